@@ -0,0 +1,114 @@
+"""benchmark de vazão do broker em função do número de shards
+
+sobe o broker (broker/main.py) como processo local, servidores de eco REP e
+clientes DEALER com várias requisições em andamento, e mede requisições/s. no modo
+sharded cada cliente conecta direto no frontend de um shard; aqui os clientes são
+repartidos igualmente (o bot escolhe pelo hash do nome, ver common/shards.py, e com
+poucos clientes o hash pode concentrar vários no mesmo shard).
+
+uso: python benchmarks/broker_shards.py [--shards 1,2,4] [--clients 8] [--requests 20000]
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import zmq
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_BASE = 5600
+FRONTEND_BASE = 5700
+
+def echo_worker(endpoints, stop):
+    """servidor de eco: responde cada requisição com o próprio payload"""
+    context = zmq.Context()
+    socket = context.socket(zmq.REP)
+    for endpoint in endpoints:
+        socket.connect(endpoint)
+    while not stop.is_set():
+        if socket.poll(100):
+            socket.send(socket.recv())
+    socket.close(0)
+    context.term()
+
+def client(endpoint, requests, window, payload_size, results):
+    """cliente com até `window` requisições em andamento"""
+    context = zmq.Context()
+    socket = context.socket(zmq.DEALER)
+    socket.connect(endpoint)
+    payload = b"x" * payload_size
+    sent = received = 0
+    start = time.perf_counter()
+    while received < requests:
+        while sent < requests and sent - received < window:
+            socket.send_multipart([b"", payload])
+            sent += 1
+        if socket.poll(5000):
+            socket.recv_multipart()
+            received += 1
+        else:
+            break
+    results.put((received, time.perf_counter() - start))
+    socket.close(0)
+    context.term()
+
+def run_scenario(mode, shards, args):
+    env = dict(os.environ, BROKER_MODE=mode, BROKER_SHARDS=str(shards),
+               BROKER_IO_THREADS=str(args.io_threads), BROKER_STATS_INTERVAL="3600",
+               BROKER_SHARD_BACKEND_BASE=str(BACKEND_BASE), BROKER_SHARD_FRONTEND_BASE=str(FRONTEND_BASE))
+    broker = subprocess.Popen([sys.executable, os.path.join(ROOT, "broker", "main.py")], env=env,
+                              stdout=subprocess.DEVNULL)
+    time.sleep(0.5)
+
+    if mode == "sharded":
+        endpoints = [f"tcp://127.0.0.1:{BACKEND_BASE + index}" for index in range(shards)]
+        frontends = [f"tcp://127.0.0.1:{FRONTEND_BASE + index % shards}" for index in range(args.clients)]
+    else:
+        endpoints = ["tcp://127.0.0.1:5556"]
+        frontends = ["tcp://127.0.0.1:5555"] * args.clients
+
+    stop = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=echo_worker, args=(endpoints, stop)) for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    time.sleep(0.5)
+
+    results = multiprocessing.Queue()
+    per_client = args.requests // args.clients
+    clients = [multiprocessing.Process(target=client, args=(frontend, per_client, args.window, args.payload, results))
+               for frontend in frontends]
+    start = time.perf_counter()
+    for proc in clients:
+        proc.start()
+    received = sum(results.get()[0] for _ in clients)
+    elapsed = time.perf_counter() - start
+    for proc in clients:
+        proc.join()
+
+    stop.set()
+    for worker in workers:
+        worker.join()
+    broker.terminate()
+    broker.wait()
+    return received, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", default="1,2,4", help="lista de quantidades de shards")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=20000, help="total de requisições por cenário")
+    parser.add_argument("--window", type=int, default=16, help="requisições em andamento por cliente")
+    parser.add_argument("--payload", type=int, default=128, help="tamanho do payload em bytes")
+    parser.add_argument("--io-threads", type=int, default=2)
+    args = parser.parse_args()
+
+    scenarios = [("proxy", 1)] + [("sharded", int(count)) for count in args.shards.split(",")]
+    print(f"{'modo':<10}{'shards':>8}{'requisições':>14}{'tempo (s)':>12}{'req/s':>12}")
+    for mode, shards in scenarios:
+        received, elapsed = run_scenario(mode, shards, args)
+        print(f"{mode:<10}{shards:>8}{received:>14}{elapsed:>12.2f}{received / elapsed:>12.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+"""benchmark do cluster inteiro numa máquina: broker, proxy, referência, N servidores e M bots de carga
+
+sobe cada componente como processo local em loopback (sem Docker), com dados num
+diretório temporário, e roda cenários roteirizados, cada um num cluster novo:
+
+- publish_burst: os bots só publicam em canais, em ritmo alto
+- dm_storm: só mensagens diretas (cada usuário simulado manda pro seguinte)
+- replica_kill: um servidor morre (SIGKILL) no primeiro terço da carga e volta no
+  segundo; mede quanto tempo leva pra responder de novo, pra receber requisições do
+  broker (modo lb) e pra alcançar o vetor de versões que os outros tinham quando voltou
+- reference_restart: a referência morre no primeiro terço e volta na metade; mede
+  quanto tempo leva pra todos os servidores aparecerem de novo na lista
+
+o relatório JSON tem, por cenário, vazão (enviadas/confirmadas/recebidas por segundo),
+erros, perdas, latência de entrega (somando os histogramas dos bots), trechos das
+requisições rastreadas, tempos de recuperação e os snapshots de métricas de broker,
+proxy e referência. com --baseline compara com um relatório anterior e sai com código 1
+se a vazão cair ou o p99 subir mais que --tolerance.
+
+com --replication-factor N as mensagens de cada canal/usuário ficam só com N servidores
+(anel de hash, ver server/hashRing.js) e, no modo lb, o broker manda cada uma pra um dono:
+rodar com 1, 2 e 3 servidores mostra se a vazão de escrita cresce com as réplicas.
+
+o servidor precisa das dependências instaladas (cd server && npm install). os logs de
+cada processo ficam em <diretório do cenário>/logs (--keep mantém o diretório).
+
+uso: python benchmarks/cluster.py [--servers 3] [--bots 2] [--duration 30] [--replication-factor 0] [--scenarios publish_burst,dm_storm,replica_kill,reference_restart] [--output cluster.json] [--baseline anterior.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import msgpack
+import zmq
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+from common.metrics import Histogram, fetch
+
+HOST = "127.0.0.1"
+SYNC_PORT_BASE = 5570  # servidor i atende a sincronização em SYNC_PORT_BASE + i
+METRICS_PORTS = {"broker": 5564, "proxy": 5565, "reference": 5566}
+SCENARIOS = ("publish_burst", "dm_storm", "replica_kill", "reference_restart")
+# fração de mensagens diretas de cada cenário (o resto são publicações em canal)
+DIRECT_FRACTION = {"publish_burst": 0, "dm_storm": 1, "replica_kill": 0.2, "reference_restart": 0.2}
+# trechos das requisições rastreadas copiados dos bots pro relatório
+TRACE_HOPS = ("rtt_us.publish", "server_us.publish", "transport_us.publish",
+              "rtt_us.message", "server_us.message", "transport_us.message", "delivery_us", "end_to_end_us")
+
+def request(endpoint, service, data, timeout=1000):
+    """uma requisição msgpack {service, data}; None se não houver resposta no prazo"""
+    context = zmq.Context.instance()
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(endpoint)
+    try:
+        socket.send(msgpack.packb({"service": service, "data": data}))
+        if not socket.poll(timeout):
+            return None
+        return msgpack.unpackb(socket.recv(), raw=False).get("data", {})
+    finally:
+        socket.close()
+
+def wait_for(condition, timeout, interval=0.2):
+    """segundos até a condição valer, ou None se o prazo acabar"""
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if condition():
+            return time.monotonic() - start
+        time.sleep(interval)
+    return None
+
+def sleep_until(instant):
+    time.sleep(max(0, instant - time.monotonic()))
+
+def covers(vector, target):
+    """se o vetor de versões já tem tudo que o alvo tem"""
+    return vector is not None and all(vector.get(origin, 0) >= seq for origin, seq in target.items())
+
+class Cluster:
+    """processos de um cenário; cada um escreve em <workdir>/logs/<nome>.log"""
+
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = workdir
+        self.processes = {}  # {nome: Popen}
+        os.makedirs(os.path.join(workdir, "logs"), exist_ok=True)
+
+    def spawn(self, name, command, env, cwd=ROOT):
+        log = open(os.path.join(self.workdir, "logs", f"{name}.log"), "ab")
+        self.processes[name] = subprocess.Popen(command, cwd=cwd, env=dict(os.environ, **env),
+                                                stdout=log, stderr=subprocess.STDOUT)
+        log.close()
+
+    def spawn_python(self, name, env):
+        self.spawn(name, [sys.executable, "-u", os.path.join(ROOT, name, "main.py")],
+                   dict(env, METRICS_ENDPOINT=f"tcp://{HOST}:{METRICS_PORTS[name]}"))
+
+    def server_name(self, index):
+        return f"bench_server_{index}"
+
+    def start_reference(self):
+        self.spawn_python("reference", {"REFERENCE_DATA_DIR": os.path.join(self.workdir, "reference")})
+
+    def start_server(self, index):
+        env = {
+            "HOSTNAME": self.server_name(index),
+            "BROKER_MODE": self.args.broker_mode,
+            "SERVER_CREDIT": str(self.args.credit),
+            "SERVER_BROKER_HOST": HOST,
+            "SERVER_PROXY_HOST": HOST,
+            "SERVER_REFERENCE_HOST": HOST,
+            "SERVER_SYNC_HOST": HOST,
+            "SERVER_SYNC_PORT": str(SYNC_PORT_BASE + index),
+            "SERVER_DATA_DIR": os.path.join(self.workdir, "data"),
+            "SERVER_REPLICATION_FACTOR": str(self.args.replication_factor),
+        }
+        self.spawn(self.server_name(index), [self.args.node, "main.py"], env, cwd=os.path.join(ROOT, "server"))
+
+    def start(self):
+        """sobe referência, proxy, broker e servidores e espera todos os servidores na lista"""
+        self.start_reference()
+        self.spawn_python("proxy", {"PROXY_MODE": self.args.proxy_mode})
+        broker_env = {"BROKER_MODE": self.args.broker_mode}
+        if self.args.replication_factor > 0:
+            broker_env.update(BROKER_RING="1", BROKER_RING_REPLICAS=str(self.args.replication_factor),
+                              BROKER_REFERENCE_ENDPOINT=f"tcp://{HOST}:5559")
+        self.spawn_python("broker", broker_env)
+        time.sleep(0.5)
+        self.check_alive()
+        for index in range(self.args.servers):
+            self.start_server(index)
+        names = {self.server_name(index) for index in range(self.args.servers)}
+        if wait_for(lambda: names <= self.listed(), self.args.startup_timeout) is None:
+            self.check_alive()
+            raise RuntimeError(f"servidores não apareceram na referência em {self.args.startup_timeout}s "
+                               f"(logs em {self.workdir}/logs)")
+        # o servidor sincroniza com os outros alguns segundos depois de subir
+        time.sleep(self.args.settle)
+
+    def start_bots(self, scenario):
+        """bots de carga; cada um grava o relatório em JSON no diretório do cenário"""
+        for index in range(self.args.bots):
+            env = {
+                "BOT_MODE": "load",
+                "BROKER_MODE": self.args.broker_mode,
+                "BOT_BROKER_ENDPOINT": f"tcp://{HOST}:5555",
+                "BOT_PROXY_ENDPOINT": f"tcp://{HOST}:5558",
+                "BOT_LOAD_USERS": str(self.args.users),
+                "BOT_LOAD_CHANNELS": str(self.args.channels),
+                "BOT_LOAD_RATE": str(self.args.rate),
+                "BOT_LOAD_MESSAGE_SIZE": str(self.args.size),
+                "BOT_LOAD_DURATION": str(self.args.duration),
+                "BOT_LOAD_DIRECT": str(DIRECT_FRACTION[scenario]),
+                "BOT_LOAD_REPORT_INTERVAL": "3600",
+                "BOT_LOAD_REPORT_FILE": self.bot_report(index),
+                "TRACE_SAMPLE": str(self.args.trace_sample),
+            }
+            self.spawn(f"bot_{index}", [sys.executable, "-u", os.path.join(ROOT, "bot", "main.py")], env)
+
+    def bot_report(self, index):
+        return os.path.join(self.workdir, f"bot_{index}.json")
+
+    def wait_bots(self, timeout):
+        deadline = time.monotonic() + timeout
+        for index in range(self.args.bots):
+            process = self.processes[f"bot_{index}"]
+            try:
+                process.wait(max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def kill(self, name):
+        """derruba o processo sem dar chance de encerrar (como uma queda)"""
+        process = self.processes.pop(name)
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+
+    def check_alive(self):
+        for name, process in self.processes.items():
+            if process.poll() is not None:
+                raise RuntimeError(f"{name} saiu com código {process.returncode} (log: {self.workdir}/logs/{name}.log)")
+
+    def listed(self):
+        """nomes dos servidores na lista da referência (vazio se ela não responder)"""
+        data = request(f"tcp://{HOST}:5559", "list", {})
+        return {entry["name"] for entry in data.get("list", [])} if data else set()
+
+    def versions(self, index):
+        """vetor de versões de um servidor, pelo socket de sincronização"""
+        data = request(f"tcp://{HOST}:{SYNC_PORT_BASE + index}", "versions", {})
+        return data.get("vector") if data else None
+
+    def caught_up(self, index, target):
+        """se o servidor já cobre o alvo nas sequências que guarda (com o anel, só as partições dele)"""
+        data = request(f"tcp://{HOST}:{SYNC_PORT_BASE + index}", "versions", {"keys": list(target)})
+        if not data:
+            return False
+        owned = data.get("owned", list(target))
+        return covers(data.get("vector"), {key: target[key] for key in owned})
+
+    def routed_to(self, index):
+        """requisições que o broker (modo lb) já encaminhou ao servidor, ou None sem métricas"""
+        try:
+            snapshot = fetch(f"tcp://{HOST}:{METRICS_PORTS['broker']}", timeout=1000)
+        except zmq.ZMQError:
+            return None
+        summary = snapshot["histograms"].get(f"service_us.{self.server_name(index)}")
+        return summary["count"] if summary else 0
+
+    def snapshots(self):
+        """métricas dos componentes Python (sem as faixas dos histogramas)"""
+        result = {}
+        for name, port in METRICS_PORTS.items():
+            try:
+                snapshot = fetch(f"tcp://{HOST}:{port}", timeout=2000)
+            except zmq.ZMQError:
+                continue
+            for summary in snapshot["histograms"].values():
+                del summary["buckets"]
+            result[name] = snapshot
+        return result
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+def replica_kill(cluster, args, started, events):
+    victim = args.servers - 1
+    name = cluster.server_name(victim)
+    sleep_until(started + args.duration / 3)
+    cluster.kill(name)
+    killed = time.monotonic()
+    events.append({"t": killed - started, "event": f"{name} derrubado"})
+
+    sleep_until(started + args.duration * 2 / 3)
+    # o que os sobreviventes tinham na volta: a réplica alcançou quando cobrir esse vetor
+    target = {}
+    for index in range(args.servers):
+        if index != victim:
+            for origin, seq in (cluster.versions(index) or {}).items():
+                target[origin] = max(target.get(origin, 0), seq)
+    routed = cluster.routed_to(victim)
+    cluster.start_server(victim)
+    restarted = time.monotonic()
+    events.append({"t": restarted - started, "event": f"{name} reiniciado"})
+
+    # a referência ainda lista o servidor morto até o timeout dela: o que conta é ele responder
+    recovery = {"down_s": restarted - killed}
+    recovery["rejoin_s"] = wait_for(lambda: cluster.versions(victim) is not None, args.recovery_timeout)
+    if args.broker_mode == "lb" and routed is not None:
+        recovery["serving_s"] = wait_for(lambda: (cluster.routed_to(victim) or 0) > routed, args.recovery_timeout)
+    recovery["catch_up_s"] = wait_for(lambda: cluster.caught_up(victim, target), args.recovery_timeout)
+    recovery["catch_up_records"] = sum(target.values())
+    return recovery
+
+def reference_restart(cluster, args, started, events):
+    sleep_until(started + args.duration / 3)
+    cluster.kill("reference")
+    killed = time.monotonic()
+    events.append({"t": killed - started, "event": "referência derrubada"})
+
+    sleep_until(started + args.duration / 2)
+    cluster.start_reference()
+    restarted = time.monotonic()
+    events.append({"t": restarted - started, "event": "referência reiniciada"})
+
+    # os servidores voltam à lista no próximo heartbeat (o registro de ranks fica em disco)
+    names = {cluster.server_name(index) for index in range(args.servers)}
+    relisted = wait_for(lambda: names <= cluster.listed(), args.recovery_timeout)
+    return {"down_s": restarted - killed, "relisted_s": relisted}
+
+ACTIONS = {"replica_kill": replica_kill, "reference_restart": reference_restart}
+
+def collect(cluster, args):
+    """soma os relatórios dos bots: contagens, vazão, latência de entrega e trechos rastreados"""
+    totals = dict.fromkeys(("sent", "acked", "errors", "busy", "received", "lost", "out_of_order", "duplicates"), 0)
+    latency = Histogram()
+    hops = {name: Histogram() for name in TRACE_HOPS}
+    elapsed = 0
+    reports = 0
+    for index in range(args.bots):
+        try:
+            with open(cluster.bot_report(index)) as source:
+                report = json.load(source)
+        except (OSError, ValueError):
+            continue
+        reports += 1
+        elapsed = max(elapsed, report["elapsed"])
+        total = report["stats"]["total"]
+        for field in totals:
+            totals[field] += total[field]
+        latency.merge(Histogram.from_summary(total["latency"]))
+        for name, summary in report["metrics"]["histograms"].items():
+            if name in hops:
+                hops[name].merge(Histogram.from_summary(summary))
+
+    result = dict(totals, bots=reports, elapsed_s=elapsed)
+    for field in ("sent", "acked", "received"):
+        result[f"{field}_per_s"] = totals[field] / elapsed if elapsed else 0
+    result["latency_ms"] = {
+        "p50": latency.percentile(0.50) / 1000, "p95": latency.percentile(0.95) / 1000,
+        "p99": latency.percentile(0.99) / 1000, "max": latency.max / 1000
+    }
+    result["trace_ms"] = {
+        name: {"count": histogram.total, "p50": histogram.percentile(0.50) / 1000, "p99": histogram.percentile(0.99) / 1000}
+        for name, histogram in hops.items() if histogram.total
+    }
+    return result
+
+def run_scenario(scenario, args):
+    workdir = tempfile.mkdtemp(prefix=f"cluster_{scenario}_", dir=args.workdir)
+    cluster = Cluster(args, workdir)
+    events = []
+    try:
+        cluster.start()
+        cluster.start_bots(scenario)
+        started = time.monotonic()
+        recovery = ACTIONS[scenario](cluster, args, started, events) if scenario in ACTIONS else {}
+        # bots: login e criação de canais, a carga, e a espera final pelas mensagens em trânsito
+        cluster.wait_bots(args.duration + 60)
+        result = collect(cluster, args)
+        result["recovery"] = recovery
+        result["events"] = events
+        result["components"] = cluster.snapshots()
+    finally:
+        cluster.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+def git_version():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_result(scenario, result):
+    latency = result["latency_ms"]
+    print(f"{scenario:<18}{result['sent_per_s']:>10.0f}{result['acked_per_s']:>10.0f}{result['received_per_s']:>10.0f}"
+          f"{result['errors']:>8}{result['lost']:>8}{latency['p50']:>9.1f}{latency['p99']:>9.1f}{latency['max']:>9.1f}")
+    for name, value in result["recovery"].items():
+        text = "não recuperou" if value is None else (f"{value:.2f}s" if name.endswith("_s") else str(value))
+        print(f"{'':<18}{name}: {text}")
+
+def compare(report, baseline, tolerance):
+    """diferenças de vazão e p99 contra um relatório anterior; devolve as regressões"""
+    regressions = []
+    print(f"\ncomparação com {baseline.get('version')} (tolerância {tolerance:.0%})")
+    for scenario, result in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(scenario)
+        if old is None:
+            continue
+        # (nome, valor antigo, valor novo, maior é melhor)
+        checks = (
+            ("received_per_s", old["received_per_s"], result["received_per_s"], True),
+            ("acked_per_s", old["acked_per_s"], result["acked_per_s"], True),
+            ("latency_ms.p99", old["latency_ms"]["p99"], result["latency_ms"]["p99"], False),
+        )
+        for name, before, after, higher_is_better in checks:
+            change = (after - before) / before if before else 0
+            worse = -change if higher_is_better else change
+            flag = " REGRESSÃO" if worse > tolerance else ""
+            print(f"  {scenario:<18}{name:<16}{before:>10.1f} -> {after:>10.1f} ({change:+.1%}){flag}")
+            if flag:
+                regressions.append((scenario, name))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--servers", type=int, default=3)
+    parser.add_argument("--bots", type=int, default=2)
+    parser.add_argument("--users", type=int, default=100, help="usuários simulados por bot")
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=5, help="envios por segundo de cada usuário")
+    parser.add_argument("--size", type=int, default=64, help="tamanho do texto de cada mensagem")
+    parser.add_argument("--duration", type=float, default=30, help="segundos de carga por cenário")
+    parser.add_argument("--broker-mode", default="lb", choices=("proxy", "lb", "sharded"))
+    parser.add_argument("--proxy-mode", default="steerable", choices=("steerable", "lvc"))
+    parser.add_argument("--credit", type=int, default=16, help="requisições em voo por servidor no modo lb")
+    parser.add_argument("--replication-factor", type=int, default=0,
+                        help="donos das mensagens de cada canal/usuário (0 = todos os servidores)")
+    parser.add_argument("--trace-sample", type=float, default=0.05)
+    parser.add_argument("--node", default="node")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--settle", type=float, default=6, help="espera depois de subir, até a primeira sincronização")
+    parser.add_argument("--recovery-timeout", type=float, default=60)
+    parser.add_argument("--workdir", default=None, help="onde criar os diretórios dos cenários (padrão: temporário)")
+    parser.add_argument("--keep", action="store_true", help="manter dados e logs dos cenários")
+    parser.add_argument("--output", default="cluster.json")
+    parser.add_argument("--baseline", help="relatório anterior pra comparar")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    scenarios = [scenario for scenario in args.scenarios.split(",") if scenario]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"cenários desconhecidos: {', '.join(sorted(unknown))}")
+    if not os.path.isdir(os.path.join(ROOT, "server", "node_modules")):
+        parser.error("dependências do servidor ausentes: rode npm install em server/")
+
+    report = {
+        "version": git_version(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": vars(args),
+        "scenarios": {}
+    }
+    print(f"{args.servers} servidores, {args.bots} bots x {args.users} usuários a {args.rate}/s, {args.duration}s por cenário")
+    print(f"{'cenário':<18}{'env./s':>10}{'conf./s':>10}{'receb./s':>10}{'erros':>8}{'perdas':>8}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'máx ms':>9}")
+    for scenario in scenarios:
+        result = run_scenario(scenario, args)
+        report["scenarios"][scenario] = result
+        print_result(scenario, result)
+
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"relatório em {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as source:
+            regressions = compare(report, json.load(source), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
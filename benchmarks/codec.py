@@ -0,0 +1,75 @@
+"""benchmark do codec compartilhado (common/codec.py) contra o código anterior
+
+compara o custo por mensagem de codificar e decodificar uma requisição típica do
+bot: msgpack.packb/unpackb com dict novo a cada chamada (e json.dumps do log
+antigo do servidor de referência) contra Codec.encode/decode com packer e
+unpacker reaproveitados.
+
+uso: python benchmarks/codec.py [--messages 100000] [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import msgpack
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+from common.codec import Codec
+
+def sample_data(index):
+    """dados de um publish como os que o bot envia"""
+    return {
+        "user": "bot_1234",
+        "channel": "canal_123",
+        "message": f"Mensagem automática do bot ({index % 10 + 1}/10)",
+        "timestamp": 1700000000000 + index,
+        "clock": index
+    }
+
+def measure(function, count, runs):
+    """tempo médio (ns) por mensagem de cada rodada"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for index in range(count):
+            function(index)
+        timings.append((time.perf_counter() - start) * 1e9 / count)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    codec = Codec()
+    datas = [sample_data(index) for index in range(1000)]
+    payloads = [msgpack.packb({"service": "publish", "data": data}) for data in datas]
+    assert codec.decode(payloads[0]).data == datas[0]
+
+    def old_decode(index):
+        data = msgpack.unpackb(payloads[index % 1000], raw=False)
+        return data.get("service"), data.get("data", {})
+
+    def new_decode(index):
+        envelope = codec.decode(payloads[index % 1000])
+        return envelope.service, envelope.data
+
+    cases = (
+        ("encode packb", lambda index: msgpack.packb({"service": "publish", "data": datas[index % 1000]})),
+        ("encode codec", lambda index: codec.encode("publish", datas[index % 1000])),
+        ("encode json (log)", lambda index: json.dumps({"service": "publish", "data": datas[index % 1000]})),
+        ("decode unpackb", old_decode),
+        ("decode codec", new_decode),
+    )
+
+    print(f"{'caso':<20}{'mensagens':>10}{'mediana (ns)':>15}{'melhor (ns)':>14}")
+    for label, function in cases:
+        timings = measure(function, args.messages, args.runs)
+        print(f"{label:<20}{args.messages:>10}{statistics.median(timings):>15.0f}{min(timings):>14.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""benchmark do frame das publicações (common/frame.py) contra o envelope msgpack anterior
+
+mede o custo por mensagem de quem assina publicações, como o bot de carga: decodificar
+o envelope inteiro pra descobrir o canal, ler só o cabeçalho do frame (publicação de
+um canal que não interessa) e cabeçalho + corpo por memoryview. do lado de quem
+publica, compara codificar a mensagem duas vezes (registro replicado e publicação)
+com montar o frame uma vez. por último, receber pelo zmq (inproc) com cópia e com
+copy=False, pra ver se o zmq.Frame compensa no tamanho das mensagens do chat.
+
+uso: python benchmarks/frames.py [--messages 100000] [--runs 5] [--sizes 64,512,4096]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import msgpack
+import zmq
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+from common import frame as wire
+from common.metrics import traced
+
+def sample_data(index, size):
+    """dados de uma publicação como as do bot de carga, com o texto completado até `size` bytes"""
+    text = f"#{index}@{1700000000000000 + index} "
+    return {
+        "user": "load_1234_7",
+        "channel": f"load_{index % 4}",
+        "message": text + "x" * max(0, size - len(text)),
+        "timestamp": 1700000000000 + index,
+        "clock": index
+    }
+
+def envelope(data):
+    """publicação no formato anterior"""
+    return msgpack.packb({"service": "publish", "data": data})
+
+def frame(data, seq):
+    """publicação no formato de frame"""
+    return wire.encode(wire.PUBLISH, f"#{data['channel']}", data["clock"], seq, data)
+
+def measure(function, count, runs):
+    """tempo médio (ns) por mensagem de cada rodada"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for index in range(count):
+            function(index)
+        timings.append((time.perf_counter() - start) * 1e9 / count)
+    return timings
+
+def measure_recv(payloads, count, runs, copy):
+    """tempo médio (ns) por mensagem pra receber [tópico, payload] e ler o cabeçalho"""
+    context = zmq.Context()
+    push = context.socket(zmq.PUSH)
+    pull = context.socket(zmq.PULL)
+    push.setsockopt(zmq.SNDHWM, 0)
+    pull.setsockopt(zmq.RCVHWM, 0)
+    push.bind("inproc://frames")
+    pull.connect("inproc://frames")
+    timings = []
+    try:
+        for _ in range(runs):
+            for index in range(count):
+                push.send_multipart([b"#load_0", payloads[index % len(payloads)]])
+            start = time.perf_counter()
+            for _ in range(count):
+                frames = pull.recv_multipart(copy=copy)
+                payload = frames[-1] if copy else frames[-1].buffer
+                wire.header(payload)
+            timings.append((time.perf_counter() - start) * 1e9 / count)
+    finally:
+        push.close(0)
+        pull.close(0)
+        context.term()
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--sizes", default="64,512,4096", help="tamanhos do texto das mensagens (bytes)")
+    args = parser.parse_args()
+
+    print(f"{'caso':<32}{'tamanho':>8}{'mensagens':>10}{'mediana (ns)':>15}{'melhor (ns)':>14}")
+    for size in (int(value) for value in args.sizes.split(",")):
+        datas = [sample_data(index, size) for index in range(1000)]
+        envelopes = [envelope(data) for data in datas]
+        frames = [frame(data, index) for index, data in enumerate(datas)]
+        assert wire.decode(frames[0])["data"] == datas[0]
+
+        def old_decode(index):
+            # o bot decodificava tudo pra achar o canal, e o traced() procurava o marcador antes
+            payload = envelopes[index % 1000]
+            traced(payload)
+            message = msgpack.unpackb(payload, raw=False)
+            return message.get("data", {}).get("channel")
+
+        def header_only(index):
+            return wire.header(frames[index % 1000])[2]
+
+        def header_body(index):
+            payload = frames[index % 1000]
+            _, _, channel, _, _, length = wire.header(payload)
+            return channel, wire.body(payload, length)
+
+        def encode_twice(index):
+            data = datas[index % 1000]
+            record = dict(data, type="publish", origin="server_a", seq=index)
+            return msgpack.packb({"kind": "message", "payload": record}), envelope(data)
+
+        def encode_frame(index):
+            return frame(datas[index % 1000], index)
+
+        cases = (
+            ("encode 2x (replicação + pub)", encode_twice),
+            ("encode frame", encode_frame),
+            ("decode envelope", old_decode),
+            ("decode só cabeçalho", header_only),
+            ("decode cabeçalho + corpo", header_body),
+        )
+        for label, function in cases:
+            timings = measure(function, args.messages, args.runs)
+            print(f"{label:<32}{size:>8}{args.messages:>10}{statistics.median(timings):>15.0f}{min(timings):>14.0f}")
+        for label, copy in (("recv + cabeçalho (cópia)", True), ("recv + cabeçalho (copy=False)", False)):
+            timings = measure_recv(frames, args.messages, args.runs, copy)
+            print(f"{label:<32}{size:>8}{args.messages:>10}{statistics.median(timings):>15.0f}{min(timings):>14.0f}")
+
+if __name__ == "__main__":
+    main()
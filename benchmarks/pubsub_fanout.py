@@ -0,0 +1,171 @@
+"""benchmark da carga de cada assinante do pub/sub: tudo num XPUB vs tópicos separados
+
+sobe o proxy (proxy/main.py) como processo local, um publicador que imita os
+servidores (publicações em canais, mensagens diretas, lotes de replicação e
+anúncios de relógio) e assinantes em processos separados que, como o bot,
+decodificam cada mensagem recebida. mede por assinante mensagens, bytes e tempo
+de CPU gasto recebendo.
+
+- firehose: tudo sai pelo XPUB dos clientes e cada assinante se inscreve em ""
+- partitioned: servers/replication vão pelo plano interno e cada assinante se
+  inscreve só em @próprio_usuário e #um_canal
+
+uso: python benchmarks/pubsub_fanout.py [--subscribers 10] [--messages 10000] [--rate 2000]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+import msgpack
+import zmq
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+from common.topics import channel_topic, user_topic
+
+END = b"END"
+
+def subscriber(index, channel, firehose, results):
+    """assinante: recebe até o marcador de fim no próprio tópico e reporta a carga"""
+    context = zmq.Context()
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.RCVHWM, 0)
+    socket.connect("tcp://127.0.0.1:5558")
+    own = user_topic(f"sub_{index}")
+    # nos dois modos interessam as mensagens diretas pro assinante e as do seu canal
+    wanted = {own.encode(), channel.encode()}
+    for topic in ([""] if firehose else [own, channel]):
+        socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+    own = own.encode()
+
+    received = size = relevant = 0
+    cpu_start = time.process_time()
+    while True:
+        frames = socket.recv_multipart()
+        if frames[-1] == END:
+            if frames[0] == own:
+                break
+            continue  # fim de outro assinante (só chega no firehose)
+        received += 1
+        size += sum(len(frame) for frame in frames)
+        # como o bot: decodifica e só então decide se a mensagem interessa
+        message = msgpack.unpackb(frames[-1], raw=False)
+        if frames[0] in wanted and message.get("service") in ("publish", "message"):
+            relevant += 1
+    results.put((index, received, size, relevant, time.process_time() - cpu_start))
+    socket.close(0)
+    context.term()
+
+def chat_payload(index, channel, size):
+    """publicação como a que o servidor envia no tópico do canal"""
+    return msgpack.packb({"service": "publish", "data": {
+        "user": f"user_{index % 97}", "channel": channel, "message": "x" * size,
+        "timestamp": 1700000000000 + index, "clock": index
+    }})
+
+def replication_payload(index, channel, size):
+    """lote de replicação com um registro (o que os outros servidores recebem)"""
+    record = {"type": "publish", "user": f"user_{index % 97}", "channel": channel, "message": "x" * size,
+              "timestamp": 1700000000000 + index, "clock": index, "origin": "server_a", "seq": index}
+    return msgpack.packb({"originServer": "server_a", "dataType": "batch", "payload": {
+        "origin": "server_a", "first": index, "last": index, "records": [{"kind": "message", "payload": record}]
+    }, "timestamp": 1700000000, "clock": index})
+
+def run_scenario(mode, args):
+    env = dict(os.environ, PROXY_STATS="0", PROXY_CONTROL_ENDPOINT="tcp://127.0.0.1:5560")
+    proxy = subprocess.Popen([sys.executable, os.path.join(ROOT, "proxy", "main.py")], env=env,
+                             stdout=subprocess.DEVNULL)
+    context = zmq.Context()
+    chat = context.socket(zmq.PUB)
+    chat.setsockopt(zmq.SNDHWM, 0)
+    chat.connect("tcp://127.0.0.1:5557")
+    internal = chat
+    if mode == "partitioned":
+        internal = context.socket(zmq.PUB)
+        internal.setsockopt(zmq.SNDHWM, 0)
+        internal.connect("tcp://127.0.0.1:5562")
+
+    channels = [channel_topic(f"load_{index}") for index in range(args.channels)]
+    results = multiprocessing.Queue()
+    processes = []
+    for index in range(args.subscribers):
+        channel = channels[index % len(channels)]
+        process = multiprocessing.Process(target=subscriber, args=(index, channel, mode == "firehose", results))
+        process.start()
+        processes.append(process)
+
+    try:
+        # tempo pras inscrições chegarem ao proxy
+        time.sleep(1.5)
+        rng = random.Random(1)
+        interval = 1 / args.rate
+        next_send = time.perf_counter()
+        for index in range(args.messages):
+            if rng.random() < args.direct:
+                # mensagem direta pra um usuário qualquer (alguns são os assinantes)
+                target = rng.randrange(args.users)
+                topic = user_topic(f"sub_{target}" if target < args.subscribers else f"user_{target}")
+                payload = msgpack.packb({"service": "message", "data": {
+                    "src": "user_1", "dst": topic[1:], "message": "x" * args.size,
+                    "timestamp": 1700000000000 + index, "clock": index}})
+            else:
+                topic = channels[index % len(channels)]
+                payload = chat_payload(index, topic[1:], args.size)
+            chat.send_multipart([topic.encode(), payload])
+            internal.send_multipart([b"replication", replication_payload(index, topic[1:], args.size)])
+            if index % 100 == 0:
+                internal.send_multipart([b"servers", msgpack.packb({"service": "clock", "data": {"round": index}})])
+
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        time.sleep(0.5)
+        for index in range(args.subscribers):
+            chat.send_multipart([user_topic(f"sub_{index}").encode(), END])
+
+        rows = [results.get(timeout=60) for _ in processes]
+    finally:
+        for process in processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        chat.close(0)
+        if internal is not chat:
+            internal.close(0)
+        context.term()
+        proxy.terminate()
+        proxy.wait()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=10)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--users", type=int, default=200, help="destinatários possíveis das mensagens diretas")
+    parser.add_argument("--messages", type=int, default=10000, help="mensagens de chat publicadas (cada uma gera um lote de replicação)")
+    parser.add_argument("--rate", type=float, default=2000, help="mensagens de chat por segundo")
+    parser.add_argument("--direct", type=float, default=0.2, help="fração de mensagens diretas")
+    parser.add_argument("--size", type=int, default=64, help="tamanho do texto de cada mensagem")
+    parser.add_argument("--modes", default="firehose,partitioned")
+    args = parser.parse_args()
+
+    print(f"{args.subscribers} assinantes, {args.messages} mensagens de chat a {args.rate:.0f}/s "
+          f"({args.channels} canais, {args.direct:.0%} diretas) + replicação")
+    print(f"{'modo':<12}{'msgs/assin.':>13}{'KB/assin.':>11}{'úteis':>8}{'CPU ms/assin.':>15}{'µs CPU/útil':>13}")
+    for mode in args.modes.split(","):
+        rows = run_scenario(mode, args)
+        count = len(rows)
+        received = sum(row[1] for row in rows) / count
+        size = sum(row[2] for row in rows) / count
+        relevant = sum(row[3] for row in rows) / count
+        cpu = sum(row[4] for row in rows) / count
+        print(f"{mode:<12}{received:>13.0f}{size / 1024:>11.0f}{relevant:>8.0f}{cpu * 1000:>15.1f}"
+              f"{cpu * 1e6 / max(relevant, 1):>13.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""benchmark de inicialização do registro persistente de ranks do servidor de referência
+
+gera um log com N nomes registrados e mede quanto tempo o RankRegistry leva pra
+reaplicar o log e, depois da compactação, pra carregar o snapshot.
+
+uso: python benchmarks/reference_registry.py [--names 10000] [--runs 5]
+"""
+import argparse
+import importlib.util
+import os
+import statistics
+import tempfile
+import time
+import zlib
+import msgpack
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_reference():
+    """importa reference/main.py sem executar o servidor"""
+    spec = importlib.util.spec_from_file_location("reference_main", os.path.join(ROOT, "reference", "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def write_log(reference, directory, names):
+    """grava o log direto, no mesmo formato do RankRegistry (sem fsync por registro)"""
+    with open(os.path.join(directory, "ranks.log"), "wb") as log:
+        for rank, server_name in enumerate(names, start=1):
+            payload = msgpack.packb([server_name, rank])
+            log.write(reference.RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+
+def measure(reference, directory, runs):
+    """tempo (ms) de cada inicialização do registro"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        registry = reference.RankRegistry(directory, compact_every=float("inf"))
+        timings.append((time.perf_counter() - start) * 1000)
+        registry.close()
+    return timings, registry
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--names", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    reference = load_reference()
+    names = [f"server-{index:012x}" for index in range(args.names)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_log(reference, directory, names)
+        log_timings, registry = measure(reference, directory, args.runs)
+        assert registry.ranks[names[-1]] == args.names
+
+        registry = reference.RankRegistry(directory, compact_every=float("inf"))
+        registry.compact()
+        registry.close()
+        snapshot_timings, registry = measure(reference, directory, args.runs)
+        assert registry.ranks[names[-1]] == args.names
+
+        print(f"{'origem':<12}{'nomes':>8}{'mediana (ms)':>15}{'melhor (ms)':>14}")
+        for label, timings in (("log", log_timings), ("snapshot", snapshot_timings)):
+            print(f"{label:<12}{args.names:>8}{statistics.median(timings):>15.2f}{min(timings):>14.2f}")
+
+if __name__ == "__main__":
+    main()
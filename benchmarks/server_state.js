@@ -0,0 +1,81 @@
+// benchmark da mescla de mensagens do sync: arrays com findIndex + sort (código anterior)
+// contra o ChatState (conjunto de chaves + histórico por canal ordenado por clock)
+//
+// uso: node benchmarks/server_state.js [--messages 100000] [--legacy-max 20000] [--channels 50]
+const path = require('path');
+const { ChatState } = require(path.join(__dirname, '..', 'server', 'chatState'));
+
+function option(name, fallback) {
+    const index = process.argv.indexOf(`--${name}`);
+    return index >= 0 ? parseInt(process.argv[index + 1]) : fallback;
+}
+
+function makeMessages(count, channels, offset) {
+    // mensagens de vários servidores: clocks intercalados, como chegam num sync
+    const messages = [];
+    for (let i = 0; i < count; i++) {
+        const clock = offset + i * 2 + (i % 3);
+        messages.push({
+            type: "publish",
+            user: `user_${i % 200}`,
+            channel: `canal_${i % channels}`,
+            message: `mensagem ${i}`,
+            timestamp: 1700000000000 + clock,
+            clock: clock
+        });
+    }
+    return messages;
+}
+
+function legacyMerge(existing, incoming) {
+    // cópia da mescla anterior de applyReplication('sync')
+    const messages = existing.slice();
+    incoming.forEach(message => {
+        const existingIndex = messages.findIndex(m =>
+            m.type === message.type &&
+            m.timestamp === message.timestamp &&
+            m.clock === message.clock &&
+            ((m.user === message.user && m.channel === message.channel) ||
+             (m.src === message.src && m.dst === message.dst))
+        );
+        if (existingIndex < 0) {
+            messages.push(message);
+        }
+    });
+    messages.sort((a, b) => a.clock - b.clock);
+    return messages;
+}
+
+function stateMerge(existing, incoming) {
+    const state = new ChatState();
+    state.mergeMessages(existing);
+    const started = process.hrtime.bigint();
+    state.mergeMessages(incoming);
+    return Number(process.hrtime.bigint() - started) / 1e6;
+}
+
+function measure(count, channels, legacyMax) {
+    // metade já está no servidor; o sync traz tudo (metade duplicada, metade nova)
+    const existing = makeMessages(count / 2, channels, 0);
+    const incoming = existing.concat(makeMessages(count / 2, channels, 1));
+    
+    const stateMs = stateMerge(existing, incoming);
+    let legacyMs = null;
+    if (count <= legacyMax) {
+        const started = process.hrtime.bigint();
+        legacyMerge(existing, incoming);
+        legacyMs = Number(process.hrtime.bigint() - started) / 1e6;
+    }
+    const legacy = legacyMs === null ? "(pulado)" : legacyMs.toFixed(1);
+    console.log(`${String(count).padStart(10)}${legacy.padStart(16)}${stateMs.toFixed(1).padStart(16)}`);
+}
+
+const total = option("messages", 100000);
+const legacyMax = option("legacy-max", 20000);
+const channels = option("channels", 50);
+console.log(`${"mensagens".padStart(10)}${"arrays (ms)".padStart(16)}${"ChatState (ms)".padStart(16)}`);
+for (const count of [1000, 10000, 20000, total]) {
+    if (count <= total) {
+        measure(count, channels, legacyMax);
+    }
+}
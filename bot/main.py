@@ -1,29 +1,235 @@
 import zmq
-import json
+import zmq.asyncio
+import os
+import sys
 import time
+import struct
+import asyncio
 import threading
 import random
-import msgpack
 import re
+import json
+from collections import deque
 from datetime import datetime
 
+# no container o codec é montado em /app/common; rodando direto do repositório ele fica um nível acima
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.codec import Codec, CodecError
+from common.topics import channel_topic, user_topic, topic_name
+from common.metrics import Histogram, Metrics, new_trace, now_us
+from common.flow import configure, is_busy
+from common.shards import broker_endpoint
+from common import frame as wire
+
+# demo (um bot conversando) ou load (vários usuários simulados gerando carga)
+BOT_MODE = os.environ.get("BOT_MODE", "demo")
+BROKER_ENDPOINT = os.environ.get("BOT_BROKER_ENDPOINT", "tcp://broker:5555")
+PROXY_ENDPOINT = os.environ.get("BOT_PROXY_ENDPOINT", "tcp://proxy:5558")
+# requisições em voo por bot (1 = uma por vez, como o REQ)
+MAX_INFLIGHT = int(os.environ.get("BOT_MAX_INFLIGHT", "10"))
+# prazo de cada tentativa e quantas vezes reenviar antes de desistir
+REQUEST_TIMEOUT = float(os.environ.get("BOT_REQUEST_TIMEOUT", "5"))
+REQUEST_RETRIES = int(os.environ.get("BOT_REQUEST_RETRIES", "2"))
+# só esses serviços são reenviados: o servidor não deduplica, e reenviar publish/message
+# pode gravar a mesma mensagem duas vezes
+IDEMPOTENT_SERVICES = frozenset(("login", "users", "channels", "history"))
+# exibir só uma a cada N mensagens recebidas (a verificação de ordem vale pra todas)
+PRINT_EVERY = max(1, int(os.environ.get("BOT_PRINT_EVERY", "1")))
+# mensagens drenadas do SUB por volta do poller e espera máxima do poll (ms)
+SUB_RECV_BATCH = 256
+SUB_POLL_TIMEOUT = 1000
+# mensagens por página do serviço history
+HISTORY_PAGE = int(os.environ.get("BOT_HISTORY_PAGE", "50"))
+# publicações da rajada numerada em voo ao mesmo tempo (no máximo BOT_MAX_INFLIGHT). as
+# confirmações são lidas na ordem de envio, casadas pela correlação; já a ordem de entrega só é
+# garantida com 1 (cada publicação espera a anterior), porque com mais de um servidor atendendo
+# o canal publicações em voo juntas podem sair fora de ordem e a verificação de ordem avisa
+BURST_INFLIGHT = max(1, min(MAX_INFLIGHT, int(os.environ.get("BOT_BURST_INFLIGHT", str(MAX_INFLIGHT)))))
+# com resposta "ocupado" a pausa entre rajadas dobra, até esse múltiplo da pausa normal
+BUSY_BACKOFF_MAX = float(os.environ.get("BOT_BUSY_BACKOFF_MAX", "8"))
+# número da mensagem dentro da rajada: "texto (X/10)"
+NUMBERED_MESSAGE = re.compile(r'\((\d+)/10\)')
+# parâmetros do modo load
+LOAD_USERS = int(os.environ.get("BOT_LOAD_USERS", "200"))
+LOAD_CHANNELS = int(os.environ.get("BOT_LOAD_CHANNELS", "10"))
+# publicações por segundo de cada usuário simulado
+LOAD_RATE = float(os.environ.get("BOT_LOAD_RATE", "1"))
+# com resposta "ocupado" o ritmo do usuário cai pela metade (até LOAD_MIN_RATE) e volta
+# LOAD_RATE/10 a cada publicação confirmada
+LOAD_MIN_RATE = float(os.environ.get("BOT_LOAD_MIN_RATE", "0.1"))
+# tamanho aproximado do texto de cada mensagem (bytes)
+LOAD_MESSAGE_SIZE = int(os.environ.get("BOT_LOAD_MESSAGE_SIZE", "64"))
+LOAD_DURATION = float(os.environ.get("BOT_LOAD_DURATION", "60"))
+# espera depois da última publicação pelas mensagens ainda em trânsito
+LOAD_DRAIN = float(os.environ.get("BOT_LOAD_DRAIN", "2"))
+# tempo máximo por requisição antes de descartar o socket REQ
+LOAD_TIMEOUT = float(os.environ.get("BOT_LOAD_TIMEOUT", "5"))
+LOAD_REPORT_INTERVAL = float(os.environ.get("BOT_LOAD_REPORT_INTERVAL", "5"))
+# cada usuário lê uma página do histórico do canal a cada N publicações (0 = não lê)
+LOAD_HISTORY_EVERY = int(os.environ.get("BOT_LOAD_HISTORY_EVERY", "0"))
+# fração dos envios que são mensagens diretas pro usuário seguinte (0 = só publicações em canal)
+LOAD_DIRECT = float(os.environ.get("BOT_LOAD_DIRECT", "0"))
+# arquivo JSON com o relatório final (pra ferramentas como benchmarks/cluster.py)
+LOAD_REPORT_FILE = os.environ.get("BOT_LOAD_REPORT_FILE", "")
+# assinante atrasado mais que isso (segundos entre o envio e a recepção) refaz o SUB e descarta
+# a fila acumulada, em vez de travar o tópico no proxy (0 = nunca)
+LOAD_MAX_LAG = float(os.environ.get("BOT_LOAD_MAX_LAG", "0"))
+
+class RequestTimeout(Exception):
+    """requisição sem resposta depois de todas as tentativas"""
+
+def record_response(metrics, service, response):
+    """requisição rastreada: ida e volta e tempo gasto no servidor (o resto é broker + rede)"""
+    trace = response.trace
+    if not isinstance(trace, dict) or "sent" not in trace:
+        return
+    rtt = now_us() - trace["sent"]
+    metrics.observe(f"rtt_us.{service}", rtt)
+    if "server_us" in trace:
+        metrics.observe(f"server_us.{service}", trace["server_us"])
+        metrics.observe(f"transport_us.{service}", rtt - trace["server_us"])
+
+def record_delivery(metrics, message):
+    """publicação rastreada: servidor -> assinante e envio da requisição -> assinante"""
+    trace = message.get("trace")
+    if not isinstance(trace, dict) or "pub" not in trace:
+        return
+    now = now_us()
+    metrics.observe("delivery_us", now - trace["pub"])
+    metrics.observe("end_to_end_us", now - trace["sent"])
+
+class PendingRequest:
+    __slots__ = ("correlation", "service", "frames", "deadline", "attempts", "response", "error", "traced")
+    
+    def __init__(self, correlation, service, frames, deadline, traced):
+        self.correlation = correlation
+        self.service = service
+        self.frames = frames
+        self.deadline = deadline
+        self.traced = traced
+        self.attempts = 1
+        self.response = None
+        self.error = None
+    
+    @property
+    def done(self):
+        return self.response is not None or self.error is not None
+
+class PipelinedClient:
+    """cliente DEALER: várias requisições em voo, respostas casadas pela id de correlação do envelope
+    
+    cada requisição vai como [correlação, b"", payload]; o broker e o servidor devolvem o
+    envelope inteiro, então a resposta volta como [correlação, b"", resposta]. não é
+    thread-safe: só a thread que envia deve chamar submit/wait.
+    """
+    
+    def __init__(self, context, endpoint, codec, metrics, max_inflight=MAX_INFLIGHT, timeout=REQUEST_TIMEOUT, retries=REQUEST_RETRIES):
+        self.socket = configure(context.socket(zmq.DEALER), "BOT_REQ", linger=0)
+        self.socket.connect(endpoint)
+        self.codec = codec
+        self.metrics = metrics
+        self.max_inflight = max(1, max_inflight)
+        self.timeout = timeout
+        self.retries = retries
+        self.pending = {}  # {correlação: PendingRequest}
+        self.next_id = 0
+    
+    def submit(self, service, data):
+        """envia sem esperar a resposta; só bloqueia se a janela de requisições estiver cheia"""
+        while len(self.pending) >= self.max_inflight:
+            self.poll()
+        
+        self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+        correlation = struct.pack(">I", self.next_id)
+        trace = new_trace()
+        request = PendingRequest(correlation, service, [correlation, b"", self.codec.encode(service, data, trace)],
+                                 time.monotonic() + self.timeout, trace is not None)
+        self.pending[correlation] = request
+        self.socket.send_multipart(request.frames)
+        return request
+    
+    def poll(self):
+        """espera a próxima resposta ou o próximo prazo; reenvia ou desiste das requisições vencidas"""
+        deadline = min(request.deadline for request in self.pending.values())
+        if self.socket.poll(max(0, deadline - time.monotonic()) * 1000):
+            while True:
+                try:
+                    frames = self.socket.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                # respostas atrasadas de uma tentativa anterior (ou de requisição já desistida) são ignoradas
+                request = self.pending.pop(frames[0], None)
+                if request is None:
+                    continue
+                try:
+                    request.response = self.codec.decode(frames[-1])
+                except CodecError as e:
+                    request.error = e
+                    continue
+                if request.traced:
+                    record_response(self.metrics, request.service, request.response)
+                if is_busy(request.response.data):
+                    self.metrics.count(f"busy.{request.service}")
+        
+        now = time.monotonic()
+        for request in [request for request in self.pending.values() if request.deadline <= now]:
+            if request.attempts > self.retries or request.service not in IDEMPOTENT_SERVICES:
+                del self.pending[request.correlation]
+                self.metrics.count(f"timeouts.{request.service}")
+                request.error = RequestTimeout(f"Sem resposta após {request.attempts} tentativas")
+                continue
+            # mesma correlação: vale a primeira resposta que chegar
+            request.attempts += 1
+            request.deadline = now + self.timeout
+            self.metrics.count(f"retries.{request.service}")
+            self.socket.send_multipart(request.frames)
+    
+    def wait(self, request):
+        """bloqueia até a resposta da requisição (ou RequestTimeout)"""
+        while not request.done:
+            self.poll()
+        if request.error is not None:
+            raise request.error
+        return request.response
+    
+    def call(self, service, data):
+        """envia e espera a resposta"""
+        return self.wait(self.submit(service, data))
+    
+    def close(self):
+        self.socket.close()
+
 class Bot:
     def __init__(self):
         self.context = zmq.Context()
         
-        # socket req pra comunicação com servidor
-        self.req_socket = self.context.socket(zmq.REQ)
-        self.req_socket.connect("tcp://broker:5555")
+        # codec das requisições (loop principal); a thread de escuta lê as publicações com common/frame.py
+        self.req_codec = Codec()
         
-        # socket sub pra receber mensagens
-        self.sub_socket = self.context.socket(zmq.SUB)
-        self.sub_socket.connect("tcp://proxy:5558")
-        self.sub_socket.setsockopt_string(zmq.SUBSCRIBE, "")
+        # latências das requisições e publicações rastreadas (ver common/metrics.py)
+        self.metrics = Metrics("bot")
+        self.metrics.start(self.context)
+        
+        # nome aleatório do bot (também escolhe o shard do broker no modo sharded)
+        self.bot_name = f"bot_{random.randint(1000, 9999)}"
+        
+        # cliente DEALER pra comunicação com servidor (várias requisições em voo)
+        self.client = PipelinedClient(self.context, broker_endpoint(BROKER_ENDPOINT, self.bot_name), self.req_codec, self.metrics)
+        
+        # socket sub pra receber mensagens: só o próprio usuário e os canais em que entrar
+        self.sub_socket = configure(self.context.socket(zmq.SUB), "BOT_SUB")
+        self.sub_socket.connect(PROXY_ENDPOINT)
         
         self.username = None
+        self.backoff = 1  # multiplicador da pausa entre rajadas (cresce com respostas "ocupado")
         self.running = True
+        self.listen_thread = None
         self.logical_clock = 0
-        self.received_messages = []  # lista pra verificar ordem das mensagens
+        self.last_seen = {}  # {(canal, remetente): último número X/10} pra verificar ordem das mensagens
+        self.received_count = 0
+        # cache da última hora formatada (segundo, texto)
+        self.formatted_second = None
+        self.formatted_time = None
         
         # mensagens pré-definidas
         self.messages = [
@@ -50,44 +256,41 @@ class Bot:
         """atualiza o relógio lógico"""
         self.logical_clock = max(self.logical_clock, received_clock) + 1
     
+    def request(self, service, data):
+        """envia uma requisição ao servidor e devolve o envelope da resposta"""
+        return self.complete(self.client.submit(service, data))
+    
+    def complete(self, request):
+        """espera a resposta de uma requisição já enviada"""
+        response = self.client.wait(request)
+        
+        # atualizar relógio lógico
+        if "clock" in response.data:
+            self.update_clock(response.data["clock"])
+        
+        return response
+    
     def login(self, username):
         """realiza login do usuário"""
         try:
             # usar timestamp em milissegundos
             current_time = int(time.time() * 1000)
-            message = {
-                "service": "login",
-                "data": {
+            try:
+                response = self.request("login", {
                     "user": username,
                     "timestamp": current_time,
                     "clock": self.increment_clock()
-                }
-            }
-            
-            self.req_socket.send(msgpack.packb(message))
-            response = self.req_socket.recv()
-            
-            try:
-                response_data = msgpack.unpackb(response, raw=False)
-            except Exception as e:
-                print(f"Erro ao decodificar resposta: {e}")
-                return False
-            
-            # verificar estrutura da resposta
-            if "data" not in response_data:
-                print(f"Erro no login do bot: Formato de mensagem inválido - resposta: {response_data}")
+                })
+            except (CodecError, RequestTimeout) as e:
+                print(f"Erro no login do bot: {e}")
                 return False
             
-            # atualizar relógio lógico
-            if "clock" in response_data.get("data", {}):
-                self.update_clock(response_data["data"]["clock"])
-            
-            if response_data.get("data", {}).get("status") == "sucesso":
+            if response.data.get("status") == "sucesso":
                 self.username = username
                 print(f"Bot logado: {username}")
                 return True
             else:
-                error_msg = response_data.get("data", {}).get("description", "Erro desconhecido")
+                error_msg = response.data.get("description", "Erro desconhecido")
                 print(f"Erro no login do bot: {error_msg}")
                 return False
         except Exception as e:
@@ -97,151 +300,179 @@ class Bot:
     def list_channels(self):
         """lista canais disponíveis"""
         current_time = int(time.time() * 1000)
-        message = {
-            "service": "channels",
-            "data": {
-                "timestamp": current_time,
-                "clock": self.increment_clock()
-            }
-        }
+        response = self.request("channels", {
+            "timestamp": current_time,
+            "clock": self.increment_clock()
+        })
         
-        self.req_socket.send(msgpack.packb(message))
-        response = self.req_socket.recv()
-        response_data = msgpack.unpackb(response, raw=False)
-        
-        # atualizar relógio lógico
-        if "clock" in response_data["data"]:
-            self.update_clock(response_data["data"]["clock"])
-        
-        return response_data["data"]["channels"]
+        return response.data["channels"]
     
     def create_channel(self, channel_name):
         """cria um novo canal"""
         current_time = int(time.time() * 1000)
-        message = {
-            "service": "channel",
-            "data": {
-                "channel": channel_name,
-                "timestamp": current_time,
-                "clock": self.increment_clock()
-            }
-        }
+        response = self.request("channel", {
+            "channel": channel_name,
+            "timestamp": current_time,
+            "clock": self.increment_clock()
+        })
         
-        self.req_socket.send(msgpack.packb(message))
-        response = self.req_socket.recv()
-        response_data = msgpack.unpackb(response, raw=False)
-        
-        # atualizar relógio lógico
-        if "clock" in response_data["data"]:
-            self.update_clock(response_data["data"]["clock"])
+        return response.data["status"] == "sucesso"
+    
+    def history(self, channel=None, user=None, cursor=None, limit=HISTORY_PAGE):
+        """lê uma página do histórico de um canal ou das mensagens diretas de um usuário; devolve (mensagens, próximo cursor)"""
+        data = {
+            "limit": limit,
+            "timestamp": int(time.time() * 1000),
+            "clock": self.increment_clock()
+        }
+        if channel is not None:
+            data["channel"] = channel
+        if user is not None:
+            data["user"] = user
+        if cursor is not None:
+            data["cursor"] = cursor
+        response = self.request("history", data)
         
-        return response_data["data"]["status"] == "sucesso"
+        return response.data.get("messages", []), response.data.get("next")
     
-    def publish_message(self, channel, message):
-        """publica mensagem em canal"""
+    def submit_publish(self, channel, message):
+        """envia publicação sem esperar a resposta; devolve a requisição e o timestamp usado"""
         # usar timestamp em milissegundos pra maior precisão
         current_time = int(time.time() * 1000)
-        req_message = {
-            "service": "publish",
-            "data": {
-                "user": self.username,
-                "channel": channel,
-                "message": message,
-                "timestamp": current_time,
-                "clock": self.increment_clock()
-            }
-        }
-        
-        self.req_socket.send(msgpack.packb(req_message))
-        response = self.req_socket.recv()
-        response_data = msgpack.unpackb(response, raw=False)
-        
-        # atualizar relógio lógico
-        if "clock" in response_data["data"]:
-            self.update_clock(response_data["data"]["clock"])
+        request = self.client.submit("publish", {
+            "user": self.username,
+            "channel": channel,
+            "message": message,
+            "timestamp": current_time,
+            "clock": self.increment_clock()
+        })
+        return request, current_time
+    
+    def finish_publish(self, channel, i, message, request, timestamp_used):
+        """espera a confirmação da mensagem i da rajada; devolve True se a resposta foi "ocupado" """
+        try:
+            response = self.complete(request)
+        except (CodecError, RequestTimeout) as e:
+            print(f"Erro ao publicar mensagem {i+1}/10: {e}")
+            return False
+        if is_busy(response.data):
+            print(f"Servidores ocupados: mensagem {i+1}/10 não publicada")
+            return True
+        if response.data.get("status") == "OK":
+            # usar o mesmo timestamp da mensagem pra garantir consistência
+            if timestamp_used > 1e10:  # timestamp em milissegundos
+                dt = datetime.fromtimestamp(timestamp_used / 1000)
+            else:  # timestamp em segundos
+                dt = datetime.fromtimestamp(timestamp_used)
+            current_time = dt.strftime("%Y-%m-%d %H:%M:%S")
+            print(f"[{current_time}] Bot enviou mensagem {i+1}/10 no canal '{channel}': {message} (timestamp: {timestamp_used})")
+        return False
+    
+    def publish_message(self, channel, message):
+        """publica mensagem em canal"""
+        request, current_time = self.submit_publish(channel, message)
+        response = self.complete(request)
         
         # retornar também o timestamp usado pra poder fazer print consistente
-        return response_data["data"]["status"] == "OK", current_time
+        return response.data["status"] == "OK", current_time
     
     def subscribe_to_channel(self, channel):
         """inscreve-se em um canal"""
-        self.sub_socket.setsockopt_string(zmq.SUBSCRIBE, channel)
+        self.sub_socket.setsockopt_string(zmq.SUBSCRIBE, channel_topic(channel))
         print(f"Bot inscrito no canal: {channel}")
     
+    def format_timestamp(self, timestamp):
+        """converte timestamp (segundos ou milissegundos) pra hora legível"""
+        if timestamp:
+            second = int(timestamp / 1000) if timestamp > 1e10 else int(timestamp)  # ms ou s
+            # mensagens chegam em rajadas dentro do mesmo segundo: reaproveitar a última formatação
+            if second != self.formatted_second:
+                self.formatted_second = second
+                self.formatted_time = datetime.fromtimestamp(second).strftime("%Y-%m-%d %H:%M:%S")
+            return self.formatted_time
+        return "N/A"
+    
+    def check_order(self, topic, user, message):
+        """compara o número X/10 com o último visto do mesmo remetente no canal"""
+        match = NUMBERED_MESSAGE.search(message)
+        if not match:
+            return None
+        msg_num = int(match.group(1))
+        key = (topic, user)
+        prev_num = self.last_seen.get(key, 0)
+        self.last_seen[key] = msg_num
+        # 1 abre uma nova rajada; fora isso o número só pode crescer
+        if msg_num != 1 and msg_num < prev_num:
+            return f"⚠️ ATENÇÃO: Mensagem recebida fora de ordem! Anterior: {prev_num}/10, Atual: {msg_num}/10"
+        return None
+    
+    def handle_message(self, topic, message_data, lines, replayed=False):
+        """processa uma mensagem recebida (ao vivo ou reenviada pelo cache do proxy); o texto vai pra lines"""
+        service = message_data.get('service')
+        data = message_data.get('data', {})
+        origin = "recebeu do histórico" if replayed else "recebeu"
+        if "trace" in message_data and not replayed:
+            record_delivery(self.metrics, message_data)
+        
+        if service == 'publish':
+            message = data.get('message', '')
+            # verificar ordem das mensagens (se tem número no formato X/10)
+            # mensagens do histórico são anteriores à inscrição e ficam fora da verificação
+            if not replayed:
+                warning = self.check_order(topic, data.get('user', ''), message)
+                if warning:
+                    lines.append(warning)
+            
+            # formatação só pra uma a cada BOT_PRINT_EVERY mensagens
+            self.received_count += 1
+            if self.received_count % PRINT_EVERY:
+                return
+            timestamp = data.get('timestamp', 0)
+            lines.append(f"[{self.format_timestamp(timestamp)}] Bot {origin} no canal '{topic}': {data.get('user', '')}: {message} (timestamp: {timestamp}, clock: {data.get('clock', 0)})")
+        elif service == 'message':
+            self.received_count += 1
+            if self.received_count % PRINT_EVERY:
+                return
+            timestamp = data.get('timestamp', 0)
+            lines.append(f"[{self.format_timestamp(timestamp)}] Bot {origin} mensagem de {data.get('src', '')}: {data.get('message', '')} (timestamp: {timestamp})")
+        elif service == 'replay':
+            # histórico do tópico enviado pelo proxy (modo lvc) logo após a inscrição
+            history = data.get('messages', [])
+            if history:
+                lines.append(f"Bot recebeu {len(history)} mensagens de histórico do tópico '{topic}'")
+            for payload in history:
+                self.handle_message(topic, wire.decode(payload), lines, replayed=True)
+    
     def listen_for_messages(self):
-        """thread pra escutar mensagens recebidas"""
+        """thread pra escutar mensagens recebidas: bloqueia no poller e drena tudo que estiver pronto"""
+        poller = zmq.Poller()
+        poller.register(self.sub_socket, zmq.POLLIN)
+        
         while self.running:
             try:
-                # receber mensagem do pub/sub (formato multipart: [topic, message_bytes])
-                try:
-                    frames = self.sub_socket.recv_multipart(zmq.NOBLOCK)
-                    if len(frames) >= 2:
-                        topic = frames[0].decode('utf-8')
-                        message_bytes = frames[1]
-                        
-                        try:
-                            # deserializar messagepack
-                            message_data = msgpack.unpackb(message_bytes, raw=False)
-                            
-                            # exibir mensagem formatada
-                            if message_data.get('service') == 'publish':
-                                user = message_data.get('data', {}).get('user', '')
-                                message = message_data.get('data', {}).get('message', '')
-                                timestamp = message_data.get('data', {}).get('timestamp', 0)
-                                clock = message_data.get('data', {}).get('clock', 0)
-                                
-                                # converter timestamp pra hora legível - usar o timestamp da mensagem recebida
-                                if timestamp:
-                                    if timestamp > 1e10:  # timestamp em milissegundos
-                                        dt = datetime.fromtimestamp(timestamp / 1000)
-                                    else:  # timestamp em segundos
-                                        dt = datetime.fromtimestamp(timestamp)
-                                    time_str = dt.strftime("%Y-%m-%d %H:%M:%S")
-                                else:
-                                    time_str = "N/A"
-                                
-                                # verificar ordem das mensagens (se tem número no formato X/10)
-                                match = re.search(r'\((\d+)/10\)', message)
-                                if match:
-                                    msg_num = int(match.group(1))
-                                    self.received_messages.append({
-                                        'num': msg_num,
-                                        'message': message,
-                                        'timestamp': timestamp,
-                                        'clock': clock,
-                                        'time': time_str
-                                    })
-                                    # verificar se está em ordem
-                                    if len(self.received_messages) > 1:
-                                        prev_num = self.received_messages[-2]['num']
-                                        if msg_num < prev_num:
-                                            print(f"⚠️ ATENÇÃO: Mensagem recebida fora de ordem! Anterior: {prev_num}/10, Atual: {msg_num}/10")
-                                
-                                print(f"[{time_str}] Bot recebeu no canal '{topic}': {user}: {message} (timestamp: {timestamp}, clock: {clock})")
-                            elif message_data.get('service') == 'message':
-                                src = message_data.get('data', {}).get('src', '')
-                                message = message_data.get('data', {}).get('message', '')
-                                timestamp = message_data.get('data', {}).get('timestamp', 0)
-                                
-                                # converter timestamp pra hora legível - usar o timestamp da mensagem recebida
-                                if timestamp:
-                                    if timestamp > 1e10:  # timestamp em milissegundos
-                                        dt = datetime.fromtimestamp(timestamp / 1000)
-                                    else:  # timestamp em segundos
-                                        dt = datetime.fromtimestamp(timestamp)
-                                    time_str = dt.strftime("%Y-%m-%d %H:%M:%S")
-                                else:
-                                    time_str = "N/A"
-                                
-                                print(f"[{time_str}] Bot recebeu mensagem de {src}: {message} (timestamp: {timestamp})")
-                        except Exception as ex:
-                            print(f"Erro ao decodificar mensagem: {ex}")
-                except zmq.Again:
-                    time.sleep(0.1)
-                except Exception as e:
-                    print(f"Erro ao receber mensagem: {e}")
-                    time.sleep(0.1)
-                    
+                # o timeout só serve pra perceber self.running = False
+                if not poller.poll(SUB_POLL_TIMEOUT):
+                    continue
+                
+                # receber mensagens do pub/sub (formato multipart: [topic, message_bytes]) em lote
+                lines = []
+                for _ in range(SUB_RECV_BATCH):
+                    try:
+                        frames = self.sub_socket.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    if len(frames) < 2:
+                        continue
+                    try:
+                        self.handle_message(topic_name(frames[0].decode('utf-8')), wire.decode(frames[1]), lines)
+                    except Exception as ex:
+                        lines.append(f"Erro ao decodificar mensagem: {ex}")
+                
+                # um print por lote em vez de um por mensagem
+                if lines:
+                    print("\n".join(lines))
+            except zmq.ContextTerminated:
+                break
             except Exception as e:
                 print(f"Erro ao receber mensagem: {e}")
                 time.sleep(0.1)
@@ -249,20 +480,19 @@ class Bot:
     def run(self):
         """executa o bot"""
         try:
-            # gerar nome aleatório pro bot
-            bot_name = f"bot_{random.randint(1000, 9999)}"
+            bot_name = self.bot_name
             
             # login
             if not self.login(bot_name):
                 return
             
             # inscrever-se pra receber mensagens próprias
-            self.sub_socket.setsockopt_string(zmq.SUBSCRIBE, bot_name)
+            self.sub_socket.setsockopt_string(zmq.SUBSCRIBE, user_topic(bot_name))
             
             # iniciar thread de escuta
-            listen_thread = threading.Thread(target=self.listen_for_messages)
-            listen_thread.daemon = True
-            listen_thread.start()
+            self.listen_thread = threading.Thread(target=self.listen_for_messages)
+            self.listen_thread.daemon = True
+            self.listen_thread.start()
             
             # loop principal do bot
             while self.running:
@@ -283,41 +513,443 @@ class Bot:
                         # inscrever-se no canal
                         self.subscribe_to_channel(selected_channel)
                         
-                        # enviar 10 mensagens sequencialmente
+                        # últimas mensagens do canal (anteriores à inscrição)
+                        history, _ = self.history(channel=selected_channel, limit=10)
+                        print(f"Bot leu {len(history)} mensagens do histórico do canal '{selected_channel}'")
+                        
+                        # enviar as 10 mensagens com até BURST_INFLIGHT em voo; as confirmações são
+                        # tratadas na ordem de envio (cada uma casada pela própria correlação)
+                        burst = deque()
+                        busy = False
                         for i in range(10):
                             if not self.running:
                                 break
                             
                             message = random.choice(self.messages)
                             msg_with_num = f"{message} ({i+1}/10)"
-                            success, timestamp_used = self.publish_message(selected_channel, msg_with_num)
-                            if success:
-                                # usar o mesmo timestamp da mensagem pra garantir consistência
-                                if timestamp_used > 1e10:  # timestamp em milissegundos
-                                    dt = datetime.fromtimestamp(timestamp_used / 1000)
-                                else:  # timestamp em segundos
-                                    dt = datetime.fromtimestamp(timestamp_used)
-                                current_time = dt.strftime("%Y-%m-%d %H:%M:%S")
-                                print(f"[{current_time}] Bot enviou mensagem {i+1}/10 no canal '{selected_channel}': {message} (timestamp: {timestamp_used})")
-                            
-                            # usar sleep menor mas mais consistente pra garantir ordem
-                            time.sleep(random.uniform(0.5, 1.5))  # pausa entre mensagens
+                            if len(burst) >= BURST_INFLIGHT:
+                                busy = self.finish_publish(selected_channel, *burst.popleft()) or busy
+                            burst.append((i, message) + self.submit_publish(selected_channel, msg_with_num))
+                        while burst:
+                            busy = self.finish_publish(selected_channel, *burst.popleft()) or busy
+                        
+                        # sobrecarga: espaçar as rajadas até as respostas voltarem ao normal
+                        if busy:
+                            self.backoff = min(self.backoff * 2, BUSY_BACKOFF_MAX)
+                            print(f"Bot reduzindo o ritmo: pausa x{self.backoff:g}")
+                        else:
+                            self.backoff = max(1, self.backoff / 2)
                     
                     # pausa antes do próximo ciclo
-                    time.sleep(random.uniform(5, 10))
-                    
+                    time.sleep(random.uniform(5, 10) * self.backoff)
+                
                 except Exception as e:
                     print(f"Erro no loop do bot: {e}")
                     time.sleep(5)
-                    
+        
         except KeyboardInterrupt:
             print("\nBot encerrado")
         finally:
             self.running = False
-            self.req_socket.close()
+            # a thread de escuta sai em até SUB_POLL_TIMEOUT; só então o socket sub pode ser fechado
+            if self.listen_thread is not None:
+                self.listen_thread.join()
+            self.client.close()
+            self.sub_socket.close()
+            self.context.term()
+
+# rótulo das estatísticas de mensagens diretas no modo load (canais de carga são load_<n>)
+DIRECT_LABEL = "direct"
+
+class ChannelStats:
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        self.errors = 0
+        self.busy = 0  # respostas "ocupado" (não publicadas, não contam como perda)
+        self.received = 0
+        self.lost = 0
+        self.out_of_order = 0
+        self.duplicates = 0  # sequências já recebidas (não entram em recebidas nem na latência)
+        self.latency = Histogram()
+    
+    def summary(self):
+        """contagens e latências (µs) serializáveis"""
+        return {
+            "sent": self.sent, "acked": self.acked, "errors": self.errors, "busy": self.busy, "received": self.received,
+            "lost": self.lost, "out_of_order": self.out_of_order, "duplicates": self.duplicates,
+            "latency": self.latency.summary()
+        }
+
+class HistoryStats:
+    def __init__(self):
+        self.pages = 0
+        self.messages = 0
+        self.errors = 0
+        self.latency = Histogram()
+    
+    def summary(self):
+        return {"pages": self.pages, "messages": self.messages, "errors": self.errors, "latency": self.latency.summary()}
+
+class LoadTest:
+    """vários usuários simulados num só processo (asyncio), publicando em ritmo fixo e medindo a entrega"""
+    
+    def __init__(self):
+        self.context = zmq.asyncio.Context()
+        self.codec = Codec()
+        # prefixo dos usuários desta execução (o servidor recusa nomes repetidos)
+        self.run_id = f"load_{random.randint(0, 0xffff):04x}"
+        self.channels = [f"load_{index}" for index in range(LOAD_CHANNELS)]
+        self.labels = self.channels + ([DIRECT_LABEL] if LOAD_DIRECT > 0 else [])
+        self.stats = {label: ChannelStats() for label in self.labels}
+        # ids dos canais de carga no cabeçalho do frame (publicações de outros canais nem são decodificadas)
+        self.channel_ids = {wire.channel_id(channel_topic(channel)) for channel in self.channels}
+        self.channel_names = set(self.channels)
+        # mensagens diretas contam como o canal DIRECT_LABEL (cada usuário só manda pro seguinte)
+        self.last_seq = {}   # {(usuário, canal): maior sequência recebida}
+        self.missing = {}    # {(usuário, canal): sequências puladas, contadas como perdidas até chegarem}
+        self.acked_seq = {}  # {(usuário, canal): maior sequência confirmada pelo servidor}
+        self.history = HistoryStats()
+        self.clock = 0
+        self.sub_socket = None
+        self.metrics = Metrics("bot")
+        self.metrics.start(self.context)
+    
+    def connect(self, identity):
+        """novo socket REQ pro broker (no modo sharded, no shard de `identity`)"""
+        socket = configure(self.context.socket(zmq.REQ), "BOT_REQ", linger=0)
+        socket.connect(broker_endpoint(BROKER_ENDPOINT, identity))
+        return socket
+    
+    def subscribe(self):
+        """novo socket SUB inscrito nos canais de carga (e nos usuários, com LOAD_DIRECT)"""
+        sub_socket = configure(self.context.socket(zmq.SUB), "BOT_SUB")
+        sub_socket.connect(PROXY_ENDPOINT)
+        for channel in self.channels:
+            sub_socket.setsockopt_string(zmq.SUBSCRIBE, channel_topic(channel))
+        if LOAD_DIRECT > 0:
+            for index in range(LOAD_USERS):
+                sub_socket.setsockopt_string(zmq.SUBSCRIBE, user_topic(self.user_name(index)))
+        return sub_socket
+    
+    async def request(self, socket, service, data):
+        """uma requisição com timeout; o chamador descarta o socket se der timeout"""
+        self.clock += 1
+        data["clock"] = self.clock
+        data["timestamp"] = int(time.time() * 1000)
+        trace = new_trace()
+        await socket.send(self.codec.encode(service, data, trace))
+        response = self.codec.decode(await asyncio.wait_for(socket.recv(), LOAD_TIMEOUT))
+        self.clock = max(self.clock, response.data.get("clock", 0)) + 1
+        if trace is not None:
+            record_response(self.metrics, service, response)
+        return response
+    
+    async def setup(self):
+        """cria os canais de carga (já existentes são reaproveitados)"""
+        socket = self.connect(self.run_id)
+        try:
+            for channel in self.channels:
+                await self.request(socket, "channel", {"channel": channel})
+        finally:
+            socket.close()
+    
+    def user_name(self, index):
+        return f"{self.run_id}_{index % LOAD_USERS}"
+    
+    async def login(self, index):
+        """login de um usuário simulado; devolve o socket REQ (None se falhar)"""
+        user = self.user_name(index)
+        socket = self.connect(user)
+        try:
+            response = await self.request(socket, "login", {"user": user})
+            if response.data.get("status") == "sucesso":
+                return socket
+            print(f"Erro no login de {user}: {response.data.get('description')}")
+        except (asyncio.TimeoutError, CodecError) as e:
+            print(f"Erro no login de {user}: {e!r}")
+        socket.close()
+        return None
+    
+    async def simulate_user(self, index, socket, start_at, stop_at):
+        """publicações em ritmo fixo (LOAD_RATE por segundo) num canal e, com LOAD_DIRECT, mensagens diretas"""
+        user = self.user_name(index)
+        channel = self.channels[index % len(self.channels)]
+        peer = self.user_name(index + 1)
+        
+        rate = LOAD_RATE
+        # espalhar os usuários dentro do primeiro intervalo pra não publicarem todos juntos
+        next_send = start_at + random.uniform(0, 1 / rate)
+        seq = 0
+        direct_seq = 0
+        padding = "x" * LOAD_MESSAGE_SIZE
+        cursor = None
+        
+        while next_send < stop_at:
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_send += 1 / rate
+            
+            # sequências separadas por destino: os saltos na recepção continuam indicando perda
+            direct = LOAD_DIRECT > 0 and random.random() < LOAD_DIRECT
+            if direct:
+                direct_seq += 1
+                label, current = DIRECT_LABEL, direct_seq
+            else:
+                seq += 1
+                label, current = channel, seq
+            stats = self.stats[label]
+            
+            # sequência e instante de envio vão no texto: o servidor repassa só timestamp (ms) e o próprio clock
+            header = f"#{current}@{time.perf_counter_ns() // 1000} "
+            message = header + padding[len(header):]
+            stats.sent += 1
+            try:
+                if direct:
+                    response = await self.request(socket, "message", {"src": user, "dst": peer, "message": message})
+                else:
+                    response = await self.request(socket, "publish", {"user": user, "channel": channel, "message": message})
+            except (asyncio.TimeoutError, CodecError):
+                stats.errors += 1
+                socket.close()
+                socket = self.connect(user)
+                continue
+            
+            if is_busy(response.data):
+                # não foi publicada: a sequência é reaproveitada e o usuário desacelera
+                stats.busy += 1
+                if direct:
+                    direct_seq -= 1
+                else:
+                    seq -= 1
+                rate = max(LOAD_MIN_RATE, rate / 2)
+                continue
+            if response.data.get("status") == "OK":
+                stats.acked += 1
+                self.acked_seq[(user, label)] = current
+                rate = min(LOAD_RATE, rate + LOAD_RATE / 10)
+            else:
+                stats.errors += 1
+            
+            if not direct and LOAD_HISTORY_EVERY and seq % LOAD_HISTORY_EVERY == 0:
+                socket, cursor = await self.read_history(socket, user, channel, cursor)
+        
+        socket.close()
+    
+    async def read_history(self, socket, user, channel, cursor):
+        """lê uma página do histórico do canal, andando pra trás a cada chamada (volta pro fim quando acaba)"""
+        data = {"channel": channel, "limit": HISTORY_PAGE}
+        if cursor is not None:
+            data["cursor"] = cursor
+        started = time.perf_counter_ns()
+        try:
+            response = await self.request(socket, "history", data)
+        except (asyncio.TimeoutError, CodecError):
+            self.history.errors += 1
+            socket.close()
+            return self.connect(user), None
+        
+        if response.data.get("status") != "OK":
+            self.history.errors += 1
+            return socket, None
+        self.history.latency.record((time.perf_counter_ns() - started) // 1000)
+        self.history.pages += 1
+        self.history.messages += len(response.data.get("messages", []))
+        return socket, response.data.get("next")
+    
+    def handle_publish(self, payload):
+        """contabiliza uma mensagem de carga recebida (publicação num canal ou mensagem direta); devolve o atraso (s)"""
+        if not wire.is_frame(payload):
+            return 0
+        # o cabeçalho diz o canal: o corpo só é decodificado se ele for de carga
+        kind, flags, channel, _, _, length = wire.header(payload)
+        if kind == wire.PUBLISH:
+            if channel not in self.channel_ids:
+                return 0
+        elif kind != wire.MESSAGE:
+            return 0
+        data = wire.body(payload, length)
+        # o id é um hash de 32 bits e pode colidir: o canal (ou o destinatário) vem do corpo
+        if kind == wire.PUBLISH:
+            topic = data.get("channel")
+            if topic not in self.channel_names:
+                self.metrics.count("channel_id_collisions")
+                return 0
+            user = data.get("user", "")
+        else:
+            if not data.get("dst", "").startswith(self.run_id):
+                return 0
+            topic = DIRECT_LABEL
+            user = data.get("src", "")
+        stats = self.stats.get(topic)
+        text = data.get("message", "")
+        if stats is None or not user.startswith(self.run_id) or not text.startswith("#"):
+            return 0
+        if flags & wire.TRACED:
+            record_delivery(self.metrics, {"trace": wire.trace_of(payload)})
+        
+        header = text[1:text.index(" ")] if " " in text else text[1:]
+        seq, _, sent_us = header.partition("@")
+        seq = int(seq)
+        
+        # ordem por usuário: salto = perda (até chegar depois), volta de uma pulada = fora de ordem,
+        # o resto (já recebida) = duplicada
+        key = (user, topic)
+        last = self.last_seq.get(key, 0)
+        if seq > last:
+            if seq > last + 1:
+                stats.lost += seq - last - 1
+                self.missing.setdefault(key, set()).update(range(last + 1, seq))
+            self.last_seq[key] = seq
+        else:
+            missing = self.missing.get(key)
+            if missing is None or seq not in missing:
+                stats.duplicates += 1
+                return 0
+            missing.remove(seq)
+            stats.out_of_order += 1
+            stats.lost -= 1
+        stats.received += 1
+        stats.latency.record(time.perf_counter_ns() // 1000 - int(sent_us))
+        # o timestamp é o do envio (ms), que o servidor repassa na publicação
+        return time.time() - data.get("timestamp", 0) / 1000
+    
+    async def receive(self):
+        """recebe as publicações de todos os canais de carga"""
+        # depois de refazer o SUB, esperar um prazo antes de julgar o atraso de novo
+        check_lag_at = 0
+        while True:
+            frames = await self.sub_socket.recv_multipart()
+            if len(frames) < 2:
+                continue
+            try:
+                lag = self.handle_publish(frames[-1])
+            except Exception as e:
+                print(f"Erro ao processar mensagem de carga: {e!r}")
+                continue
+            if LOAD_MAX_LAG and lag > LOAD_MAX_LAG and time.monotonic() >= check_lag_at:
+                # assinante lento: descarta a fila e se inscreve de novo; o que ficou pra trás conta como perda
+                print(f"[CARGA] assinante {lag:.1f}s atrasado: refazendo o SUB")
+                self.metrics.count("resubscribed")
+                self.sub_socket.close()
+                self.sub_socket = self.subscribe()
+                check_lag_at = time.monotonic() + LOAD_MAX_LAG
+    
+    def totals(self):
+        """soma das estatísticas de todos os canais"""
+        total = ChannelStats()
+        for stats in self.stats.values():
+            for field in ("sent", "acked", "errors", "busy", "received", "lost", "out_of_order", "duplicates"):
+                setattr(total, field, getattr(total, field) + getattr(stats, field))
+            total.latency.merge(stats.latency)
+        return total
+    
+    async def report_progress(self, start_at):
+        """resumo periódico durante o teste"""
+        previous = 0
+        while True:
+            await asyncio.sleep(LOAD_REPORT_INTERVAL)
+            total = self.totals()
+            rate = (total.received - previous) / LOAD_REPORT_INTERVAL
+            previous = total.received
+            print(f"[CARGA] {time.monotonic() - start_at:6.1f}s enviadas={total.sent} confirmadas={total.acked} "
+                  f"ocupado={total.busy} recebidas={total.received} ({rate:.0f} msg/s) "
+                  f"p99={total.latency.percentile(0.99) / 1000:.1f}ms")
+    
+    def report(self, elapsed):
+        """tabela final por canal e total"""
+        # mensagens confirmadas que nunca chegaram (depois da última recebida)
+        for (user, channel), acked in self.acked_seq.items():
+            last = self.last_seq.get((user, channel), 0)
+            if acked > last:
+                self.stats[channel].lost += acked - last
+        
+        print(f"{'canal':<12}{'enviadas':>10}{'confirm.':>10}{'erros':>7}{'recebidas':>11}{'perdidas':>10}"
+              f"{'fora ordem':>12}{'duplic.':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        rows = [(label, self.stats[label]) for label in self.labels] + [("total", self.totals())]
+        for label, stats in rows:
+            latency = stats.latency
+            print(f"{label:<12}{stats.sent:>10}{stats.acked:>10}{stats.errors:>7}{stats.received:>11}{stats.lost:>10}"
+                  f"{stats.out_of_order:>12}{stats.duplicates:>9}{latency.percentile(0.5) / 1000:>9.1f}{latency.percentile(0.95) / 1000:>9.1f}"
+                  f"{latency.percentile(0.99) / 1000:>9.1f}")
+        
+        total = rows[-1][1]
+        print(f"[CARGA] {LOAD_USERS} usuários, {LOAD_CHANNELS} canais, {LOAD_RATE} msg/s por usuário, "
+              f"{LOAD_MESSAGE_SIZE} bytes: {total.received / elapsed:.0f} msg/s recebidas, "
+              f"{total.acked / elapsed:.0f} msg/s confirmadas, latência máxima {total.latency.max / 1000:.1f}ms")
+        resubscribed = self.metrics.snapshot()["counters"].get("resubscribed", 0)
+        if total.busy or resubscribed:
+            print(f"[CARGA] sobrecarga: {total.busy} respostas 'ocupado' (ritmo reduzido), "
+                  f"{resubscribed} reinscrições por atraso")
+        
+        history = self.history
+        if history.pages or history.errors:
+            print(f"[CARGA] histórico: {history.pages} páginas ({history.messages} mensagens), {history.errors} erros, "
+                  f"p50={history.latency.percentile(0.5) / 1000:.1f}ms p99={history.latency.percentile(0.99) / 1000:.1f}ms")
+        
+        # onde vai o tempo das requisições rastreadas (TRACE_SAMPLE), trecho a trecho
+        hops = (("ida e volta", "rtt_us.publish"), ("no servidor", "server_us.publish"),
+                ("broker + rede", "transport_us.publish"), ("servidor -> bot", "delivery_us"), ("ponta a ponta", "end_to_end_us"))
+        for label, name in hops:
+            latency = self.metrics.histogram(name)
+            if latency.total:
+                print(f"[CARGA] rastreadas, {label}: n={latency.total} p50={latency.percentile(0.5) / 1000:.2f}ms "
+                      f"p99={latency.percentile(0.99) / 1000:.2f}ms máx={latency.max / 1000:.2f}ms")
+        
+        if LOAD_REPORT_FILE:
+            self.write_report(LOAD_REPORT_FILE, elapsed, rows)
+    
+    def write_report(self, path, elapsed, rows):
+        """grava o relatório final em JSON (latências em µs, com as faixas dos histogramas pra somar bots)"""
+        report = {
+            "run_id": self.run_id,
+            "users": LOAD_USERS,
+            "channels": LOAD_CHANNELS,
+            "rate": LOAD_RATE,
+            "direct": LOAD_DIRECT,
+            "message_size": LOAD_MESSAGE_SIZE,
+            "elapsed": elapsed,
+            "stats": {label: stats.summary() for label, stats in rows},
+            "history": self.history.summary(),
+            "metrics": self.metrics.snapshot()
+        }
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as output:
+            json.dump(report, output)
+        os.replace(temp_path, path)
+    
+    async def run(self):
+        """executa o teste de carga"""
+        self.sub_socket = self.subscribe()
+        receiver = asyncio.ensure_future(self.receive())
+        
+        try:
+            await self.setup()
+            # todos logados antes de começar: mensagens diretas pra quem ainda não existe seriam recusadas
+            sockets = await asyncio.gather(*(self.login(index) for index in range(LOAD_USERS)))
+            # dar tempo pras inscrições chegarem aos servidores antes de publicar
+            await asyncio.sleep(1)
+            
+            print(f"[CARGA] {LOAD_USERS} usuários por {LOAD_DURATION}s em {LOAD_CHANNELS} canais ({self.run_id})")
+            start_at = time.monotonic()
+            stop_at = start_at + LOAD_DURATION
+            progress = asyncio.ensure_future(self.report_progress(start_at))
+            await asyncio.gather(*(self.simulate_user(index, socket, start_at, stop_at)
+                                   for index, socket in enumerate(sockets) if socket is not None))
+            elapsed = time.monotonic() - start_at
+            
+            await asyncio.sleep(LOAD_DRAIN)
+            progress.cancel()
+            self.report(elapsed)
+        finally:
+            receiver.cancel()
             self.sub_socket.close()
             self.context.term()
 
 if __name__ == "__main__":
-    bot = Bot()
-    bot.run()
\ No newline at end of file
+    if BOT_MODE == "load":
+        asyncio.run(LoadTest().run())
+    else:
+        bot = Bot()
+        bot.run()
@@ -1,18 +1,68 @@
 import zmq
+import os
+import sys
+import time
 import threading
+import msgpack
+from collections import deque
+
+# no container o common é montado em /app/common; rodando direto do repositório ele fica um nível acima
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.metrics import Metrics
+from common.flow import BUSY_STATUS, configure
+from common.ring import HashRing
+from common.topics import channel_topic, user_topic
+from common.shards import BROKER_SHARDS, BROKER_SHARD_FRONTEND_BASE
+
+# modo do broker: "proxy" (round-robin com zmq.proxy), "lb" (paranoid pirate) ou "sharded"
+BROKER_MODE = os.environ.get("BROKER_MODE", "proxy")
+
+# threads de I/O do contexto zmq (o padrão do libzmq é 1)
+BROKER_IO_THREADS = int(os.environ.get("BROKER_IO_THREADS", "1"))
+
+# modo "sharded": BROKER_SHARDS pares frontend/backend, cada um com seu zmq.proxy numa thread
+# (frontends em BROKER_SHARD_FRONTEND_BASE + i, ver common/shards.py)
+BROKER_SHARD_BACKEND_BASE = int(os.environ.get("BROKER_SHARD_BACKEND_BASE", "5600"))  # shard i usa a porta base + i
+
+# parâmetros do protocolo paranoid pirate
+HEARTBEAT_INTERVAL = float(os.environ.get("BROKER_HEARTBEAT_INTERVAL", "1.0"))  # segundos
+HEARTBEAT_LIVENESS = int(os.environ.get("BROKER_HEARTBEAT_LIVENESS", "3"))  # heartbeats perdidos até remover
+STATS_INTERVAL = float(os.environ.get("BROKER_STATS_INTERVAL", "10.0"))  # segundos entre relatórios
+
+# modo lb: com a fila cheia (ou uma requisição esperando demais) o cliente recebe status
+# "ocupado" na hora, em vez de esperar até o próprio timeout por uma resposta que não vem
+BROKER_MAX_QUEUE = int(os.environ.get("BROKER_MAX_QUEUE", "1000"))
+BROKER_QUEUE_TIMEOUT = float(os.environ.get("BROKER_QUEUE_TIMEOUT", "5.0"))  # segundos
+
+# modo lb: publish, message e history vão de preferência pra um dono da partição do canal/usuário
+# (common/ring.py), no anel montado com a lista do servidor de referência. BROKER_RING_REPLICAS é
+# quantos dos primeiros donos servem (use o menor fator de replicação dos canais: o primeiro é
+# dono em qualquer fator); sem dono livre a requisição vai pra qualquer servidor
+BROKER_RING = os.environ.get("BROKER_RING", "0") == "1"
+BROKER_RING_REPLICAS = int(os.environ.get("BROKER_RING_REPLICAS", "1"))
+BROKER_REFERENCE_ENDPOINT = os.environ.get("BROKER_REFERENCE_ENDPOINT", "tcp://reference:5559")
+BROKER_RING_REFRESH = float(os.environ.get("BROKER_RING_REFRESH", "5.0"))  # segundos entre pedidos da lista
+
+# sinais trocados com os servidores (primeiro frame da mensagem)
+PPP_READY = b"\x01"
+PPP_HEARTBEAT = b"\x02"
 
 class Broker:
     def __init__(self):
-        self.context = zmq.Context()
+        self.context = zmq.Context(io_threads=BROKER_IO_THREADS)
         
         # Socket ROUTER para receber requisições dos clientes
-        self.frontend = self.context.socket(zmq.ROUTER)
+        self.frontend = configure(self.context.socket(zmq.ROUTER), "BROKER_FRONTEND")
         self.frontend.bind("tcp://*:5555")
         
         # Socket DEALER para enviar para servidores
-        self.backend = self.context.socket(zmq.DEALER)
+        self.backend = configure(self.context.socket(zmq.DEALER), "BROKER_BACKEND")
         self.backend.bind("tcp://*:5556")
         
+        # zmq.proxy encaminha sem passar pelo Python: só o modo lb mede fila e atendimento
+        self.metrics = Metrics("broker")
+        self.metrics.start(self.context)
+        
         print("Broker iniciado")
     
     def run(self):
@@ -26,6 +76,454 @@ class Broker:
             self.backend.close()
             self.context.term()
 
+def ring_key(payload):
+    """tópico (#canal, @usuário) que decide os donos de uma requisição, ou None se qualquer servidor atende"""
+    try:
+        request = msgpack.unpackb(payload, raw=False)
+    except Exception:
+        return None  # o servidor responde o erro de formato
+    data = request.get("data") if isinstance(request, dict) else None
+    if not isinstance(data, dict):
+        return None
+    service = request.get("service")
+    if service == "message":
+        name, topic = data.get("dst"), user_topic
+    elif service == "publish" or (service == "history" and data.get("channel")):
+        name, topic = data.get("channel"), channel_topic
+    elif service == "history":
+        name, topic = data.get("user"), user_topic
+    else:
+        return None
+    return topic(name) if isinstance(name, str) and name else None
+
+def envelope_of(frames):
+    """frames de endereçamento até o delimitador vazio, inclusive"""
+    for index, frame in enumerate(frames):
+        if not frame:
+            return tuple(frames[:index + 1])
+    return tuple(frames[:1])
+
+class Worker:
+    def __init__(self, address, credit):
+        self.address = address
+        self.credit = credit  # quantas requisições o servidor aceita ao mesmo tempo
+        self.pending = {}  # {envelope (cliente, [correlação,] b""): [instantes de envio]} requisições em andamento
+        self.inflight = 0
+        self.routed = 0
+        self.service_time = 0.0  # média móvel do tempo de resposta (segundos)
+        self.expiry = time.time() + HEARTBEAT_INTERVAL * HEARTBEAT_LIVENESS
+    
+    def refresh(self):
+        """renova o prazo de vida do servidor"""
+        self.expiry = time.time() + HEARTBEAT_INTERVAL * HEARTBEAT_LIVENESS
+    
+    def load(self):
+        """chave de ordenação: ocupação relativa ao crédito, depois tempo de resposta"""
+        return (self.inflight / self.credit, self.service_time)
+    
+    def name(self):
+        """nome legível do servidor pra logs"""
+        return self.address.decode("utf-8", "replace")
+
+def least_loaded(workers):
+    """servidor com crédito e menor carga entre os dados (None se todos estão cheios)"""
+    best = None
+    for worker in workers:
+        if worker is None or worker.inflight >= worker.credit:
+            continue
+        if best is None or worker.load() < best.load():
+            best = worker
+    return best
+
+class LoadBalancingBroker:
+    def __init__(self):
+        self.context = zmq.Context(io_threads=BROKER_IO_THREADS)
+        
+        # Socket ROUTER para receber requisições dos clientes
+        # (mandatory: resposta pra cliente sumido ou com a fila cheia falha e é contada, não some)
+        self.frontend = configure(self.context.socket(zmq.ROUTER), "BROKER_FRONTEND")
+        self.frontend.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.frontend.bind("tcp://*:5555")
+        
+        # Socket ROUTER para os servidores (cada um se anuncia com READY)
+        # (mandatory: requisição pra servidor desconectado falha na hora em vez de esperar o liveness)
+        self.backend = configure(self.context.socket(zmq.ROUTER), "BROKER_BACKEND")
+        self.backend.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.backend.bind("tcp://*:5556")
+        
+        self.workers = {}  # {address: Worker}
+        self.queue = deque()  # (instante de chegada, frames, chave do anel) das requisições aguardando servidor livre
+        self.routed_total = 0
+        self.expired_total = 0
+        
+        # queue_us: chegada -> envio pro servidor; service_us: envio -> resposta (total e por servidor)
+        # busy: respostas "ocupado"; replies_dropped: respostas que o cliente não pôde receber
+        self.metrics = Metrics("broker")
+        self.metrics.start(self.context)
+        
+        # anel dos donos (BROKER_RING): a lista vem do servidor de referência por um DEALER, que
+        # não trava esperando resposta como um REQ se a referência cair
+        self.ring = HashRing()
+        self.ring_names = set()
+        self.ring_version = None
+        self.ring_epoch = None
+        self.reference = None
+        if BROKER_RING:
+            self.reference = self.context.socket(zmq.DEALER)
+            self.reference.setsockopt(zmq.LINGER, 0)
+            self.reference.connect(BROKER_REFERENCE_ENDPOINT)
+        
+        print(f"Broker iniciado em modo balanceamento (heartbeat: {HEARTBEAT_INTERVAL}s, liveness: {HEARTBEAT_LIVENESS})")
+    
+    def next_worker(self, owners=None):
+        """escolhe o servidor vivo menos carregado que ainda tem crédito, de preferência entre os donos"""
+        if owners:
+            best = least_loaded(self.workers.get(owner) for owner in owners)
+            if best is not None:
+                return best
+        return least_loaded(self.workers.values())
+    
+    def owners(self, key):
+        """endereços dos donos da chave no anel (None sem chave ou sem anel)"""
+        if key is None or not len(self.ring):
+            return None
+        return [name.encode("utf-8") for name in self.ring.owners_of(key, BROKER_RING_REPLICAS)]
+    
+    def request_ring(self):
+        """pede a lista de servidores ao servidor de referência (só o que mudou desde a última versão)"""
+        request = {
+            "service": "list",
+            "data": {
+                "since": self.ring_version,
+                "epoch": self.ring_epoch,
+                "timestamp": int(time.time() * 1000),
+                "clock": 0
+            }
+        }
+        try:
+            # envelope vazio: pro ROUTER da referência o pedido chega como o de um REQ
+            self.reference.send_multipart([b"", msgpack.packb(request)], zmq.NOBLOCK)
+        except zmq.Again:
+            pass  # referência fora do ar: tenta de novo no próximo intervalo
+    
+    def handle_reference(self, frames):
+        """aplica a lista (completa ou incremental) e refaz o anel se alguém entrou ou saiu"""
+        data = msgpack.unpackb(frames[-1], raw=False).get("data") or {}
+        if "list" not in data:
+            return
+        version = data.get("version")
+        epoch = data.get("epoch")
+        if epoch == self.ring_epoch and version is not None and self.ring_version is not None and version < self.ring_version:
+            return  # resposta atrasada de um pedido anterior
+        listed = {entry["name"] for entry in data["list"]}
+        if data.get("full", True):
+            names = listed
+        else:
+            names = (self.ring_names - set(data.get("removed", []))) | listed
+        self.ring_version = version
+        self.ring_epoch = epoch
+        if names != self.ring_names:
+            self.ring_names = names
+            self.ring = HashRing(names)
+            print(f"[BROKER] anel com {len(self.ring)} servidores: {', '.join(sorted(names))}")
+    
+    def register_worker(self, address, credit):
+        """registra servidor novo ou renova um existente"""
+        worker = self.workers.get(address)
+        if worker is None:
+            worker = Worker(address, credit)
+            self.workers[address] = worker
+            print(f"Servidor '{worker.name()}' pronto (crédito: {credit})")
+        else:
+            worker.credit = credit
+            worker.refresh()
+        return worker
+    
+    def route(self, worker, request):
+        """encaminha uma requisição [client, ..., b"", payload] pro servidor (None se o envio falhou)"""
+        try:
+            self.backend.send_multipart([worker.address] + request, zmq.NOBLOCK)
+        except zmq.Again:
+            # fila do servidor cheia: a requisição volta pra fila até ele esvaziar
+            self.metrics.count("backend_full")
+            return None
+        except zmq.ZMQError as error:
+            if error.errno != zmq.EHOSTUNREACH:
+                raise
+            # desconectou sem o broker perceber: sai agora, com as requisições que tinha
+            self.remove_worker(worker, "desconectado")
+            return None
+        # o envelope inteiro identifica a requisição (clientes DEALER mandam uma id de correlação)
+        now = time.time()
+        worker.pending.setdefault(envelope_of(request), deque()).append(now)
+        worker.inflight += 1
+        worker.routed += 1
+        self.routed_total += 1
+        return now
+    
+    def dispatch(self):
+        """esvazia a fila enquanto houver servidor com crédito"""
+        while self.queue:
+            arrived, request, key = self.queue[0]
+            if time.time() - arrived > BROKER_QUEUE_TIMEOUT:
+                # o cliente provavelmente já desistiu: não vale ocupar um servidor com ela
+                self.queue.popleft()
+                self.metrics.count("queue_expired")
+                self.busy_reply(envelope_of(request))
+                continue
+            owners = self.owners(key)
+            worker = self.next_worker(owners)
+            if worker is None:
+                break
+            sent = self.route(worker, request)
+            if sent is None:
+                if worker.address in self.workers:
+                    break  # servidor vivo mas cheio: tenta de novo na próxima volta
+                continue
+            if owners:
+                # fora dos donos o servidor guarda uma cópia a mais (quem cria sempre guarda)
+                self.metrics.count("ring_owner" if worker.address in owners else "ring_fallback")
+            self.queue.popleft()
+            self.metrics.observe("queue_us", (sent - arrived) * 1e6)
+    
+    def reply(self, frames):
+        """envia uma resposta ao cliente sem bloquear o loop; falhas só são contadas"""
+        try:
+            self.frontend.send_multipart(frames, zmq.NOBLOCK)
+        except zmq.Again:
+            self.metrics.count("replies_dropped")  # cliente não está lendo (fila dele cheia)
+        except zmq.ZMQError as error:
+            if error.errno != zmq.EHOSTUNREACH:
+                raise
+            self.metrics.count("replies_dropped")  # cliente desconectou
+    
+    def error_reply(self, envelope, description, status="erro"):
+        """responde ao cliente com erro (evita REQ travado esperando resposta)"""
+        response = {
+            "service": "error",
+            "data": {
+                "status": status,
+                "timestamp": int(time.time() * 1000),
+                "clock": 0,
+                "description": description
+            }
+        }
+        self.reply(list(envelope) + [msgpack.packb(response)])
+    
+    def busy_reply(self, envelope):
+        """responde "ocupado": o cliente deve esperar e reduzir o ritmo"""
+        self.metrics.count("busy")
+        self.error_reply(envelope, "Servidores ocupados, tente novamente mais tarde", BUSY_STATUS)
+    
+    def remove_worker(self, worker, reason):
+        """tira o servidor da rotação e responde com erro as requisições que estavam com ele"""
+        print(f"Removendo servidor {reason}: {worker.name()} ({worker.inflight} requisições perdidas)")
+        del self.workers[worker.address]
+        self.expired_total += 1
+        self.metrics.count("expired_workers")
+        for envelope, sent in worker.pending.items():
+            self.metrics.count("lost_requests", len(sent))
+            for _ in sent:
+                self.error_reply(envelope, "Servidor indisponível, tente novamente")
+    
+    def ask_ready(self, address):
+        """pede a um servidor desconhecido que se anuncie de novo (READY com o crédito)"""
+        try:
+            self.backend.send_multipart([address, PPP_READY], zmq.NOBLOCK)
+        except (zmq.Again, zmq.ZMQError):
+            pass  # o próximo heartbeat pede de novo
+    
+    def purge_workers(self):
+        """remove servidores sem heartbeat dentro do intervalo de liveness"""
+        now = time.time()
+        expired = [worker for worker in self.workers.values() if worker.expiry < now]
+        for worker in expired:
+            self.remove_worker(worker, "inativo")
+    
+    def handle_backend(self, frames):
+        """processa mensagem vinda de um servidor"""
+        address = frames[0]
+        body = frames[1:]
+        
+        if len(body) == 1 and body[0] == PPP_HEARTBEAT:
+            worker = self.workers.get(address)
+            if worker is None:
+                # servidor já conectado antes de o broker reiniciar (ou removido por inatividade):
+                # pedir um READY novo pra saber o crédito em vez de supor um
+                self.ask_ready(address)
+            else:
+                worker.refresh()
+            return
+        
+        if body and body[0] == PPP_READY:
+            credit = int(body[1]) if len(body) > 1 else 1
+            self.register_worker(address, max(credit, 1))
+            return
+        
+        # resposta: [client, ..., b"", payload]
+        worker = self.workers.get(address)
+        envelope = envelope_of(body)
+        sent = worker.pending.get(envelope) if worker is not None else None
+        if not sent:
+            # resposta atrasada de um servidor já removido (o cliente recebeu erro e pode ter mandado
+            # a próxima requisição) ou de uma requisição que não é dele: repassar faria o cliente
+            # tomá-la pela resposta de outra. O servidor removido volta quando o heartbeat pedir READY
+            self.metrics.count("replies_dropped")
+            return
+        worker.refresh()
+        elapsed = time.time() - sent.popleft()
+        worker.service_time = 0.8 * worker.service_time + 0.2 * elapsed
+        worker.inflight -= 1
+        if not sent:
+            del worker.pending[envelope]
+        self.metrics.observe("service_us", elapsed * 1e6)
+        self.metrics.observe(f"service_us.{worker.name()}", elapsed * 1e6)
+        self.reply(body)
+    
+    def report(self):
+        """imprime profundidade da fila, contagem de roteamento e latências"""
+        queue_us = self.metrics.histogram("queue_us")
+        service_us = self.metrics.histogram("service_us")
+        per_worker = ", ".join(
+            f"{worker.name()}={worker.routed} (em andamento: {worker.inflight}/{worker.credit}, "
+            f"tempo médio: {worker.service_time * 1000:.1f}ms)"
+            for worker in self.workers.values()
+        )
+        print(f"[BROKER] fila: {len(self.queue)}, servidores vivos: {len(self.workers)}, "
+              f"roteadas: {self.routed_total}, expirados: {self.expired_total} | {per_worker or 'nenhum servidor'}")
+        print(f"[BROKER] fila p50 {queue_us.percentile(0.5) / 1000:.1f}ms p99 {queue_us.percentile(0.99) / 1000:.1f}ms, "
+              f"atendimento p50 {service_us.percentile(0.5) / 1000:.1f}ms p99 {service_us.percentile(0.99) / 1000:.1f}ms")
+        counters = self.metrics.snapshot()["counters"]
+        print(f"[BROKER] ocupado: {counters.get('busy', 0)} (expiradas na fila: {counters.get('queue_expired', 0)}), "
+              f"respostas descartadas: {counters.get('replies_dropped', 0)}")
+        if BROKER_RING:
+            print(f"[BROKER] anel: {len(self.ring)} servidores, pro dono: {counters.get('ring_owner', 0)}, "
+                  f"sem dono livre: {counters.get('ring_fallback', 0)}")
+    
+    def run(self):
+        """Loop principal do broker"""
+        poller = zmq.Poller()
+        poller.register(self.frontend, zmq.POLLIN)
+        poller.register(self.backend, zmq.POLLIN)
+        if self.reference is not None:
+            poller.register(self.reference, zmq.POLLIN)
+        
+        heartbeat_at = time.time() + HEARTBEAT_INTERVAL
+        report_at = time.time() + STATS_INTERVAL
+        ring_at = time.time() if BROKER_RING else float("inf")
+        
+        try:
+            while True:
+                timeout = max(0, min(heartbeat_at, report_at, ring_at) - time.time())
+                events = dict(poller.poll(timeout * 1000))
+                
+                if events.get(self.backend) == zmq.POLLIN:
+                    self.handle_backend(self.backend.recv_multipart())
+                
+                if self.reference is not None and events.get(self.reference) == zmq.POLLIN:
+                    self.handle_reference(self.reference.recv_multipart())
+                
+                if events.get(self.frontend) == zmq.POLLIN:
+                    # [client, b"", payload]
+                    request = self.frontend.recv_multipart()
+                    self.metrics.count("requests")
+                    if len(self.queue) >= BROKER_MAX_QUEUE:
+                        self.busy_reply(envelope_of(request))
+                    else:
+                        # só com o anel ligado vale decodificar o payload pra achar o canal/usuário
+                        key = ring_key(request[-1]) if BROKER_RING else None
+                        self.queue.append((time.time(), request, key))
+                
+                self.dispatch()
+                
+                now = time.time()
+                if now >= heartbeat_at:
+                    for worker in list(self.workers.values()):
+                        try:
+                            self.backend.send_multipart([worker.address, PPP_HEARTBEAT], zmq.NOBLOCK)
+                        except zmq.ZMQError:
+                            pass  # fila cheia ou servidor sumido: o liveness resolve
+                    heartbeat_at = now + HEARTBEAT_INTERVAL
+                    self.purge_workers()
+                
+                if now >= report_at:
+                    self.report()
+                    report_at = now + STATS_INTERVAL
+                
+                if now >= ring_at:
+                    self.request_ring()
+                    ring_at = now + BROKER_RING_REFRESH
+        except KeyboardInterrupt:
+            print("Broker encerrado")
+        finally:
+            self.frontend.close()
+            self.backend.close()
+            if self.reference is not None:
+                self.reference.close()
+            self.context.term()
+
+class ShardedBroker:
+    """pares frontend/backend independentes, um zmq.proxy por thread, sem despachante central
+    
+    o cliente escolhe o shard pelo hash da identidade e conecta direto no frontend dele
+    (common/shards.py); o shard 0 também atende na porta 5555, pra clientes que não escolhem.
+    os servidores conectam em todos os backends.
+    """
+    
+    def __init__(self, shards=BROKER_SHARDS):
+        self.context = zmq.Context(io_threads=BROKER_IO_THREADS)
+        self.shards = shards
+        
+        self.frontends = []
+        self.backends = []
+        for index in range(shards):
+            frontend = configure(self.context.socket(zmq.ROUTER), "BROKER_FRONTEND")
+            frontend.bind(f"tcp://*:{BROKER_SHARD_FRONTEND_BASE + index}")
+            if index == 0:
+                frontend.bind("tcp://*:5555")
+            backend = configure(self.context.socket(zmq.DEALER), "BROKER_BACKEND")
+            backend.bind(f"tcp://*:{BROKER_SHARD_BACKEND_BASE + index}")
+            self.frontends.append(frontend)
+            self.backends.append(backend)
+        
+        # zmq.proxy encaminha sem passar pelo Python, como no modo proxy
+        self.metrics = Metrics("broker")
+        self.metrics.start(self.context)
+        
+        print(f"Broker iniciado em modo sharded ({shards} shards, {BROKER_IO_THREADS} threads de I/O, "
+              f"frontends nas portas {BROKER_SHARD_FRONTEND_BASE}-{BROKER_SHARD_FRONTEND_BASE + shards - 1}, "
+              f"backends nas portas {BROKER_SHARD_BACKEND_BASE}-{BROKER_SHARD_BACKEND_BASE + shards - 1})")
+    
+    def run_shard(self, index):
+        """thread de um shard: zmq.proxy libera o GIL, então os shards rodam em paralelo"""
+        try:
+            zmq.proxy(self.frontends[index], self.backends[index])
+        except zmq.ContextTerminated:
+            pass
+        finally:
+            self.frontends[index].close()
+            self.backends[index].close()
+    
+    def run(self):
+        """sobe uma thread por shard e espera (a thread principal não encaminha nada)"""
+        threads = [threading.Thread(target=self.run_shard, args=(index,), daemon=True) for index in range(self.shards)]
+        for shard_thread in threads:
+            shard_thread.start()
+        try:
+            for shard_thread in threads:
+                # join com prazo pra o KeyboardInterrupt chegar na thread principal
+                while shard_thread.is_alive():
+                    shard_thread.join(1.0)
+        except KeyboardInterrupt:
+            print("Broker encerrado")
+        finally:
+            self.context.term()
+
 if __name__ == "__main__":
-    broker = Broker()
+    if BROKER_MODE == "lb":
+        broker = LoadBalancingBroker()
+    elif BROKER_MODE == "sharded":
+        broker = ShardedBroker()
+    else:
+        broker = Broker()
     broker.run()
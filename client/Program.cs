@@ -1,4 +1,5 @@
 using System;
+using System.Buffers.Binary;
 using System.Threading;
 using System.Threading.Tasks;
 using NetMQ;
@@ -25,6 +26,12 @@ namespace ChatClient
         private bool running = true;
         private int logicalClock = 0;
 
+        // Frame das publicações (ver server/frame.js): cabeçalho fixo + corpo MessagePack
+        private const byte FrameMagic = 0xC1;
+        private const byte FramePublish = 1;
+        private const byte FrameMessage = 2;
+        private const int FrameHeaderSize = 24;
+
         public Client()
         {
             // Socket REQ para comunicação com servidor
@@ -34,7 +41,7 @@ namespace ChatClient
             // Socket SUB para receber mensagens
             subSocket = new SubscriberSocket();
             subSocket.Connect("tcp://proxy:5558");
-            subSocket.Subscribe("");
+            // inscrições só no próprio usuário e nos canais escolhidos (ver SubscribeToUser/SubscribeToChannel)
             
             Console.WriteLine("Cliente iniciado");
         }
@@ -269,13 +276,14 @@ namespace ChatClient
 
         public void SubscribeToUser(string username)
         {
-            subSocket.Subscribe(username);
+            // tópicos com prefixo: @usuário e #canal (mesmo formato de server/main.js)
+            subSocket.Subscribe("@" + username);
             Console.WriteLine($"Inscrito para receber mensagens de: {username}");
         }
 
         public void SubscribeToChannel(string channel)
         {
-            subSocket.Subscribe(channel);
+            subSocket.Subscribe("#" + channel);
             Console.WriteLine($"Inscrito no canal: {channel}");
         }
 
@@ -297,6 +305,23 @@ namespace ChatClient
                         {
                             try
                             {
+                                if (messageBytes.Length >= FrameHeaderSize && messageBytes[0] == FrameMagic)
+                                {
+                                    // Frame: tipo no cabeçalho, só o corpo (dados da mensagem) é deserializado
+                                    byte frameType = messageBytes[1];
+                                    int bodyLength = (int)BinaryPrimitives.ReadUInt32BigEndian(messageBytes.AsSpan(20, 4));
+                                    var body = MessagePackSerializer.Deserialize<dynamic>(new ReadOnlyMemory<byte>(messageBytes, FrameHeaderSize, bodyLength));
+                                    if (frameType == FramePublish)
+                                    {
+                                        Console.WriteLine($"[{topic}] {body.user}: {body.message}");
+                                    }
+                                    else if (frameType == FrameMessage)
+                                    {
+                                        Console.WriteLine($"Mensagem de {body.src}: {body.message}");
+                                    }
+                                    continue;
+                                }
+                                
                                 // Deserializar MessagePack
                                 var data = MessagePackSerializer.Deserialize<dynamic>(messageBytes);
                                 
@@ -0,0 +1,66 @@
+"""codec msgpack compartilhado pelos componentes Python (reference, bot)
+
+reaproveita o msgpack.Packer em vez de criar um packer a cada msgpack.packb, e
+decodifica no envelope fixo {service, data}. JSON só é aceito quando habilitado
+(CODEC_ALLOW_JSON=1), pra clientes antigos.
+
+a decodificação usa msgpack.unpackb: cada frame zmq traz exatamente uma mensagem
+e, medido em benchmarks/codec.py, um Unpacker reaproveitado (feed + checagem de
+bytes sobrando) sai mais caro que o unpackb.
+
+o Packer guarda estado do buffer: usar um Codec por thread.
+"""
+import os
+import json
+import msgpack
+
+ALLOW_JSON = os.environ.get("CODEC_ALLOW_JSON", "0") == "1"
+
+class CodecError(ValueError):
+    """mensagem que não é um envelope {service, data} válido"""
+
+class Envelope:
+    __slots__ = ("service", "data", "trace")
+    
+    def __init__(self, service, data, trace=None):
+        self.service = service
+        self.data = data
+        self.trace = trace  # {id, sent, ...} só nas mensagens amostradas (ver common/metrics.py)
+    
+    def __repr__(self):
+        return f"Envelope(service={self.service!r}, data={self.data!r}, trace={self.trace!r})"
+
+class Codec:
+    def __init__(self, allow_json=ALLOW_JSON):
+        self.allow_json = allow_json
+        self.packer = msgpack.Packer(autoreset=True)
+    
+    def encode(self, service, data, trace=None):
+        """serializa um envelope {service, data} (com trace, se houver)"""
+        if trace is None:
+            return self.packer.pack({"service": service, "data": data})
+        return self.packer.pack({"service": service, "data": data, "trace": trace})
+    
+    def pack(self, obj):
+        """serializa um objeto qualquer reaproveitando o packer"""
+        return self.packer.pack(obj)
+    
+    def unpack(self, payload):
+        """desserializa um único objeto msgpack (bytes extras são erro)"""
+        return msgpack.unpackb(payload, raw=False)
+    
+    def decode(self, payload):
+        """decodifica um envelope; JSON só se allow_json estiver ligado"""
+        try:
+            obj = msgpack.unpackb(payload, raw=False)
+        except Exception as error:
+            if not self.allow_json:
+                raise CodecError(f"Formato de mensagem inválido: {error}")
+            try:
+                obj = json.loads(bytes(payload).decode("utf-8"))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                raise CodecError("Formato de mensagem inválido")
+        
+        if obj.__class__ is not dict:
+            raise CodecError("Mensagem não é um objeto")
+        return Envelope(obj.get("service"), obj.get("data") or {}, obj.get("trace"))
@@ -0,0 +1,31 @@
+"""controle de fluxo dos componentes Python: limites de fila dos sockets e o sinal de ocupado
+
+cada socket tem um nome (ex: BROKER_FRONTEND) e lê <NOME>_SNDHWM, <NOME>_RCVHWM e
+<NOME>_LINGER do ambiente; sem a variável vale o padrão de quem cria o socket. o HWM
+conta mensagens por conexão (o padrão do libzmq é 1000); o que passa disso é
+descartado (PUB/XPUB) ou bloqueia/falha o envio (DEALER/ROUTER), então cada
+componente decide o que fazer e conta nas métricas.
+
+sobrecarga vira resposta explícita: o broker responde com status BUSY_STATUS em vez de
+enfileirar sem limite, e o bot reduz o próprio ritmo quando recebe isso.
+"""
+import os
+import zmq
+
+# status das respostas de quem está sobrecarregado (o cliente deve esperar e reduzir o ritmo)
+BUSY_STATUS = "ocupado"
+
+def env_int(name, default):
+    value = os.environ.get(name, "")
+    return int(value) if value else default
+
+def configure(socket, name, sndhwm=1000, rcvhwm=1000, linger=-1):
+    """aplica HWMs e linger do socket `name` (antes do bind/connect) e devolve o socket"""
+    socket.setsockopt(zmq.SNDHWM, env_int(f"{name}_SNDHWM", sndhwm))
+    socket.setsockopt(zmq.RCVHWM, env_int(f"{name}_RCVHWM", rcvhwm))
+    socket.setsockopt(zmq.LINGER, env_int(f"{name}_LINGER", linger))
+    return socket
+
+def is_busy(data):
+    """se a resposta é o sinal de ocupado"""
+    return data.get("status") == BUSY_STATUS
@@ -0,0 +1,83 @@
+"""frame das publicações: cabeçalho fixo na frente de um corpo msgpack opaco
+
+gêmeo de server/frame.js (mantenha em sincronia, e client/Program.cs). o servidor
+codifica a publicação uma vez e o mesmo buffer vai pro tópico dos clientes, pro lote
+de replicação e pro cache do proxy; quem recebe lê o cabeçalho (struct.unpack_from,
+sem cópia) e só decodifica o corpo, por uma fatia memoryview, se precisar dele. encode
+monta o mesmo frame do lado Python (benchmarks e testes: tests/fixtures/frames.json tem
+frames de referência que os dois lados precisam produzir e ler byte a byte).
+
+cabeçalho big-endian de HEADER.size (24) bytes: magic 0xC1 (o único byte que o msgpack
+nunca usa, então não se confunde com um envelope), tipo, flags, reservado, id do canal
+(hash32 do tópico, o mesmo do anel), relógio lógico (u64), seq do registro na origem e
+tamanho do corpo. o corpo é o `data` da publicação; com a flag TRACED o trace vem em
+msgpack logo depois dele.
+
+o id do canal é só um filtro: dois tópicos podem ter o mesmo hash32, então quem casa pelo
+id confirma pelo corpo (channel, ou dst das mensagens diretas) antes de usar a publicação.
+
+os frames chegam copiados (sem copy=False): pras publicações do chat, de poucas centenas
+de bytes, o zmq.Frame sai mais caro que a cópia (medido em benchmarks/frames.py).
+"""
+import struct
+import msgpack
+from common.ring import hash32
+from common.metrics import TRACE_MARKER
+
+MAGIC = 0xC1
+PUBLISH = 1
+MESSAGE = 2
+TRACED = 1
+HEADER = struct.Struct(">BBBBIQII")
+
+SERVICES = {PUBLISH: "publish", MESSAGE: "message"}
+
+def channel_id(topic):
+    """id do canal no cabeçalho: hash32 do tópico (#canal, @usuário)"""
+    return hash32(topic)
+
+def encode(kind, topic, clock, seq, data, trace=None):
+    """frame de uma publicação, o mesmo do encodeFrame do servidor"""
+    body = msgpack.packb(data)
+    frame = HEADER.pack(MAGIC, kind, TRACED if trace else 0, 0, channel_id(topic), clock or 0, seq or 0, len(body)) + body
+    return frame + msgpack.packb(trace) if trace else frame
+
+def is_frame(payload):
+    """se o payload é um frame (e não um envelope msgpack)"""
+    return len(payload) >= HEADER.size and payload[0] == MAGIC
+
+def header(payload):
+    """(tipo, flags, id do canal, relógio, seq, tamanho do corpo), sem decodificar o corpo"""
+    _, kind, flags, _, channel, clock, seq, length = HEADER.unpack_from(payload)
+    return kind, flags, channel, clock, seq, length
+
+def body(payload, length):
+    """decodifica só o corpo (o `data` da publicação)"""
+    return msgpack.unpackb(memoryview(payload)[HEADER.size:HEADER.size + length], raw=False)
+
+def trace_of(payload):
+    """trace de uma publicação (frame ou envelope), ou None"""
+    if is_frame(payload):
+        _, flags, _, _, _, length = header(payload)
+        if not flags & TRACED:
+            return None
+        return msgpack.unpackb(memoryview(payload)[HEADER.size + length:], raw=False)
+    if TRACE_MARKER not in payload:
+        return None
+    return msgpack.unpackb(payload, raw=False).get("trace")
+
+def traced(payload):
+    """se a publicação pode ter trace: a flag do frame ou o marcador no envelope"""
+    if is_frame(payload):
+        return bool(payload[2] & TRACED)
+    return TRACE_MARKER in payload
+
+def decode(payload):
+    """publicação como envelope {service, data[, trace]}, seja frame ou envelope msgpack"""
+    if not is_frame(payload):
+        return msgpack.unpackb(payload, raw=False)
+    kind, flags, _, _, _, length = header(payload)
+    message = {"service": SERVICES.get(kind), "data": body(payload, length)}
+    if flags & TRACED:
+        message["trace"] = msgpack.unpackb(memoryview(payload)[HEADER.size + length:], raw=False)
+    return message
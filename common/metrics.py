@@ -0,0 +1,238 @@
+"""métricas dos componentes Python (broker, proxy, reference, bot): contadores e histogramas
+
+cada processo tem um registro (Metrics) com contadores e histogramas de latência em µs.
+os histogramas têm tamanho fixo (faixas log-lineares, estilo HDR): registrar é um
+índice numa lista, sem alocação, então dá pra deixar ligado no caminho quente.
+
+rastreamento: uma fração das requisições (TRACE_SAMPLE) sai com um campo "trace" no
+envelope, {id, sent}, com o instante de envio em µs desde a época. o servidor devolve
+o trace na resposta com o tempo que gastou (server_us) e copia pra publicação com o
+instante em que publicou (pub), então cada salto mede o próprio trecho.
+
+exposição: com METRICS_ENDPOINT (ex: tcp://*:5564) um socket REP numa thread devolve
+o snapshot em msgpack; com METRICS_FILE o snapshot é gravado em JSON a cada
+METRICS_INTERVAL segundos.
+
+uso: python common/metrics.py [endpoint]   (snapshot de um processo em execução)
+"""
+import os
+import sys
+import json
+import time
+import random
+import threading
+import msgpack
+import zmq
+
+METRICS_ENDPOINT = os.environ.get("METRICS_ENDPOINT", "")
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", "10"))
+# fração das requisições rastreadas (0 desliga, 1 rastreia todas)
+TRACE_SAMPLE = float(os.environ.get("TRACE_SAMPLE", "0.01"))
+
+# 32 faixas exatas pra 0..31, depois 16 sub-faixas por potência de 2: erro relativo < 7%
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << (SUB_BUCKET_BITS - 1)
+MAX_SHIFT = 32  # valores acima de ~2^37 µs (38 horas) caem na última faixa
+BUCKETS = 2 * SUB_BUCKETS + MAX_SHIFT * SUB_BUCKETS
+
+def now_us():
+    """instante atual em µs desde a época (comparável entre processos da mesma máquina)"""
+    return time.time_ns() // 1000
+
+def bucket_of(value):
+    """índice da faixa de um valor (µs)"""
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    if shift <= 0:
+        return value
+    if shift > MAX_SHIFT:
+        return BUCKETS - 1
+    return 2 * SUB_BUCKETS + (shift - 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+def bucket_limit(index):
+    """maior valor que cai na faixa"""
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift, mantissa = divmod(index - 2 * SUB_BUCKETS, SUB_BUCKETS)
+    return ((mantissa + SUB_BUCKETS + 1) << (shift + 1)) - 1
+
+class Histogram:
+    """histograma log-linear de latências (µs) com número fixo de faixas"""
+    __slots__ = ("counts", "total", "sum", "max")
+    
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+    
+    @classmethod
+    def from_summary(cls, summary):
+        """histograma refeito a partir do resumo (em JSON as chaves das faixas viram texto)"""
+        histogram = cls()
+        for index, count in summary["buckets"].items():
+            histogram.counts[int(index)] = count
+        histogram.total = summary["count"]
+        histogram.sum = round(summary["mean"] * summary["count"])
+        histogram.max = summary["max"]
+        return histogram
+    
+    def record(self, value):
+        """registra uma amostra (negativos contam como 0)"""
+        value = int(value) if value > 0 else 0
+        self.counts[bucket_of(value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+    
+    def merge(self, other):
+        """soma as contagens de outro histograma"""
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+    
+    def percentile(self, fraction):
+        """limite superior da faixa que contém o percentil (0 se vazio)"""
+        if not self.total:
+            return 0
+        target = fraction * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(bucket_limit(index), self.max)
+        return self.max
+    
+    def summary(self):
+        """resumo serializável: contagem, média, percentis e as faixas não vazias"""
+        return {
+            "count": self.total,
+            "mean": self.sum / self.total if self.total else 0,
+            "p50": self.percentile(0.50),
+            "p90": self.percentile(0.90),
+            "p99": self.percentile(0.99),
+            "p999": self.percentile(0.999),
+            "max": self.max,
+            "buckets": {index: count for index, count in enumerate(self.counts) if count}
+        }
+
+class Metrics:
+    """registro de contadores e histogramas de um processo (seguro entre threads)"""
+    
+    def __init__(self, component):
+        self.component = component
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+    
+    def count(self, name, amount=1):
+        """soma ao contador"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def observe(self, name, value):
+        """registra uma amostra (µs) no histograma"""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[name] = histogram
+            histogram.record(value)
+    
+    def histogram(self, name):
+        """cópia do histograma (vazio se não existir)"""
+        copy = Histogram()
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is not None:
+                copy.merge(histogram)
+        return copy
+    
+    def snapshot(self):
+        """contadores e resumo dos histogramas"""
+        with self.lock:
+            return {
+                "component": self.component,
+                "pid": os.getpid(),
+                "uptime": time.time() - self.started,
+                "counters": dict(self.counters),
+                "histograms": {name: histogram.summary() for name, histogram in self.histograms.items()}
+            }
+    
+    def serve(self, context, endpoint):
+        """thread do REP: cada requisição recebe o snapshot atual"""
+        socket = context.socket(zmq.REP)
+        socket.bind(endpoint)
+        try:
+            while True:
+                socket.recv()
+                socket.send(msgpack.packb(self.snapshot()))
+        except zmq.ContextTerminated:
+            pass
+        finally:
+            socket.close()
+    
+    def dump(self, path, interval):
+        """thread que grava o snapshot em JSON periodicamente (troca atômica do arquivo)"""
+        while True:
+            time.sleep(interval)
+            temp_path = path + ".tmp"
+            with open(temp_path, "w") as output:
+                json.dump(self.snapshot(), output)
+            os.replace(temp_path, path)
+    
+    def start(self, context, endpoint=METRICS_ENDPOINT, path=METRICS_FILE):
+        """expõe o registro no endpoint e/ou arquivo configurados (nenhum = só em memória)"""
+        if endpoint:
+            serve_thread = threading.Thread(target=self.serve, args=(context, endpoint))
+            serve_thread.daemon = True
+            serve_thread.start()
+            print(f"[METRICAS] {self.component}: snapshot em {endpoint}")
+        if path:
+            dump_thread = threading.Thread(target=self.dump, args=(path, METRICS_INTERVAL))
+            dump_thread.daemon = True
+            dump_thread.start()
+            print(f"[METRICAS] {self.component}: snapshot em {path} a cada {METRICS_INTERVAL}s")
+
+# chave "trace" codificada em msgpack (fixstr de 5 bytes): achar no payload é bem mais
+# barato que decodificar todas as mensagens pra descobrir as poucas rastreadas
+TRACE_MARKER = b"\xa5trace"
+
+def traced(payload):
+    """se o payload msgpack pode ter um campo trace"""
+    return TRACE_MARKER in payload
+
+def new_trace(sample=TRACE_SAMPLE):
+    """campo trace de uma requisição amostrada, ou None"""
+    if sample <= 0 or (sample < 1 and random.random() >= sample):
+        return None
+    return {"id": random.getrandbits(52), "sent": now_us()}
+
+def fetch(endpoint, timeout=5000):
+    """snapshot de um processo em execução"""
+    context = zmq.Context()
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.RCVTIMEO, timeout)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(endpoint)
+    try:
+        socket.send(b"")
+        return msgpack.unpackb(socket.recv(), raw=False, strict_map_key=False)
+    finally:
+        socket.close()
+        context.term()
+
+if __name__ == "__main__":
+    snapshot = fetch(sys.argv[1] if len(sys.argv) > 1 else "tcp://localhost:5564")
+    print(f"{snapshot['component']} (pid {snapshot['pid']}, {snapshot['uptime']:.0f}s)")
+    for name, value in sorted(snapshot["counters"].items()):
+        print(f"  {name}: {value}")
+    for name, summary in sorted(snapshot["histograms"].items()):
+        print(f"  {name}: n={summary['count']} média={summary['mean']:.0f}µs p50={summary['p50']}µs "
+              f"p90={summary['p90']}µs p99={summary['p99']}µs p99.9={summary['p999']}µs máx={summary['max']}µs")
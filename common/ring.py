@@ -0,0 +1,57 @@
+"""anel de hash consistente: donos das mensagens de cada canal/usuário entre os servidores
+
+gêmeo de server/hashRing.js (mantenha os dois em sincronia: broker e servidores precisam
+chegar aos mesmos donos). a chave é o tópico (#canal, @usuário, ver topics.py) e cai numa
+de PARTITIONS partições fixas; os donos de uma partição são os N primeiros servidores
+distintos a partir do início dela no anel, onde cada servidor tem VNODES pontos. os nomes
+vêm da lista do servidor de referência (o mesmo nome que o servidor usa como routing id
+no broker).
+"""
+import bisect
+import hashlib
+
+PARTITIONS = 64
+VNODES = 64
+RING_SIZE = 1 << 32
+
+def hash32(text):
+    """primeiros 4 bytes do md5, big-endian"""
+    return int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:4], "big")
+
+def partition_of(key):
+    """partição de uma chave (tópico)"""
+    return hash32(key) * PARTITIONS >> 32
+
+class HashRing:
+    """anel com VNODES pontos por servidor; owners() é memorizado por partição"""
+    
+    def __init__(self, names=()):
+        self.names = sorted(set(names))
+        points = sorted((hash32(f"{name}#{index}"), name) for name in self.names for index in range(VNODES))
+        self.points = [point for point, _ in points]
+        self.point_names = [name for _, name in points]
+        self.cache = {}  # {(partição, réplicas): [donos]}
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def owners(self, partition, replicas):
+        """os `replicas` primeiros servidores distintos a partir do início da partição, em ordem de preferência"""
+        owners = self.cache.get((partition, replicas))
+        if owners is not None:
+            return owners
+        count = min(replicas, len(self.names))
+        start = bisect.bisect_left(self.points, partition * (RING_SIZE // PARTITIONS))
+        owners = []
+        step = 0
+        while len(owners) < count:
+            name = self.point_names[(start + step) % len(self.points)]
+            if name not in owners:
+                owners.append(name)
+            step += 1
+        self.cache[(partition, replicas)] = owners
+        return owners
+    
+    def owners_of(self, key, replicas):
+        """donos das mensagens de uma chave"""
+        return self.owners(partition_of(key), replicas)
@@ -0,0 +1,27 @@
+"""escolha do shard do broker pelo cliente (BROKER_MODE=sharded)
+
+no modo sharded o broker sobe BROKER_SHARDS pares frontend/backend independentes, cada um
+com seu zmq.proxy numa thread, e nenhuma mensagem passa por um despachante em Python: o
+shard i atende clientes na porta BROKER_SHARD_FRONTEND_BASE + i. o cliente escolhe o shard
+pelo crc32 da própria identidade (o nome do usuário), então as requisições de um cliente
+seguem sempre pelo mesmo shard e mantêm a ordem. fora do modo sharded o endpoint fica como está.
+"""
+import os
+import zlib
+
+BROKER_MODE = os.environ.get("BROKER_MODE", "proxy")
+BROKER_SHARDS = int(os.environ.get("BROKER_SHARDS", "4"))
+BROKER_SHARD_FRONTEND_BASE = int(os.environ.get("BROKER_SHARD_FRONTEND_BASE", "5700"))  # shard i na porta base + i
+
+def shard_for(identity, shards=BROKER_SHARDS):
+    """shard de um cliente pelo hash da identidade (mesmo cliente, mesmo shard, mesma ordem)"""
+    if isinstance(identity, str):
+        identity = identity.encode("utf-8")
+    return zlib.crc32(identity) % shards
+
+def broker_endpoint(endpoint, identity):
+    """endpoint do broker pra um cliente: no modo sharded, a porta do frontend do shard dele"""
+    if BROKER_MODE != "sharded":
+        return endpoint
+    host = endpoint.rsplit(":", 1)[0]
+    return f"{host}:{BROKER_SHARD_FRONTEND_BASE + shard_for(identity)}"
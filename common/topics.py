@@ -0,0 +1,26 @@
+"""tópicos do pub/sub dos clientes (bot, benchmarks)
+
+canais e usuários têm prefixos diferentes (#canal, @usuário), então um canal e um
+usuário com o mesmo nome não recebem as mensagens um do outro. o tráfego interno
+dos servidores (servers, replication) vai por outro par XSUB/XPUB do proxy e não
+aparece aqui.
+
+mantenha em sincronia com server/main.js e client/Program.cs.
+"""
+
+CHANNEL_PREFIX = "#"
+USER_PREFIX = "@"
+
+def channel_topic(channel):
+    """tópico das publicações de um canal"""
+    return CHANNEL_PREFIX + channel
+
+def user_topic(user):
+    """tópico das mensagens diretas pra um usuário"""
+    return USER_PREFIX + user
+
+def topic_name(topic):
+    """nome do canal ou usuário, sem o prefixo"""
+    if topic[:1] in (CHANNEL_PREFIX, USER_PREFIX):
+        return topic[1:]
+    return topic
@@ -1,30 +1,678 @@
 import zmq
+import os
+import sys
+import time
+import fcntl
+import socket
+import struct
+import termios
+import threading
+import msgpack
+from zmq.utils.monitor import recv_monitor_message
+from collections import deque, OrderedDict
+
+# no container o common é montado em /app/common; rodando direto do repositório ele fica um nível acima
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.metrics import Metrics, now_us
+from common.frame import trace_of, traced
+from common.flow import configure
+
+# modo do proxy: "steerable" (zmq.proxy_steerable instrumentado) ou "lvc" (cache + replay pra quem entra depois)
+PROXY_MODE = os.environ.get("PROXY_MODE", "steerable")
+
+# socket de controle (PAUSE/RESUME/TERMINATE/STATISTICS) exposto pra operadores
+CONTROL_ENDPOINT = os.environ.get("PROXY_CONTROL_ENDPOINT", "tcp://*:5560")
+# endpoint extra opcional onde o fluxo capturado é republicado (ex: tcp://*:5561)
+CAPTURE_ENDPOINT = os.environ.get("PROXY_CAPTURE_ENDPOINT", "")
+# estatísticas por tópico na thread auxiliar (0 desliga a captura)
+STATS_ENABLED = os.environ.get("PROXY_STATS", "1") == "1"
+STATS_INTERVAL = float(os.environ.get("PROXY_STATS_INTERVAL", "10.0"))  # segundos entre relatórios
+STATS_SAMPLES = int(os.environ.get("PROXY_STATS_SAMPLES", "1024"))  # intervalos guardados por tópico
+STATS_TOP = int(os.environ.get("PROXY_STATS_TOP", "10"))  # tópicos exibidos por relatório
+CAPTURE_BATCH = 256  # frames capturados processados por vez com o lock das estatísticas
+
+# modo "lvc": últimas mensagens por tópico, com orçamento total de memória
+LVC_DEPTH = int(os.environ.get("PROXY_LVC_DEPTH", "50"))  # mensagens guardadas por tópico
+LVC_BYTES = int(os.environ.get("PROXY_LVC_BYTES", str(16 * 1024 * 1024)))  # orçamento total em bytes
+# tópicos que não são guardados nem reenviados (servers/replication já vão pelo plano interno)
+LVC_EXCLUDE = {topic.encode() for topic in os.environ.get("PROXY_LVC_EXCLUDE", "servers,replication").split(",") if topic}
+
+# modo "lvc" sem descarte silencioso: com PROXY_NODROP=1 o XPUB recusa o envio quando a fila de
+# algum assinante do tópico está cheia; a publicação espera num backlog do tópico e, se o
+# assinante lento não esvaziar em PROXY_SLOW_TIMEOUT (ou o backlog passar de PROXY_BACKLOG),
+# os assinantes travados são despejados (com PROXY_EVICT) e a publicação segue pros que têm
+# espaço; o que ficaria pra um assinante ainda cheio é descartado (slow_drops)
+PROXY_NODROP = os.environ.get("PROXY_NODROP", "0") == "1"
+PROXY_SLOW_TIMEOUT = float(os.environ.get("PROXY_SLOW_TIMEOUT", "0.5"))  # segundos
+PROXY_BACKLOG = int(os.environ.get("PROXY_BACKLOG", "10000"))  # publicações esperando, somando os tópicos
+FLUSH_INTERVAL = 0.001  # segundos entre tentativas de esvaziar o backlog (o XPUB não avisa quando há espaço)
+
+# despejo de assinantes lentos, nos dois modos: o XPUB não diz qual assinante está cheio, então
+# o proxy acompanha o fd de cada conexão aceita (monitor do socket) e a fila de envio do kernel
+# dela; quem passa PROXY_EVICT_TIMEOUT segundos sem a fila baixar de PROXY_EVICT_BYTES é
+# desconectado (slow_evictions)
+PROXY_EVICT = os.environ.get("PROXY_EVICT", "0") == "1"
+PROXY_EVICT_BYTES = int(os.environ.get("PROXY_EVICT_BYTES", str(64 * 1024)))
+PROXY_EVICT_TIMEOUT = float(os.environ.get("PROXY_EVICT_TIMEOUT", "5"))
+EVICT_CHECK_INTERVAL = 0.1  # segundos entre leituras da fila de cada assinante
+# bytes ainda não enviados/confirmados no socket (Linux; sem ele o despejo fica desligado)
+SIOCOUTQ = getattr(termios, "TIOCOUTQ", None)
+# tópico que nenhum cliente assina (os de chat começam com #/@): depois de uma desinscrição o
+# XPUB manual ainda direciona o próximo envio a quem saiu, e um envio vazio nele libera isso
+RELEASE_TOPIC = b"\x00"
+
+# par XSUB/XPUB separado pro tráfego interno dos servidores (servers, replication);
+# os clientes só se conectam ao XPUB dos tópicos de chat (5558)
+INTERNAL_FRONTEND = os.environ.get("PROXY_INTERNAL_FRONTEND", "tcp://*:5562")
+INTERNAL_BACKEND = os.environ.get("PROXY_INTERNAL_BACKEND", "tcp://*:5563")
+
+COMMANDS = (b"PAUSE", b"RESUME", b"TERMINATE", b"STATISTICS")
+
+# ordem dos 8 contadores devolvidos pelo STATISTICS do libzmq
+PROXY_COUNTERS = (
+    "frontend_msgs_in", "frontend_bytes_in", "frontend_msgs_out", "frontend_bytes_out",
+    "backend_msgs_in", "backend_bytes_in", "backend_msgs_out", "backend_bytes_out"
+)
+
+def percentile(samples, fraction):
+    """percentil de uma lista já ordenada"""
+    if not samples:
+        return 0.0
+    return samples[int(fraction * (len(samples) - 1))]
+
+def record_transit(metrics, payload):
+    """publicação rastreada: tempo entre o servidor publicar e o proxy encaminhar"""
+    try:
+        trace = trace_of(payload)
+    except Exception:
+        return
+    if isinstance(trace, dict) and "pub" in trace:
+        metrics.observe("transit_us", now_us() - trace["pub"])
+        metrics.count("traced")
+
+def run_internal_proxy(context):
+    """thread do plano interno: encaminha servers/replication entre os servidores"""
+    frontend = configure(context.socket(zmq.XSUB), "PROXY_INTERNAL_FRONTEND")
+    frontend.bind(INTERNAL_FRONTEND)
+    backend = configure(context.socket(zmq.XPUB), "PROXY_INTERNAL_BACKEND")
+    backend.bind(INTERNAL_BACKEND)
+    try:
+        zmq.proxy(frontend, backend)
+    except zmq.ContextTerminated:
+        pass
+    finally:
+        frontend.close()
+        backend.close()
+
+def start_internal_proxy(context):
+    """inicia o plano interno numa thread daemon"""
+    internal_thread = threading.Thread(target=run_internal_proxy, args=(context,))
+    internal_thread.daemon = True
+    internal_thread.start()
+    print(f"[PROXY] plano interno: {INTERNAL_FRONTEND} -> {INTERNAL_BACKEND}")
+
+class TopicStats:
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.last_arrival = None
+        self.intervals = deque(maxlen=STATS_SAMPLES)  # intervalos entre chegadas (segundos)
+        self.subscriptions = 0
+    
+    def record(self, size, now):
+        """contabiliza uma mensagem publicada no tópico"""
+        self.messages += 1
+        self.bytes += size
+        if self.last_arrival is not None:
+            self.intervals.append(now - self.last_arrival)
+        self.last_arrival = now
+    
+    def summary(self):
+        """resumo com p50/p99 do intervalo entre chegadas"""
+        intervals = sorted(self.intervals)
+        return {
+            "messages": self.messages,
+            "bytes": self.bytes,
+            "subscriptions": self.subscriptions,
+            "p50_ms": percentile(intervals, 0.50) * 1000,
+            "p99_ms": percentile(intervals, 0.99) * 1000
+        }
+
+class SlowSubscribers:
+    """acha e desconecta assinantes TCP/IPC que não leem a própria fila
+    
+    o monitor do XPUB dá o fd de cada conexão aceita; a fila de envio do kernel (SIOCOUTQ) de
+    quem não lê fica cheia enquanto a dos demais esvazia. o despejo é um shutdown() no fd: o
+    libzmq vê a conexão cair e descarta a fila do assinante, e o SUB reconecta e se inscreve de
+    novo (no lvc, recebendo o replay). nada disso mexe no XPUB: só a thread que chama check()
+    usa o monitor.
+    """
+    
+    def __init__(self, xpub, metrics, limit=PROXY_EVICT_BYTES, timeout=PROXY_EVICT_TIMEOUT):
+        self.monitor = xpub.get_monitor_socket(zmq.EVENT_ACCEPTED | zmq.EVENT_DISCONNECTED | zmq.EVENT_CLOSED)
+        self.metrics = metrics
+        self.limit = limit
+        self.timeout = timeout
+        self.peers = {}  # {fd: instante desde quando a fila não baixa do limite (None = baixou)}
+        self.evicted = set()  # fds já derrubados, até o monitor avisar que fecharam
+    
+    def handle_events(self):
+        """aplica as conexões aceitas e fechadas avisadas pelo monitor"""
+        while True:
+            try:
+                event = recv_monitor_message(self.monitor, zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            fd = int(event["value"])
+            if event["event"] == zmq.EVENT_ACCEPTED:
+                self.peers[fd] = None
+                self.evicted.discard(fd)
+            else:
+                self.peers.pop(fd, None)
+                self.evicted.discard(fd)
+    
+    def queued(self, fd):
+        """bytes na fila de envio do kernel pro assinante (None se o fd já não vale)"""
+        try:
+            return struct.unpack("i", fcntl.ioctl(fd, SIOCOUTQ, b"\0\0\0\0"))[0]
+        except OSError:
+            return None
+    
+    def check(self, now):
+        """despeja quem ficou `timeout` segundos com a fila acima do limite; devolve quantos"""
+        self.handle_events()
+        evicted = 0
+        for fd, since in list(self.peers.items()):
+            queued = self.queued(fd)
+            if queued is None or queued < self.limit:
+                self.peers[fd] = None
+            elif since is None:
+                self.peers[fd] = now
+            elif now - since >= self.timeout:
+                evicted += self.evict(fd, queued)
+        return evicted
+    
+    def evict_stalled(self):
+        """despeja agora todo assinante com a fila acima do limite (backlog do no-drop vencido)"""
+        self.handle_events()
+        evicted = 0
+        for fd in list(self.peers):
+            queued = self.queued(fd)
+            if queued is not None and queued >= self.limit:
+                evicted += self.evict(fd, queued)
+        return evicted
+    
+    def evict(self, fd, queued):
+        """derruba a conexão do assinante (o fd continua do libzmq: shutdown numa cópia dele)"""
+        if fd in self.evicted:
+            return 0
+        try:
+            peer = socket.socket(fileno=os.dup(fd))
+        except OSError:
+            return 0
+        try:
+            peer.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            return 0
+        finally:
+            peer.close()
+        self.evicted.add(fd)
+        self.peers.pop(fd, None)
+        self.metrics.count("slow_evictions")
+        print(f"[PROXY] assinante lento desconectado (fd {fd}, {queued} bytes na fila)")
+        return 1
+    
+    def run(self):
+        """thread do modo steerable: o encaminhamento fica no libzmq e a verificação aqui"""
+        try:
+            while True:
+                self.monitor.poll(EVICT_CHECK_INTERVAL * 1000)
+                self.check(time.time())
+        except zmq.ContextTerminated:
+            pass
+        finally:
+            self.monitor.close()
+
+def slow_subscribers(xpub, metrics):
+    """SlowSubscribers do XPUB, ou None se PROXY_EVICT estiver desligado ou sem SIOCOUTQ"""
+    if not PROXY_EVICT:
+        return None
+    if SIOCOUTQ is None:
+        print("[PROXY] PROXY_EVICT precisa de SIOCOUTQ (Linux); ignorado")
+        return None
+    print(f"[PROXY] despejo de assinantes lentos: fila acima de {PROXY_EVICT_BYTES} bytes por {PROXY_EVICT_TIMEOUT}s")
+    return SlowSubscribers(xpub, metrics)
 
 class Proxy:
     def __init__(self):
         self.context = zmq.Context()
         
         # Socket XSUB para receber publicações dos servidores
-        self.frontend = self.context.socket(zmq.XSUB)
+        self.frontend = configure(self.context.socket(zmq.XSUB), "PROXY_FRONTEND")
         self.frontend.bind("tcp://*:5557")
         
-        # Socket XPUB para enviar para clientes
-        self.backend = self.context.socket(zmq.XPUB)
+        # Socket XPUB para enviar para clientes (no loop do libzmq o no-drop travaria todos os
+        # tópicos atrás de um assinante lento, então aqui o XPUB descarta ao atingir o HWM)
+        self.backend = configure(self.context.socket(zmq.XPUB), "PROXY_BACKEND")
+        # repassar todas as (des)inscrições pra poder contar assinantes por tópico
+        self.backend.setsockopt(zmq.XPUB_VERBOSER, 1)
         self.backend.bind("tcp://*:5558")
         
+        # socket de controle do proxy_steerable (PAIR interno) e o REP externo que o alimenta
+        self.control = self.context.socket(zmq.PAIR)
+        self.control.bind("inproc://proxy-control")
+        self.control_client = self.context.socket(zmq.PAIR)
+        self.control_client.connect("inproc://proxy-control")
+        self.control_rep = self.context.socket(zmq.REP)
+        self.control_rep.bind(CONTROL_ENDPOINT)
+        
+        # socket de captura: PUB nunca bloqueia, então o caminho de encaminhamento não espera a thread auxiliar
+        self.capture = None
+        if STATS_ENABLED or CAPTURE_ENDPOINT:
+            self.capture = self.context.socket(zmq.PUB)
+            self.capture.bind("inproc://proxy-capture")
+            if CAPTURE_ENDPOINT:
+                self.capture.bind(CAPTURE_ENDPOINT)
+        
+        self.topics = {}  # {topic: TopicStats}
+        self.topics_lock = threading.Lock()
+        
+        # o encaminhamento fica dentro do libzmq: as publicações rastreadas são medidas na captura
+        self.metrics = Metrics("proxy")
+        self.metrics.start(self.context)
+        # sem no-drop aqui: assinante lento perde no HWM e, com PROXY_EVICT, é desconectado
+        self.slow = slow_subscribers(self.backend, self.metrics)
+        
+        if PROXY_NODROP:
+            print("[PROXY] PROXY_NODROP só vale no modo lvc; ignorado")
         print("Proxy iniciado")
     
+    def topic_stats(self, topic):
+        """estatísticas do tópico (cria se necessário)"""
+        stats = self.topics.get(topic)
+        if stats is None:
+            stats = TopicStats()
+            self.topics[topic] = stats
+        return stats
+    
+    def handle_captured(self, frames, now):
+        """classifica um frame capturado: (des)inscrição do XPUB ou publicação"""
+        if len(frames) == 1 and frames[0][:1] in (b"\x00", b"\x01"):
+            topic = frames[0][1:].decode("utf-8", "replace")
+            stats = self.topic_stats(topic)
+            if frames[0][:1] == b"\x01":
+                stats.subscriptions += 1
+            elif stats.subscriptions > 0:
+                stats.subscriptions -= 1
+            return
+        
+        # frames únicos restantes são comandos de controle, que o libzmq também captura
+        if len(frames) < 2:
+            return
+        
+        topic = frames[0].decode("utf-8", "replace")
+        self.topic_stats(topic).record(sum(len(frame) for frame in frames[1:]), now)
+        if traced(frames[-1]):
+            record_transit(self.metrics, frames[-1])
+    
+    def snapshot(self):
+        """resumo das estatísticas por tópico"""
+        with self.topics_lock:
+            return {topic: stats.summary() for topic, stats in self.topics.items()}
+    
+    def report(self):
+        """imprime os tópicos mais movimentados"""
+        snapshot = self.snapshot()
+        subscriptions = sum(summary["subscriptions"] for summary in snapshot.values())
+        busiest = sorted(snapshot.items(), key=lambda item: item[1]["messages"], reverse=True)[:STATS_TOP]
+        print(f"[PROXY] tópicos: {len(snapshot)}, inscrições ativas: {subscriptions}")
+        for topic, summary in busiest:
+            print(f"[PROXY]   {topic}: {summary['messages']} msgs, {summary['bytes']} bytes, "
+                  f"{summary['subscriptions']} inscrições, intervalo p50 {summary['p50_ms']:.1f}ms "
+                  f"p99 {summary['p99_ms']:.1f}ms")
+    
+    def stats_loop(self):
+        """thread auxiliar: consome a captura e mantém contadores por tópico"""
+        subscriber = self.context.socket(zmq.SUB)
+        subscriber.setsockopt(zmq.SUBSCRIBE, b"")
+        subscriber.connect("inproc://proxy-capture")
+        report_at = time.time() + STATS_INTERVAL
+        try:
+            while True:
+                if subscriber.poll(max(0, report_at - time.time()) * 1000):
+                    # no máximo CAPTURE_BATCH por vez com o lock: com tráfego contínuo a fila nunca
+                    # esvazia, e o STATISTICS e o relatório precisam do lock entre um lote e outro
+                    with self.topics_lock:
+                        for _ in range(CAPTURE_BATCH):
+                            try:
+                                frames = subscriber.recv_multipart(zmq.NOBLOCK)
+                            except zmq.Again:
+                                break
+                            self.handle_captured(frames, time.time())
+                if time.time() >= report_at:
+                    self.report()
+                    report_at = time.time() + STATS_INTERVAL
+        except zmq.ContextTerminated:
+            pass
+        finally:
+            subscriber.close()
+    
+    def control_loop(self):
+        """thread de controle: repassa comandos ao proxy e sempre responde ao REP"""
+        try:
+            while True:
+                command = self.control_rep.recv().strip().upper()
+                if command not in COMMANDS:
+                    response = {"status": "erro", "description": f"Comando '{command.decode('utf-8', 'replace')}' não reconhecido"}
+                    self.control_rep.send(msgpack.packb(response))
+                    continue
+                
+                self.control_client.send(command)
+                if command == b"STATISTICS":
+                    counters = [int.from_bytes(frame, sys.byteorder) for frame in self.control_client.recv_multipart()]
+                    response = {"status": "OK", "proxy": dict(zip(PROXY_COUNTERS, counters))}
+                    if STATS_ENABLED:
+                        response["topics"] = self.snapshot()
+                        response["metrics"] = self.metrics.snapshot()
+                else:
+                    response = {"status": "OK"}
+                print(f"[PROXY] comando de controle: {command.decode()}")
+                self.control_rep.send(msgpack.packb(response))
+        except zmq.ContextTerminated:
+            pass
+        finally:
+            self.control_rep.close()
+            self.control_client.close()
+    
+    def run(self):
+        """Loop principal do proxy"""
+        control_thread = threading.Thread(target=self.control_loop)
+        control_thread.daemon = True
+        control_thread.start()
+        start_internal_proxy(self.context)
+        
+        if STATS_ENABLED:
+            stats_thread = threading.Thread(target=self.stats_loop)
+            stats_thread.daemon = True
+            stats_thread.start()
+        
+        if self.slow is not None:
+            slow_thread = threading.Thread(target=self.slow.run)
+            slow_thread.daemon = True
+            slow_thread.start()
+        
+        try:
+            zmq.proxy_steerable(self.frontend, self.backend, self.capture, self.control)
+            print("Proxy encerrado via TERMINATE")
+        except KeyboardInterrupt:
+            print("Proxy encerrado")
+        finally:
+            self.frontend.close()
+            self.backend.close()
+            self.control.close()
+            if self.capture is not None:
+                self.capture.close()
+            self.context.term()
+
+class TopicCache:
+    def __init__(self):
+        self.payloads = deque()
+        self.bytes = 0
+
+class LastValueCacheProxy:
+    def __init__(self):
+        self.context = zmq.Context()
+        
+        # Socket XSUB para receber publicações dos servidores
+        self.frontend = configure(self.context.socket(zmq.XSUB), "PROXY_FRONTEND")
+        self.frontend.bind("tcp://*:5557")
+        
+        # Socket XPUB em modo manual: a primeira mensagem enviada após aplicar uma
+        # inscrição vai só pro assinante que acabou de se inscrever
+        self.backend = configure(self.context.socket(zmq.XPUB), "PROXY_BACKEND")
+        self.backend.setsockopt(zmq.XPUB_MANUAL_LAST_VALUE, 1)
+        if PROXY_NODROP:
+            self.backend.setsockopt(zmq.XPUB_NODROP, 1)
+        self.backend.bind("tcp://*:5558")
+        
+        self.cache = OrderedDict()  # {topic: TopicCache}, do menos pro mais recentemente usado
+        self.cached_bytes = 0
+        self.forwarded = 0
+        self.replayed = 0
+        self.evicted = 0
+        
+        # {topic: deque[(instante em que travou, frames)]} publicações esperando assinante lento (no-drop)
+        self.backlog = OrderedDict()
+        self.backlogged = 0
+        
+        # fanout_us: envio no XPUB (cópia pra fila de cada assinante), medido nas publicações rastreadas
+        # slow_stalls: vezes que um tópico travou num assinante lento; slow_drops: publicações
+        # que passaram do prazo e foram descartadas pros assinantes cheios (o XPUB não diz quantos);
+        # slow_evictions: assinantes lentos desconectados (PROXY_EVICT)
+        self.metrics = Metrics("proxy")
+        self.metrics.start(self.context)
+        self.slow = slow_subscribers(self.backend, self.metrics)
+        
+        print(f"Proxy iniciado em modo last-value cache (profundidade: {LVC_DEPTH}, orçamento: {LVC_BYTES} bytes"
+              f"{f', no-drop com prazo de {PROXY_SLOW_TIMEOUT}s' if PROXY_NODROP else ''})")
+    
+    def store(self, topic, payload):
+        """guarda a publicação no buffer circular do tópico (só depois de enviada: uma que
+        espera no backlog não entra no replay, senão quem se inscreve no meio a recebe duas vezes)"""
+        if topic in LVC_EXCLUDE:
+            return
+        
+        buffer = self.cache.get(topic)
+        if buffer is None:
+            buffer = TopicCache()
+            self.cache[topic] = buffer
+        else:
+            self.cache.move_to_end(topic)
+        
+        buffer.payloads.append(payload)
+        buffer.bytes += len(payload)
+        self.cached_bytes += len(payload)
+        if len(buffer.payloads) > LVC_DEPTH:
+            oldest = buffer.payloads.popleft()
+            buffer.bytes -= len(oldest)
+            self.cached_bytes -= len(oldest)
+        
+        # estourou o orçamento: descartar os tópicos usados há mais tempo
+        while self.cached_bytes > LVC_BYTES and self.cache:
+            _, evicted = self.cache.popitem(last=False)
+            self.cached_bytes -= evicted.bytes
+            self.evicted += 1
+    
+    def handle_subscription(self, message):
+        """aplica a (des)inscrição, repassa aos servidores e responde com o histórico"""
+        subscribe = message[:1] == b"\x01"
+        topic = message[1:]
+        try:
+            self.backend.setsockopt(zmq.SUBSCRIBE if subscribe else zmq.UNSUBSCRIBE, topic)
+        except zmq.ZMQError:
+            # assinante já desconectado
+            pass
+        self.frontend.send(message)
+        
+        if not subscribe:
+            # o próximo envio iria só pra quem acabou de sair: gastá-lo num tópico sem assinantes,
+            # pra não perder a próxima publicação dos demais nem mandar um replay a ninguém
+            self.send_lossy([RELEASE_TOPIC, b""])
+            return
+        
+        history = []
+        if topic in self.cache:
+            self.cache.move_to_end(topic)
+            history = list(self.cache[topic].payloads)
+        
+        # enviar mesmo vazio: o XPUB manual direciona o próximo envio ao assinante que acabou
+        # de se inscrever, então isso também libera o envio normal pros demais
+        replay = {
+            "service": "replay",
+            "data": {
+                "topic": topic.decode("utf-8", "replace"),
+                "messages": history,
+                "timestamp": int(time.time() * 1000)
+            }
+        }
+        self.send_lossy([topic, msgpack.packb(replay)])
+        self.replayed += len(history)
+    
+    def send_lossy(self, frames):
+        """envia descartando pra quem está com a fila cheia (comportamento padrão do XPUB)
+        
+        quem estava cheio perde esta mensagem (o HWM normal do libzmq); ele não é desconectado
+        nem desinscrito e volta a receber quando ler o bastante da própria fila.
+        """
+        if not PROXY_NODROP:
+            self.backend.send_multipart(frames)
+            return
+        self.backend.setsockopt(zmq.XPUB_NODROP, 0)
+        try:
+            self.backend.send_multipart(frames)
+        finally:
+            self.backend.setsockopt(zmq.XPUB_NODROP, 1)
+    
+    def forward(self, frames):
+        """encaminha uma publicação; no no-drop, espera no backlog do tópico se um assinante estiver cheio"""
+        if not PROXY_NODROP:
+            self.backend.send_multipart(frames)
+            self.sent(frames)
+            return
+        topic = frames[0]
+        pending = self.backlog.get(topic)
+        if pending is None:
+            try:
+                self.backend.send_multipart(frames, zmq.NOBLOCK)
+                self.sent(frames)
+                return
+            except zmq.Again:
+                # o XPUB só recusa se algum assinante deste tópico estiver no HWM
+                pending = self.backlog[topic] = deque()
+                self.metrics.count("slow_stalls")
+        # atrás das que já esperam, pra manter a ordem do tópico
+        pending.append((time.time(), frames))
+        self.backlogged += 1
+    
+    def sent(self, frames):
+        """publicação entregue ao XPUB: a partir daqui ela entra no cache do tópico"""
+        if len(frames) >= 2:
+            self.store(frames[0], frames[1])
+    
+    def flush_backlog(self):
+        """reenvia o que couber; o que passou do prazo (ou do limite) vai só pros assinantes com espaço"""
+        now = time.time()
+        for topic in list(self.backlog):
+            pending = self.backlog[topic]
+            while pending:
+                stalled_at, frames = pending[0]
+                try:
+                    self.backend.send_multipart(frames, zmq.NOBLOCK)
+                except zmq.Again:
+                    if now - stalled_at < PROXY_SLOW_TIMEOUT and self.backlogged <= PROXY_BACKLOG:
+                        break
+                    # prazo vencido: derrubar quem travou o tópico; a publicação segue pros demais
+                    # (quem foi derrubado e ainda não saiu do XPUB é o único que a perde)
+                    if self.slow is not None:
+                        self.slow.evict_stalled()
+                    self.send_lossy(frames)
+                    self.metrics.count("slow_drops")
+                self.sent(frames)
+                pending.popleft()
+                self.backlogged -= 1
+            if not pending:
+                del self.backlog[topic]
+    
+    def report(self):
+        """imprime o estado do cache"""
+        print(f"[PROXY] encaminhadas: {self.forwarded}, reenviadas: {self.replayed}, tópicos em cache: {len(self.cache)}, "
+              f"bytes em cache: {self.cached_bytes}/{LVC_BYTES}, tópicos descartados: {self.evicted}")
+        if PROXY_NODROP:
+            counters = self.metrics.snapshot()["counters"]
+            slow = ", ".join(f"{topic.decode('utf-8', 'replace')}={len(pending)}" for topic, pending in self.backlog.items())
+            print(f"[PROXY] no-drop: esperando {self.backlogged} ({slow or 'nenhum tópico travado'}), "
+                  f"travamentos: {counters.get('slow_stalls', 0)}, descartadas pra assinantes lentos: "
+                  f"{counters.get('slow_drops', 0)}")
+        if self.slow is not None:
+            counters = self.metrics.snapshot()["counters"]
+            print(f"[PROXY] assinantes acompanhados: {len(self.slow.peers)}, desconectados por lentidão: "
+                  f"{counters.get('slow_evictions', 0)}")
+    
     def run(self):
         """Loop principal do proxy"""
+        start_internal_proxy(self.context)
+        poller = zmq.Poller()
+        poller.register(self.frontend, zmq.POLLIN)
+        poller.register(self.backend, zmq.POLLIN)
+        report_at = time.time() + STATS_INTERVAL
+        check_at = time.time() + EVICT_CHECK_INTERVAL
+        
         try:
-            zmq.proxy(self.frontend, self.backend)
+            while True:
+                timeout = max(0, report_at - time.time())
+                if self.slow is not None:
+                    timeout = min(timeout, max(0, check_at - time.time()))
+                if self.backlog:
+                    timeout = min(timeout, FLUSH_INTERVAL)
+                events = dict(poller.poll(timeout * 1000))
+                
+                if self.slow is not None and time.time() >= check_at:
+                    self.slow.check(time.time())
+                    check_at = time.time() + EVICT_CHECK_INTERVAL
+                
+                if self.backlog:
+                    self.flush_backlog()
+                
+                if self.frontend in events:
+                    # [topic, payload] vindo dos servidores
+                    frames = self.frontend.recv_multipart()
+                    if len(frames) >= 2 and traced(frames[-1]):
+                        started = time.perf_counter()
+                        self.forward(frames)
+                        self.metrics.observe("fanout_us", (time.perf_counter() - started) * 1e6)
+                        record_transit(self.metrics, frames[-1])
+                    else:
+                        self.forward(frames)
+                    self.forwarded += 1
+                
+                if self.backend in events:
+                    message = self.backend.recv()
+                    if message[:1] in (b"\x00", b"\x01"):
+                        self.handle_subscription(message)
+                
+                if time.time() >= report_at:
+                    self.report()
+                    report_at = time.time() + STATS_INTERVAL
         except KeyboardInterrupt:
             print("Proxy encerrado")
         finally:
+            if self.slow is not None:
+                self.slow.monitor.close()
             self.frontend.close()
             self.backend.close()
             self.context.term()
 
+def send_command(command, endpoint="tcp://localhost:5560"):
+    """envia um comando de controle pro proxy e devolve a resposta"""
+    context = zmq.Context()
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.RCVTIMEO, 5000)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(endpoint)
+    try:
+        socket.send_string(command)
+        return msgpack.unpackb(socket.recv(), raw=False)
+    finally:
+        socket.close()
+        context.term()
+
 if __name__ == "__main__":
-    proxy = Proxy()
-    proxy.run()
+    if len(sys.argv) > 1:
+        # uso: python main.py PAUSE|RESUME|TERMINATE|STATISTICS [endpoint]
+        print(send_command(*sys.argv[1:3]))
+    elif PROXY_MODE == "lvc":
+        proxy = LastValueCacheProxy()
+        proxy.run()
+    else:
+        proxy = Proxy()
+        proxy.run()
@@ -1,24 +1,203 @@
 import zmq
-import json
+import os
+import sys
 import time
-import threading
+import heapq
+import struct
+import zlib
 import msgpack
+from collections import OrderedDict, deque
 from datetime import datetime
 
+# no container o codec é montado em /app/common; rodando direto do repositório ele fica um nível acima
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.codec import Codec, CodecError
+from common.metrics import Metrics
+
+# tempo sem heartbeat até o servidor ser removido (segundos)
+SERVER_TIMEOUT = float(os.environ.get("REFERENCE_SERVER_TIMEOUT", "30"))
+# logs de cada requisição/resposta (caminho quente) - desligados por padrão
+VERBOSE = os.environ.get("REFERENCE_VERBOSE", "0") == "1"
+# requisições drenadas do socket por volta do poll
+RECV_BATCH = 256
+# endereço do ROUTER que atende os servidores e o broker
+BIND_ENDPOINT = os.environ.get("REFERENCE_BIND_ENDPOINT", "tcp://*:5559")
+# diretório do registro persistente de ranks (snapshot + log append-only)
+REGISTRY_DIR = os.environ.get("REFERENCE_DATA_DIR", "/app/data")
+# registros no log até gerar um novo snapshot
+COMPACT_EVERY = int(os.environ.get("REFERENCE_COMPACT_EVERY", "1000"))
+# cabeçalho de cada registro do log: tamanho do payload e crc32
+RECORD_HEADER = struct.Struct("<II")
+# remoções lembradas pra responder listas incrementais (acima disso o cliente recebe a lista completa)
+MAX_TOMBSTONES = int(os.environ.get("REFERENCE_MAX_TOMBSTONES", "1024"))
+# serviços com histograma próprio; o resto (nome vindo do cliente) cai em handle_us.unknown
+METRIC_SERVICES = frozenset(("rank", "list", "heartbeat", "batch", "error"))
+
+def metric_service(service):
+    """nome do serviço nas métricas: um dos conhecidos ou "unknown" (o nome vem do cliente)"""
+    if isinstance(service, str) and service in METRIC_SERVICES:
+        return service
+    return "unknown"
+
+class RankRegistry:
+    def __init__(self, directory, compact_every=COMPACT_EVERY):
+        self.directory = directory
+        self.compact_every = compact_every
+        self.snapshot_path = os.path.join(directory, "ranks.snapshot")
+        self.log_path = os.path.join(directory, "ranks.log")
+        os.makedirs(directory, exist_ok=True)
+        
+        self.ranks = {}  # {server_name: rank} - ranks nunca são reaproveitados
+        self.next_rank = 1
+        self.log_records = 0
+        self.load()
+        self.log = open(self.log_path, "ab")
+    
+    def apply(self, server_name, rank):
+        """aplica uma atribuição em memória"""
+        self.ranks[server_name] = rank
+        self.next_rank = max(self.next_rank, rank + 1)
+    
+    def load(self):
+        """carrega o snapshot e reaplica o log; registros incompletos no fim são descartados"""
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, "rb") as snapshot:
+                    data = msgpack.unpackb(snapshot.read(), raw=False)
+                self.ranks = data["ranks"]
+                self.next_rank = data["next_rank"]
+            except Exception as e:
+                print(f"[REGISTRO] Erro ao ler snapshot, usando apenas o log: {e}")
+        
+        if not os.path.exists(self.log_path):
+            return
+        
+        with open(self.log_path, "rb") as log:
+            buffer = log.read()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(buffer):
+            size, checksum = RECORD_HEADER.unpack_from(buffer, offset)
+            start = offset + RECORD_HEADER.size
+            payload = buffer[start:start + size]
+            if len(payload) < size or zlib.crc32(payload) != checksum:
+                break
+            server_name, rank = msgpack.unpackb(payload, raw=False)
+            self.apply(server_name, rank)
+            self.log_records += 1
+            offset = start + size
+        
+        if offset < len(buffer):
+            # escrita interrompida por queda: cortar o registro incompleto
+            print(f"[REGISTRO] Descartando {len(buffer) - offset} bytes incompletos no fim do log")
+            with open(self.log_path, "r+b") as log:
+                log.truncate(offset)
+        
+        print(f"[REGISTRO] {len(self.ranks)} ranks carregados ({self.log_records} registros no log), próximo rank: {self.next_rank}")
+    
+    def assign(self, server_name):
+        """rank do servidor, atribuindo e gravando em disco se for novo"""
+        rank = self.ranks.get(server_name)
+        if rank is not None:
+            return rank
+        
+        rank = self.next_rank
+        payload = msgpack.packb([server_name, rank])
+        self.log.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        self.apply(server_name, rank)
+        
+        self.log_records += 1
+        if self.log_records >= self.compact_every:
+            self.compact()
+        return rank
+    
+    def compact(self):
+        """grava um snapshot atômico com todos os ranks e zera o log"""
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "wb") as snapshot:
+            snapshot.write(msgpack.packb({"next_rank": self.next_rank, "ranks": self.ranks}))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        
+        # se cair antes de zerar o log, o replay só reaplica atribuições iguais
+        self.log.close()
+        self.log = open(self.log_path, "wb")
+        os.fsync(self.log.fileno())
+        self.log_records = 0
+    
+    def close(self):
+        """fecha o log"""
+        self.log.close()
+
 class ReferenceServer:
     def __init__(self):
         self.context = zmq.Context()
         
-        # socket rep pra responder requisições dos servidores
-        self.rep_socket = self.context.socket(zmq.REP)
-        self.rep_socket.bind("tcp://*:5559")
+        # socket router pra atender vários servidores ao mesmo tempo (compatível com os REQ deles)
+        self.router_socket = self.context.socket(zmq.ROUTER)
+        self.router_socket.bind(BIND_ENDPOINT)
+        # codec com o Packer reaproveitado entre requisições (só o loop principal usa)
+        self.codec = Codec()
         
         # dados dos servidores
-        self.servers = {}  # {server_name: {"rank": rank, "last_heartbeat": timestamp}}
-        self.next_rank = 1
+        self.servers = {}  # {server_name: {"rank": rank, "last_heartbeat": timestamp, "deadline": instante de expiração}}
+        # ranks persistidos: continuam os mesmos se o servidor de referência reiniciar
+        self.registry = RankRegistry(REGISTRY_DIR)
+        # heap de (deadline, server_name); entradas antigas são descartadas ao sair do heap
+        self.expiry_heap = []
+        
+        # versão da tabela: muda quando um servidor entra ou sai (rank/liveness), não a cada heartbeat
+        self.version = 0
+        # a versão só existe em memória e recomeça do zero: a época (32 bits, cabe num número do
+        # JS) distingue as instâncias, e um `since` de outra época recebe a lista completa
+        self.epoch = int.from_bytes(os.urandom(4), "big")
+        self.changes = OrderedDict()  # {server_name: versão da última mudança}, da mais antiga pra mais recente
+        self.tombstones = deque()  # (versão, server_name) de servidores removidos
+        self.tombstone_floor = 0  # listas incrementais anteriores a esta versão precisam da lista completa
+        
+        # handle_us.<serviço>: decodificar, processar e codificar a resposta (unknown pros não reconhecidos)
+        self.metrics = Metrics("reference")
+        self.metrics.start(self.context)
         
         print("Servidor de referência iniciado")
     
+    def mark_changed(self, server_name):
+        """registra que o servidor entrou ou saiu da tabela"""
+        self.version += 1
+        self.changes[server_name] = self.version
+        self.changes.move_to_end(server_name)
+        
+        if server_name not in self.servers:
+            self.tombstones.append((self.version, server_name))
+            if len(self.tombstones) > MAX_TOMBSTONES:
+                version, removed_name = self.tombstones.popleft()
+                if self.changes.get(removed_name) == version:
+                    del self.changes[removed_name]
+                self.tombstone_floor = version
+    
+    def set_address(self, server_name, address):
+        """guarda o endereço de sincronização do servidor (avisando a lista se mudou)"""
+        info = self.servers[server_name]
+        if address and info.get("address") != address:
+            info["address"] = address
+            self.mark_changed(server_name)
+    
+    def server_entry(self, server_name):
+        """entrada do servidor na lista"""
+        info = self.servers[server_name]
+        entry = {"name": server_name, "rank": info["rank"]}
+        if "address" in info:
+            entry["address"] = info["address"]
+        return entry
+    
+    def touch(self, server_name):
+        """renova a validade do servidor e agenda a próxima verificação"""
+        deadline = time.time() + SERVER_TIMEOUT
+        self.servers[server_name]["deadline"] = deadline
+        heapq.heappush(self.expiry_heap, (deadline, server_name))
+    
     def handle_rank_request(self, data):
         """processa pedido de rank de servidor"""
         server_name = data.get('user')
@@ -39,11 +218,13 @@ class ReferenceServer:
         # atribuir rank se servidor não existe
         if server_name not in self.servers:
             self.servers[server_name] = {
-                "rank": self.next_rank,
+                "rank": self.registry.assign(server_name),
                 "last_heartbeat": timestamp
             }
-            self.next_rank += 1
             print(f"Servidor '{server_name}' registrado com rank {self.servers[server_name]['rank']}")
+            self.mark_changed(server_name)
+        self.set_address(server_name, data.get('address'))
+        self.touch(server_name)
         
         return {
             "service": "rank",
@@ -55,21 +236,63 @@ class ReferenceServer:
         }
     
     def handle_list_request(self, data):
-        """retorna lista de servidores"""
+        """retorna lista de servidores (completa ou só o que mudou desde a versão `since` da época `epoch`)"""
         timestamp = data.get('timestamp')
         clock = data.get('clock', 0)
+        since = data.get('since')
         
-        server_list = []
-        for server_name, info in self.servers.items():
-            server_list.append({
-                "name": server_name,
-                "rank": info["rank"]
-            })
+        if since is None or data.get('epoch') != self.epoch or since < self.tombstone_floor or since > self.version:
+            server_list = [self.server_entry(server_name) for server_name in self.servers]
+            removed = []
+            full = True
+        else:
+            # percorre as mudanças da mais recente pra trás: custo proporcional ao que mudou
+            server_list = []
+            removed = []
+            for server_name, version in reversed(self.changes.items()):
+                if version <= since:
+                    break
+                if server_name not in self.servers:
+                    removed.append(server_name)
+                else:
+                    server_list.append(self.server_entry(server_name))
+            full = False
         
         return {
             "service": "list",
             "data": {
                 "list": server_list,
+                "removed": removed,
+                "full": full,
+                "version": self.version,
+                "epoch": self.epoch,
+                "timestamp": int(time.time()),
+                "clock": clock
+            }
+        }
+    
+    def handle_batch(self, data):
+        """executa várias operações rank/heartbeat/list numa única ida e volta"""
+        clock = data.get('clock', 0)
+        results = []
+        for operation in data.get('operations', []):
+            service = operation.get('service')
+            if service == "batch":
+                results.append({
+                    "service": service,
+                    "data": {
+                        "status": "erro",
+                        "timestamp": int(time.time() * 1000),
+                        "description": "Lote dentro de lote não é permitido"
+                    }
+                })
+            else:
+                results.append(self.dispatch(service, operation.get('data', {})))
+        
+        return {
+            "service": "batch",
+            "data": {
+                "results": results,
                 "timestamp": int(time.time()),
                 "clock": clock
             }
@@ -98,11 +321,13 @@ class ReferenceServer:
         else:
             # se servidor não existe, registrar com novo rank
             self.servers[server_name] = {
-                "rank": self.next_rank,
+                "rank": self.registry.assign(server_name),
                 "last_heartbeat": timestamp
             }
-            self.next_rank += 1
             print(f"Servidor '{server_name}' registrado via heartbeat com rank {self.servers[server_name]['rank']}")
+            self.mark_changed(server_name)
+        self.set_address(server_name, data.get('address'))
+        self.touch(server_name)
         
         return {
             "service": "heartbeat",
@@ -113,94 +338,107 @@ class ReferenceServer:
         }
     
     def cleanup_inactive_servers(self):
-        """remove servidores inativos (sem heartbeat há mais de 30 segundos)"""
-        current_time = int(time.time())
-        inactive_servers = []
-        
-        for server_name, info in self.servers.items():
-            if current_time - info["last_heartbeat"] > 30:
-                inactive_servers.append(server_name)
-        
-        for server_name in inactive_servers:
+        """remove servidores inativos (sem heartbeat há mais de SERVER_TIMEOUT segundos)"""
+        # só olha o topo do heap: custo proporcional aos expirados, não ao total de servidores
+        current_time = time.time()
+        while self.expiry_heap and self.expiry_heap[0][0] <= current_time:
+            deadline, server_name = heapq.heappop(self.expiry_heap)
+            info = self.servers.get(server_name)
+            # entrada antiga (servidor renovou depois) ou servidor já removido
+            if info is None or info["deadline"] != deadline:
+                continue
             print(f"Removendo servidor inativo: {server_name}")
             del self.servers[server_name]
+            self.mark_changed(server_name)
+    
+    def handle_request(self, message_bytes):
+        """decodifica uma requisição e devolve a resposta (dict)"""
+        if VERBOSE:
+            print(f"Recebido bytes: {len(message_bytes)} bytes")
+        
+        # msgpack por padrão; json só se CODEC_ALLOW_JSON=1
+        try:
+            request = self.codec.decode(message_bytes)
+        except CodecError as error:
+            return {
+                "service": "error",
+                "data": {
+                    "status": "erro",
+                    "timestamp": int(time.time() * 1000),
+                    "clock": 0,
+                    "description": str(error)
+                }
+            }
+        
+        return self.dispatch(request.service, request.data)
+    
+    def dispatch(self, service, service_data):
+        """processa um serviço já decodificado"""
+        if service == "rank":
+            return self.handle_rank_request(service_data)
+        elif service == "list":
+            return self.handle_list_request(service_data)
+        elif service == "heartbeat":
+            return self.handle_heartbeat(service_data)
+        elif service == "batch":
+            return self.handle_batch(service_data)
+        return {
+            "service": service,
+            "data": {
+                "status": "erro",
+                "timestamp": int(time.time() * 1000),
+                "description": f"Serviço '{service}' não reconhecido"
+            }
+        }
     
     def run(self):
         """loop principal do servidor de referência"""
-        # thread pra limpeza de servidores inativos
-        def cleanup_thread():
-            while True:
-                time.sleep(10)  # verificar a cada 10 segundos
-                self.cleanup_inactive_servers()
-        
-        cleanup_thread_obj = threading.Thread(target=cleanup_thread)
-        cleanup_thread_obj.daemon = True
-        cleanup_thread_obj.start()
+        # a expiração roda no próprio loop, sem thread separada mexendo em self.servers
+        next_cleanup = time.time() + 1
         
         while True:
             try:
-                # receber mensagem (msgpack bytes)
-                message_bytes = self.rep_socket.recv()
-                print(f"Recebido bytes: {len(message_bytes)} bytes")
-                
-                # parse da mensagem (tentar msgpack primeiro, depois json)
-                try:
-                    data = msgpack.unpackb(message_bytes, raw=False)
-                    service = data.get('service')
-                    service_data = data.get('data', {})
-                except (Exception) as msgpack_error:
-                    try:
-                        # fallback pra json string
-                        message_str = message_bytes.decode('utf-8')
-                        data = json.loads(message_str)
-                        service = data.get('service')
-                        service_data = data.get('data', {})
-                    except (json.JSONDecodeError, UnicodeDecodeError):
-                        response = {
-                            "service": "error",
-                            "data": {
-                                "status": "erro",
-                                "timestamp": int(time.time() * 1000),
-                                "clock": 0,
-                                "description": "Formato de mensagem inválido"
+                if self.router_socket.poll(max(0, next_cleanup - time.time()) * 1000):
+                    # drenar todas as requisições prontas: [identidade, b"", payload]
+                    for _ in range(RECV_BATCH):
+                        try:
+                            frames = self.router_socket.recv_multipart(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        envelope, message_bytes = frames[:-1], frames[-1]
+                        started = time.perf_counter()
+                        
+                        try:
+                            response = self.handle_request(message_bytes)
+                        except Exception as e:
+                            print(f"Erro: {e}")
+                            self.metrics.count("errors")
+                            response = {
+                                "service": "error",
+                                "data": {
+                                    "status": "erro",
+                                    "timestamp": int(time.time() * 1000),
+                                    "description": str(e)
+                                }
                             }
-                        }
-                        self.rep_socket.send(msgpack.packb(response))
-                        continue
-                
-                # processar serviço
-                if service == "rank":
-                    response = self.handle_rank_request(service_data)
-                elif service == "list":
-                    response = self.handle_list_request(service_data)
-                elif service == "heartbeat":
-                    response = self.handle_heartbeat(service_data)
-                else:
-                    response = {
-                        "service": service,
-                        "data": {
-                            "status": "erro",
-                            "timestamp": int(time.time() * 1000),
-                            "description": f"Serviço '{service}' não reconhecido"
-                        }
-                    }
-                
-                # enviar resposta (msgpack)
-                response_bytes = msgpack.packb(response)
-                self.rep_socket.send(response_bytes)
-                print(f"Enviado: {json.dumps(response)}")
+                        
+                        # enviar resposta (msgpack) com o envelope de volta
+                        reply = self.codec.pack(response)
+                        self.metrics.observe(f"handle_us.{metric_service(response['service'])}", (time.perf_counter() - started) * 1e6)
+                        self.router_socket.send_multipart(envelope + [reply])
+                        if VERBOSE:
+                            print(f"Enviado: {response}")
                 
-            except Exception as e:
-                print(f"Erro: {e}")
-                error_response = {
-                    "service": "error",
-                    "data": {
-                        "status": "erro",
-                        "timestamp": int(time.time() * 1000),
-                        "description": str(e)
-                    }
-                }
-                self.rep_socket.send(msgpack.packb(error_response))
+                if time.time() >= next_cleanup:
+                    self.cleanup_inactive_servers()
+                    next_cleanup = time.time() + 1
+            except KeyboardInterrupt:
+                print("Servidor de referência encerrado")
+                break
+        
+        self.registry.close()
+        self.router_socket.close()
+        self.context.term()
 
 if __name__ == "__main__":
     reference_server = ReferenceServer()
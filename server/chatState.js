@@ -0,0 +1,299 @@
+// Estado em memória do servidor: usuários e canais indexados por nome, histórico de
+// mensagens por canal (publish) e por destinatário (message), ordenado por relógio lógico,
+// e o vetor de versões (por servidor de origem) usado na sincronização incremental
+
+function messageKey(message) {
+    // identifica a mensagem entre réplicas (a mesma mensagem chega pela replicação e pelo sync)
+    if (message.type === "message") {
+        return `message|${message.src}|${message.dst}|${message.timestamp}|${message.clock}`;
+    }
+    return `${message.type}|${message.user}|${message.channel}|${message.timestamp}|${message.clock}`;
+}
+
+function boundByClock(list, clock, upper) {
+    // primeira posição com clock >= clock (ou > clock, se upper)
+    let low = 0;
+    let high = list.length;
+    while (low < high) {
+        const middle = (low + high) >> 1;
+        if (list[middle].clock < clock || (upper && list[middle].clock === clock)) {
+            low = middle + 1;
+        } else {
+            high = middle;
+        }
+    }
+    return low;
+}
+
+function insertByClock(list, message) {
+    // inserção ordenada; o caso comum (mensagem mais nova) é um push
+    let position = list.length;
+    if (position > 0 && list[position - 1].clock > message.clock) {
+        position = boundByClock(list, message.clock, true);
+    }
+    list.splice(position, 0, message);
+}
+
+function mergeByClock(list, added) {
+    // intercala duas listas já ordenadas por clock em tempo linear
+    if (list.length === 0 || list[list.length - 1].clock <= added[0].clock) {
+        for (const message of added) {
+            list.push(message);
+        }
+        return list;
+    }
+    const merged = new Array(list.length + added.length);
+    let i = 0;
+    let j = 0;
+    let k = 0;
+    while (i < list.length && j < added.length) {
+        merged[k++] = list[i].clock <= added[j].clock ? list[i++] : added[j++];
+    }
+    while (i < list.length) {
+        merged[k++] = list[i++];
+    }
+    while (j < added.length) {
+        merged[k++] = added[j++];
+    }
+    return merged;
+}
+
+function versionKey(origin, stream) {
+    // entrada do vetor de versões: a origem, ou origem/sequência pras mensagens particionadas (hashRing.js)
+    return stream ? `${origin}/${stream}` : origin;
+}
+
+function streamOfKey(key) {
+    const separator = key.indexOf('/');
+    return separator < 0 ? undefined : key.slice(separator + 1);
+}
+
+function lowerBound(records, seq) {
+    // primeira posição com seq >= seq
+    let low = 0;
+    let high = records.length;
+    while (low < high) {
+        const middle = (low + high) >> 1;
+        if (records[middle].seq < seq) {
+            low = middle + 1;
+        } else {
+            high = middle;
+        }
+    }
+    return low;
+}
+
+class ChatState {
+    constructor() {
+        this.users = new Map();    // nome -> { user, timestamp, clock }
+        this.channels = new Map(); // nome -> { channel, timestamp, clock }
+        this.messageKeys = new Set();
+        this.channelHistory = new Map(); // canal -> mensagens publish ordenadas por clock
+        this.directHistory = new Map();  // destinatário -> mensagens diretas ordenadas por clock
+        this.messageCount = 0;
+        
+        // cada registro criado num servidor leva { origin, seq } (e stream, se a mensagem é
+        // particionada); seq cresce de 1 em 1 por origem e sequência (chave de versionKey)
+        this.versions = new Map();      // chave -> maior seq aplicado sem lacunas
+        this.originRecords = new Map(); // chave -> [{ seq, kind, payload }] ordenado por seq
+    }
+    
+    historyFor(message, create) {
+        const index = message.type === "message" ? this.directHistory : this.channelHistory;
+        const key = message.type === "message" ? message.dst : message.channel;
+        let list = index.get(key);
+        if (list === undefined && create) {
+            list = [];
+            index.set(key, list);
+        }
+        return list;
+    }
+    
+    hasUser(name) {
+        return this.users.has(name);
+    }
+    
+    putUser(user) {
+        this.users.set(user.user, user);
+    }
+    
+    mergeUser(user) {
+        // mantém o registro com o maior relógio lógico; true se mudou algo
+        const existing = this.users.get(user.user);
+        if (existing === undefined || user.clock > existing.clock) {
+            this.users.set(user.user, user);
+            return true;
+        }
+        return false;
+    }
+    
+    hasChannel(name) {
+        return this.channels.has(name);
+    }
+    
+    putChannel(channel) {
+        this.channels.set(channel.channel, channel);
+    }
+    
+    mergeChannel(channel) {
+        const existing = this.channels.get(channel.channel);
+        if (existing === undefined || channel.clock > existing.clock) {
+            this.channels.set(channel.channel, channel);
+            return true;
+        }
+        return false;
+    }
+    
+    addMessage(message) {
+        // adiciona uma mensagem no histórico do canal/destinatário; false se já existia
+        const key = messageKey(message);
+        if (this.messageKeys.has(key)) {
+            return false;
+        }
+        this.messageKeys.add(key);
+        insertByClock(this.historyFor(message, true), message);
+        this.messageCount++;
+        return true;
+    }
+    
+    mergeMessages(messages) {
+        // mescla um lote (sync): deduplica pelo conjunto de chaves, ordena só as novas e
+        // intercala com cada histórico afetado; devolve as mensagens que eram novas
+        const added = [];
+        const perHistory = new Map();
+        for (const message of messages) {
+            const key = messageKey(message);
+            if (this.messageKeys.has(key)) {
+                continue;
+            }
+            this.messageKeys.add(key);
+            added.push(message);
+            const list = this.historyFor(message, true);
+            let batch = perHistory.get(list);
+            if (batch === undefined) {
+                batch = [];
+                perHistory.set(list, batch);
+            }
+            batch.push(message);
+        }
+        
+        for (const [list, batch] of perHistory) {
+            batch.sort((a, b) => a.clock - b.clock);
+            const merged = mergeByClock(list, batch);
+            if (merged !== list) {
+                // trocar o conteúdo mantendo a mesma referência guardada no índice
+                list.length = 0;
+                for (const message of merged) {
+                    list.push(message);
+                }
+            }
+        }
+        this.messageCount += added.length;
+        return added;
+    }
+    
+    channelMessages(channel) {
+        return this.channelHistory.get(channel) || [];
+    }
+    
+    directMessages(user) {
+        return this.directHistory.get(user) || [];
+    }
+    
+    historyPage(list, cursor, limit) {
+        // até limit mensagens anteriores ao cursor, em ordem de clock; sem cursor, as mais recentes.
+        // O cursor { clock, count } marca "clock menor que clock, mais as count primeiras com esse
+        // clock", então não anda quando chegam mensagens novas. Custo: busca binária + a página
+        let end = list.length;
+        if (cursor) {
+            end = Math.min(boundByClock(list, cursor.clock, false) + cursor.count, boundByClock(list, cursor.clock, true));
+        }
+        const start = Math.max(0, end - limit);
+        let next = null;
+        if (start > 0) {
+            const clock = list[start].clock;
+            next = { clock: clock, count: start - boundByClock(list, clock, false) };
+        }
+        return { messages: list.slice(start, end), next: next };
+    }
+    
+    expectedSeq(key) {
+        return (this.versions.get(key) || 0) + 1;
+    }
+    
+    trackRecord(kind, payload) {
+        // registra um registro versionado pra poder repassá-lo a quem estiver atrasado
+        if (payload.origin === undefined || payload.seq === undefined) {
+            return;
+        }
+        const key = versionKey(payload.origin, payload.stream);
+        let records = this.originRecords.get(key);
+        if (records === undefined) {
+            records = [];
+            this.originRecords.set(key, records);
+        }
+        const entry = { seq: payload.seq, kind: kind, payload: payload };
+        if (records.length === 0 || records[records.length - 1].seq < payload.seq) {
+            records.push(entry);
+        } else {
+            const position = lowerBound(records, payload.seq);
+            if (records[position].seq === payload.seq) {
+                return;
+            }
+            records.splice(position, 0, entry);
+        }
+        
+        // avançar o vetor enquanto não houver lacuna
+        let version = this.versions.get(key) || 0;
+        if (payload.seq > version + 1) {
+            return;
+        }
+        let position = lowerBound(records, version + 1);
+        while (position < records.length && records[position].seq === version + 1) {
+            version++;
+            position++;
+        }
+        this.versions.set(key, version);
+    }
+    
+    advanceVersion(key, seq) {
+        // registros carregados do disco ou recebidos na sincronização já cobrem tudo até seq
+        // (o que falta antes foi sobrescrito por um registro mais novo)
+        if (seq > (this.versions.get(key) || 0)) {
+            this.versions.set(key, seq);
+        }
+    }
+    
+    missingFor(vector, limit, wanted) {
+        // registros que faltam pra quem tem o vetor `vector`, no máximo limit, em ordem de seq por
+        // chave; wanted(origin, stream) filtra as sequências que o outro lado guarda
+        const records = [];
+        for (const [key, list] of this.originRecords) {
+            if (wanted !== undefined && list.length > 0 && !wanted(list[0].payload.origin, streamOfKey(key))) {
+                continue;
+            }
+            // só a parte contínua: o outro lado descarta o que vier depois de uma lacuna
+            const known = vector[key] || 0;
+            const version = this.versions.get(key) || 0;
+            for (let i = lowerBound(list, known + 1); i < list.length && list[i].seq <= version; i++) {
+                if (records.length >= limit) {
+                    return { records: records, more: true };
+                }
+                records.push({ kind: list[i].kind, payload: list[i].payload });
+            }
+        }
+        return { records: records, more: false };
+    }
+    
+    *allMessages() {
+        // todas as mensagens (ordenadas por clock dentro de cada canal/destinatário)
+        for (const list of this.channelHistory.values()) {
+            yield* list;
+        }
+        for (const list of this.directHistory.values()) {
+            yield* list;
+        }
+    }
+}
+
+module.exports = { ChatState, messageKey, versionKey, streamOfKey };
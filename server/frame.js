@@ -0,0 +1,58 @@
+const msgpack = require('msgpack-lite');
+const { hash32 } = require('./hashRing');
+
+// Frame das publicações (publish e message): cabeçalho fixo na frente de um corpo msgpack
+// opaco. O servidor codifica uma vez e manda o mesmo buffer pro tópico dos clientes, no
+// lote de replicação e (via proxy lvc) no replay; quem recebe lê o cabeçalho sem decodificar
+// o corpo. Mantenha em sincronia com common/frame.py e client/Program.cs
+//
+//   0  u8   FRAME_MAGIC (0xC1, o único byte que o msgpack nunca usa: distingue de um envelope)
+//   1  u8   tipo: FRAME_PUBLISH ou FRAME_MESSAGE
+//   2  u8   flags: FRAME_TRACED = o trace vem em msgpack depois do corpo
+//   3  u8   reservado (0)
+//   4  u32  id do canal: hash32 do tópico (#canal, @usuário), o mesmo do anel; só um filtro:
+//           dois tópicos podem colidir, quem casa pelo id confere channel/dst no corpo
+//   8  u64  relógio lógico
+//  16  u32  seq do registro na origem
+//  20  u32  tamanho do corpo
+//  24       corpo: msgpack {user, channel, message, timestamp, clock} ou {src, dst, message, timestamp, clock}
+
+const FRAME_MAGIC = 0xC1;
+const FRAME_PUBLISH = 1;
+const FRAME_MESSAGE = 2;
+const FRAME_TRACED = 1;
+const FRAME_HEADER_SIZE = 24;
+
+function encodeFrame(type, topic, clock, seq, data, trace) {
+    const body = msgpack.encode(data);
+    const traceBytes = trace ? msgpack.encode(trace) : null;
+    const frame = Buffer.allocUnsafe(FRAME_HEADER_SIZE + body.length + (traceBytes ? traceBytes.length : 0));
+    frame.writeUInt8(FRAME_MAGIC, 0);
+    frame.writeUInt8(type, 1);
+    frame.writeUInt8(traceBytes ? FRAME_TRACED : 0, 2);
+    frame.writeUInt8(0, 3);
+    frame.writeUInt32BE(hash32(topic), 4);
+    frame.writeBigUInt64BE(BigInt(clock || 0), 8);
+    frame.writeUInt32BE(seq || 0, 16);
+    frame.writeUInt32BE(body.length, 20);
+    body.copy(frame, FRAME_HEADER_SIZE);
+    if (traceBytes) {
+        traceBytes.copy(frame, FRAME_HEADER_SIZE + body.length);
+    }
+    return frame;
+}
+
+function frameType(frame) {
+    return frame.readUInt8(1);
+}
+
+function frameSeq(frame) {
+    return frame.readUInt32BE(16);
+}
+
+function frameBody(frame) {
+    // decodifica só o corpo (o trace, se houver, fica de fora)
+    return msgpack.decode(frame.subarray(FRAME_HEADER_SIZE, FRAME_HEADER_SIZE + frame.readUInt32BE(20)));
+}
+
+module.exports = { encodeFrame, frameType, frameSeq, frameBody, FRAME_PUBLISH, FRAME_MESSAGE };
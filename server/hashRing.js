@@ -0,0 +1,89 @@
+const crypto = require('crypto');
+
+// Anel de hash consistente: reparte as mensagens de canais e usuários entre os servidores
+// da lista do servidor de referência. A chave é o tópico (#canal, @usuário) e cai numa de
+// RING_PARTITIONS partições fixas; os donos de uma partição são os N primeiros servidores
+// distintos a partir do início dela no anel, onde cada servidor tem RING_VNODES pontos.
+// Entrar ou sair um servidor só muda os donos das partições vizinhas dos pontos dele.
+// O broker monta o mesmo anel (common/ring.py): mantenha os dois em sincronia
+
+const RING_PARTITIONS = 64;
+const RING_VNODES = 64;
+const RING_SIZE = 2 ** 32;
+
+function hash32(text) {
+    // primeiros 4 bytes do md5, big-endian
+    return crypto.createHash('md5').update(text).digest().readUInt32BE(0);
+}
+
+function partitionOf(key) {
+    return Math.floor(hash32(key) * RING_PARTITIONS / RING_SIZE);
+}
+
+function streamFor(key, replicas) {
+    // sequência de replicação das mensagens da chave: "partição:réplicas" (undefined = todos guardam)
+    return replicas > 0 ? `${partitionOf(key)}:${replicas}` : undefined;
+}
+
+class HashRing {
+    constructor(names) {
+        this.names = [...new Set(names)].sort();
+        this.points = [];
+        for (const name of this.names) {
+            for (let index = 0; index < RING_VNODES; index++) {
+                this.points.push({ point: hash32(`${name}#${index}`), name: name });
+            }
+        }
+        this.points.sort((a, b) => a.point - b.point || (a.name < b.name ? -1 : a.name > b.name ? 1 : 0));
+        this.cache = new Map(); // sequência -> donos
+    }
+    
+    get size() {
+        return this.names.length;
+    }
+    
+    sameAs(names) {
+        const other = [...new Set(names)].sort();
+        return other.length === this.names.length && other.every((name, index) => name === this.names[index]);
+    }
+    
+    ownersOf(stream) {
+        // donos de uma sequência, em ordem de preferência (todos, se ela não é particionada ou faltam servidores)
+        if (!stream) {
+            return this.names;
+        }
+        let owners = this.cache.get(stream);
+        if (owners !== undefined) {
+            return owners;
+        }
+        const [partition, replicas] = stream.split(':').map(Number);
+        const count = Math.min(replicas, this.names.length);
+        const start = partition * (RING_SIZE / RING_PARTITIONS);
+        let low = 0;
+        let high = this.points.length;
+        while (low < high) {
+            const middle = (low + high) >> 1;
+            if (this.points[middle].point < start) {
+                low = middle + 1;
+            } else {
+                high = middle;
+            }
+        }
+        owners = [];
+        for (let step = 0; owners.length < count; step++) {
+            const name = this.points[(low + step) % this.points.length].name;
+            if (!owners.includes(name)) {
+                owners.push(name);
+            }
+        }
+        this.cache.set(stream, owners);
+        return owners;
+    }
+    
+    owns(name, stream) {
+        // anel vazio (lista ainda não chegou): cada um guarda tudo
+        return this.names.length === 0 || this.ownersOf(stream).includes(name);
+    }
+}
+
+module.exports = { HashRing, streamFor, partitionOf, hash32, RING_PARTITIONS };
@@ -3,22 +3,95 @@ const fs = require('fs');
 const path = require('path');
 const os = require('os');
 const msgpack = require('msgpack-lite');
+const { MessageLog } = require('./messageLog');
+const { SeqMarks } = require('./seqMarks');
+const { ChatState, versionKey, streamOfKey } = require('./chatState');
+const { PeerPool } = require('./peerPool');
+const { HashRing, streamFor } = require('./hashRing');
+const { encodeFrame, frameType, frameSeq, frameBody, FRAME_PUBLISH, FRAME_MESSAGE } = require('./frame');
+
+// prefixos dos tópicos dos clientes: um canal e um usuário com o mesmo nome não colidem
+// (mantenha em sincronia com common/topics.py e client/Program.cs)
+const CHANNEL_TOPIC_PREFIX = "#";
+const USER_TOPIC_PREFIX = "@";
+
+// sinais do protocolo paranoid pirate trocados com o broker no modo "lb"
+const PPP_READY = Buffer.from([0x01]);
+const PPP_HEARTBEAT = Buffer.from([0x02]);
+
+// hosts dos outros componentes (nomes dos serviços no docker-compose; benchmarks/cluster.py usa 127.0.0.1)
+const BROKER_HOST = process.env.SERVER_BROKER_HOST || "broker";
+const PROXY_HOST = process.env.SERVER_PROXY_HOST || "proxy";
+const REFERENCE_HOST = process.env.SERVER_REFERENCE_HOST || "reference";
+
+function epochMicros() {
+    // instante atual em µs desde a época, com resolução abaixo do milissegundo (ver common/metrics.py)
+    return Math.round((performance.timeOrigin + performance.now()) * 1000);
+}
+
+function recordFromFrame(frame, origin, stream) {
+    // mensagem guardada a partir do frame replicado, com os mesmos campos de quem a criou
+    const data = frameBody(frame);
+    const record = frameType(frame) === FRAME_PUBLISH
+        ? { type: "publish", user: data.user, channel: data.channel }
+        : { type: "message", src: data.src, dst: data.dst };
+    record.message = data.message;
+    record.timestamp = data.timestamp;
+    record.clock = data.clock;
+    record.origin = origin;
+    if (stream) {
+        record.stream = stream;
+    }
+    record.seq = frameSeq(frame);
+    return record;
+}
 
 class Server {
     constructor() {
         this.context = new zmq.Context();
         
-        // socket rep pra responder requisições
-        this.repSocket = new zmq.Reply();
-        this.repSocket.connect("tcp://broker:5556");
+        // Usar hostname do container como identificador único temporário
+        // Será atualizado para um nome legível quando o rank for obtido
+        const hostname = process.env.HOSTNAME || os.hostname();
+        this.serverName = hostname || `server_${Math.floor(Math.random() * 1000)}`;
         
-        // socket pub pra publicar mensagens
+        // modo do broker: "proxy" (REP atrás do zmq.proxy), "lb" (paranoid pirate) ou "sharded"
+        this.brokerMode = process.env.BROKER_MODE || "proxy";
+        // quantas requisições este servidor aceita ao mesmo tempo no modo "lb"
+        this.brokerCredit = parseInt(process.env.SERVER_CREDIT || "1");
+        this.brokerHeartbeatInterval = parseFloat(process.env.BROKER_HEARTBEAT_INTERVAL || "1.0") * 1000;
+        // fila de envios pro broker (zeromq.js não aceita dois send() simultâneos)
+        this.brokerSendChain = Promise.resolve();
+        
+        if (this.brokerMode === "lb") {
+            // socket dealer que se anuncia ao broker com READY e heartbeats
+            this.repSocket = new zmq.Dealer({ routingId: this.serverName });
+        } else {
+            // socket rep pra responder requisições
+            this.repSocket = new zmq.Reply();
+        }
+        if (this.brokerMode === "sharded") {
+            // broker com shards: cada shard tem seu backend, e o REP distribui entre todos
+            const shards = parseInt(process.env.BROKER_SHARDS || "4");
+            const backendBase = parseInt(process.env.BROKER_SHARD_BACKEND_BASE || "5600");
+            for (let index = 0; index < shards; index++) {
+                this.repSocket.connect(`tcp://${BROKER_HOST}:${backendBase + index}`);
+            }
+        } else {
+            this.repSocket.connect(`tcp://${BROKER_HOST}:5556`);
+        }
+        
+        // socket pub pra publicar mensagens (tópicos dos clientes: #canal e @usuário)
         this.pubSocket = new zmq.Publisher();
-        this.pubSocket.connect("tcp://proxy:5557");
+        this.pubSocket.connect(`tcp://${PROXY_HOST}:5557`);
+        
+        // socket pub do plano interno do proxy ("servers" e "replication"), que os clientes não recebem
+        this.internalPubSocket = new zmq.Publisher();
+        this.internalPubSocket.connect(`tcp://${PROXY_HOST}:5562`);
         
         // socket req pra comunicação com servidor de referência
         this.refSocket = new zmq.Request();
-        this.refSocket.connect("tcp://reference:5559");
+        this.refSocket.connect(`tcp://${REFERENCE_HOST}:5559`);
         
         // socket req pra comunicação entre servidores (eleição e sincronização)
         this.serverReqSocket = new zmq.Request();
@@ -29,24 +102,65 @@ class Server {
         
         // socket sub pra escutar tópico "servers"
         this.serverSubSocket = new zmq.Subscriber();
-        this.serverSubSocket.connect("tcp://proxy:5558");
+        this.serverSubSocket.connect(`tcp://${PROXY_HOST}:5563`);
         this.serverSubSocket.subscribe("servers");
         
         // socket sub pra escutar tópico "replication" (replicação de dados)
         this.replicationSubSocket = new zmq.Subscriber();
-        this.replicationSubSocket.connect("tcp://proxy:5558");
+        this.replicationSubSocket.connect(`tcp://${PROXY_HOST}:5563`);
         this.replicationSubSocket.subscribe("replication");
         
+        // sincronização incremental: cada servidor numera o que cria (origin + seq) e atende
+        // quem está atrasado num router próprio, mandando só o que falta em blocos
+        this.syncPort = parseInt(process.env.SERVER_SYNC_PORT || "5570");
+        this.syncChunk = parseInt(process.env.SERVER_SYNC_CHUNK || "500");
+        this.syncTimeout = parseFloat(process.env.SERVER_SYNC_TIMEOUT || "5") * 1000;
+        // host anunciado aos outros servidores (padrão: hostname do container)
+        this.syncAddress = `tcp://${process.env.SERVER_SYNC_HOST || hostname}:${this.syncPort}`;
+        this.syncSocket = new zmq.Router();
+        this.syncSocket.bind(`tcp://*:${this.syncPort}`);
+        // conexões persistentes com o socket de sincronização dos outros servidores
+        this.peerPool = new PeerPool();
+        this.catchUpRunning = false;
+        this.catchUpPending = false;
+        
+        // replicação em lotes: registros criados dentro da janela saem num único frame
+        this.replicationBatchMs = parseFloat(process.env.SERVER_REPLICATION_BATCH_MS || "5");
+        this.replicationBatchMax = parseInt(process.env.SERVER_REPLICATION_BATCH_MAX || "256");
+        this.replicationOutbox = [];
+        this.replicationTimer = null;
+        // SERVER_LOG_DURABLE_ACK=1: publish/message só respondem OK depois do fdatasync do log; sem
+        // isso a resposta sai antes do group commit e uma queda pode perder as últimas
+        // SERVER_LOG_SYNC_MS de mensagens confirmadas (que podem já estar nas outras réplicas)
+        this.durableAcks = process.env.SERVER_LOG_DURABLE_ACK === "1";
+        
+        // sincronização de relógio (Berkeley) em segundo plano, conduzida pelo coordenador
+        this.clockSyncInterval = parseFloat(process.env.SERVER_CLOCK_SYNC_INTERVAL || "30") * 1000;
+        this.clockSyncTimeout = parseFloat(process.env.SERVER_CLOCK_SYNC_TIMEOUT || "2") * 1000;
+        // amostras com ida e volta maior que isso ficam fora da média
+        this.clockMaxRtt = parseFloat(process.env.SERVER_CLOCK_MAX_RTT || "500");
+        this.clockOffset = 0; // correção (ms) somada ao relógio físico local
+        this.clockRound = 0;
+        this.clockStats = null; // última rodada: defasagem e ida e volta por servidor
+        this.lastClockRound = Date.now();
+        
+        // partição das mensagens (hashRing.js): as de cada canal/usuário ficam só com
+        // SERVER_REPLICATION_FACTOR donos no anel montado com a lista do servidor de referência
+        // (0 = todos guardam tudo). Um canal pode pedir outro fator ao ser criado (campo replicas)
+        this.replicationFactor = parseInt(process.env.SERVER_REPLICATION_FACTOR || "0");
+        this.ring = new HashRing([]);
+        
+        // maior página aceita pelo serviço history
+        this.historyMaxLimit = parseInt(process.env.SERVER_HISTORY_MAX_LIMIT || "100");
+        
         // relógio lógico
         this.logicalClock = 0;
-        // Usar hostname do container como identificador único temporário
-        // Será atualizado para um nome legível quando o rank for obtido
-        const hostname = process.env.HOSTNAME || os.hostname();
-        this.serverName = hostname || `server_${Math.floor(Math.random() * 1000)}`;
         this.serverRank = null;
         this.coordinator = null;
         this.messageCount = 0;
         this.serverList = []; // lista de outros servidores
+        this.serverListVersion = null; // versão da lista no servidor de referência (pra pedir só o que mudou)
+        this.serverListEpoch = null; // época da referência: se ela reiniciar, a versão recomeça e vem a lista completa
         this.replicationListenerRunning = false; // flag para garantir apenas uma instância do listener
         this.serverListenerRunning = false; // flag para garantir apenas uma instância do listener de servidores
         this.serverRequestListenerRunning = false; // flag para garantir apenas uma instância do listener de requisições
@@ -54,28 +168,34 @@ class Server {
         // dados persistentes
         // Cada servidor salva em seu próprio diretório baseado no serverRank
         // Isso evita condições de corrida quando múltiplos servidores escrevem simultaneamente
-        this.dataDir = "/app/data";
+        this.dataDir = process.env.SERVER_DATA_DIR || "/app/data";
         // Diretório será criado quando o rank for obtido
         this.serverDataDir = null;
         this.usersFile = null;
         this.channelsFile = null;
-        this.messagesFile = null;
+        this.messagesFile = null; // formato antigo (JSON inteiro), só lido pra migrar pro log
+        this.messagesDir = null;
+        this.seqsFile = null;
+        this.messageLog = null;
+        this.seqMarks = null; // teto das sequências emitidas (seqMarks.js), lido junto com o log
         
-        // Inicializar arrays vazios - dados serão carregados após obter o rank
-        this.users = [];
-        this.channels = [];
-        this.messages = [];
+        // Estado vazio - dados serão carregados após obter o rank
+        // (usuários e canais por nome, mensagens por canal/destinatário ordenadas por clock)
+        this.state = new ChatState();
         
         // registrar no servidor de referência
         this.registerWithReference();
         
         // iniciar heartbeat
         this.startHeartbeat();
+        this.startBrokerHeartbeat();
         
         // iniciar listeners
         this.startServerListener();
         this.startReplicationListener();
         this.startServerRequestListener();
+        this.startSyncListener();
+        this.startClockSync();
         
         console.log(`[AUDITORIA RELÓGIO] Servidor ${this.serverName} iniciado`);
         console.log(`[AUDITORIA RELÓGIO] Relógio lógico inicial: ${this.logicalClock}`);
@@ -130,6 +250,8 @@ class Server {
         this.usersFile = path.join(this.serverDataDir, "users.json");
         this.channelsFile = path.join(this.serverDataDir, "channels.json");
         this.messagesFile = path.join(this.serverDataDir, "messages.json");
+        this.messagesDir = path.join(this.serverDataDir, "messages");
+        this.seqsFile = path.join(this.serverDataDir, "seqs.json");
         
         console.log(`[PERSISTENCIA] Servidor ${this.serverName} (rank: ${this.serverRank}) salvando dados em: ${this.serverDataDir}`);
     }
@@ -212,6 +334,9 @@ class Server {
                                 console.log(`[AUDITORIA RELÓGIO] Coordenador anterior: ${oldCoordinatorDisplay}`);
                                 console.log(`[AUDITORIA RELÓGIO] Novo coordenador: ${this.getCoordinatorDisplayName()}`);
                                 console.log(`[AUDITORIA RELÓGIO] Relógio lógico recebido: ${clockReceived}, Relógio atual: ${this.logicalClock}`);
+                            } else if (data.service === "clock" && data.data && data.data.adjustments && data.data.coordinator !== this.serverName) {
+                                // o coordenador já aplicou a própria rodada
+                                this.applyClockRound(data.data);
                             }
                         }
                     }
@@ -261,8 +386,8 @@ class Server {
                             const messageBuffer = Buffer.isBuffer(messageBytes) ? messageBytes : Buffer.from(messageBytes);
                             const data = msgpack.decode(messageBuffer);
                             
-                            // ignorar mensagens próprias (evitar loops)
-                            if (data.originServer === this.serverName) {
+                            // ignorar mensagens próprias (evitar loops) e o histórico enviado pelo proxy no modo lvc
+                            if (data.originServer === this.serverName || data.service === "replay") {
                                 continue;
                             }
                             
@@ -368,132 +493,23 @@ class Server {
     
     async applyReplication(data) {
         try {
-            const { dataType, payload, originServer } = data;
+            const { dataType, payload } = data;
             
             switch (dataType) {
-                case 'user':
-                    // Adicionar ou atualizar usuário
-                    const existingUserIndex = this.users.findIndex(u => u.user === payload.user);
-                    if (existingUserIndex >= 0) {
-                        this.users[existingUserIndex] = payload;
-                        console.log(`[REPLICACAO] Usuário ${payload.user} atualizado`);
-                    } else {
-                        this.users.push(payload);
-                        console.log(`[REPLICACAO] Usuário ${payload.user} adicionado`);
-                    }
-                    this.saveUsers();
-                    break;
-                    
-                case 'channel':
-                    // Adicionar ou atualizar canal
-                    const existingChannelIndex = this.channels.findIndex(c => c.channel === payload.channel);
-                    if (existingChannelIndex >= 0) {
-                        this.channels[existingChannelIndex] = payload;
-                        console.log(`[REPLICACAO] Canal ${payload.channel} atualizado`);
-                    } else {
-                        this.channels.push(payload);
-                        console.log(`[REPLICACAO] Canal ${payload.channel} adicionado`);
-                    }
-                    this.saveChannels();
-                    break;
-                    
-                case 'message':
-                    // Adicionar mensagem
-                    // Verificar duplicatas de forma mais robusta
-                    const existingMessageIndex = this.messages.findIndex(m => 
-                        m.type === payload.type &&
-                        m.timestamp === payload.timestamp &&
-                        m.clock === payload.clock &&
-                        ((m.user === payload.user && m.channel === payload.channel) ||
-                         (m.src === payload.src && m.dst === payload.dst))
-                    );
-                    if (existingMessageIndex < 0) {
-                        this.messages.push(payload);
-                        // Ordenar mensagens por relógio lógico após adicionar
-                        this.messages.sort((a, b) => a.clock - b.clock);
-                        console.log(`[REPLICACAO] Mensagem adicionada (tipo: ${payload.type}, clock: ${payload.clock})`);
-                        this.saveMessages();
-                    } else {
-                        console.log(`[REPLICACAO] Mensagem duplicada ignorada (tipo: ${payload.type}, clock: ${payload.clock})`);
-                    }
-                    break;
-                    
-                case 'sync':
-                    // Sincronização completa de dados
-                    // Garantir que todos os dados sejam mesclados corretamente (não apenas substituídos)
-                    if (payload.users && Array.isArray(payload.users)) {
-                        console.log(`[REPLICACAO] Sincronizando ${payload.users.length} usuários`);
-                        // Mesclar usuários: adicionar novos e atualizar existentes
-                        payload.users.forEach(user => {
-                            const existingIndex = this.users.findIndex(u => u.user === user.user);
-                            if (existingIndex >= 0) {
-                                // Atualizar se o relógio lógico for maior (dados mais recentes)
-                                if (user.clock > this.users[existingIndex].clock) {
-                                    this.users[existingIndex] = user;
-                                }
-                            } else {
-                                this.users.push(user);
-                            }
-                        });
-                        this.saveUsers();
-                    }
-                    if (payload.channels && Array.isArray(payload.channels)) {
-                        console.log(`[REPLICACAO] Sincronizando ${payload.channels.length} canais`);
-                        // Mesclar canais: adicionar novos e atualizar existentes
-                        payload.channels.forEach(channel => {
-                            const existingIndex = this.channels.findIndex(c => c.channel === channel.channel);
-                            if (existingIndex >= 0) {
-                                // Atualizar se o relógio lógico for maior (dados mais recentes)
-                                if (channel.clock > this.channels[existingIndex].clock) {
-                                    this.channels[existingIndex] = channel;
-                                }
-                            } else {
-                                this.channels.push(channel);
-                            }
-                        });
-                        this.saveChannels();
-                    }
-                    if (payload.messages && Array.isArray(payload.messages)) {
-                        console.log(`[REPLICACAO] Sincronizando ${payload.messages.length} mensagens`);
-                        // Mesclar mensagens: adicionar apenas novas mensagens
-                        payload.messages.forEach(message => {
-                            const existingIndex = this.messages.findIndex(m => 
-                                m.type === message.type &&
-                                m.timestamp === message.timestamp &&
-                                m.clock === message.clock &&
-                                ((m.user === message.user && m.channel === message.channel) ||
-                                 (m.src === message.src && m.dst === message.dst))
-                            );
-                            if (existingIndex < 0) {
-                                this.messages.push(message);
-                            }
-                        });
-                        // Ordenar mensagens por relógio lógico
-                        this.messages.sort((a, b) => a.clock - b.clock);
-                        this.saveMessages();
-                    }
-                    console.log(`[REPLICACAO] Sincronização completa aplicada. Total: ${this.users.length} usuários, ${this.channels.length} canais, ${this.messages.length} mensagens`);
-                    break;
-                    
-                case 'sync_request':
-                    // Solicitação de sincronização - qualquer servidor pode responder
-                    // Mas apenas o coordenador ou o primeiro servidor disponível responde
-                    // Se não temos coordenador ainda, qualquer servidor com rank menor pode responder
-                    const shouldRespond = this.coordinator === this.serverName || 
-                                         this.serverRank === 1 || 
-                                         (!this.coordinator && this.serverRank && this.serverRank <= 2);
-                    
-                    if (shouldRespond) {
-                        const originDisplayName = this.getServerDisplayName(originServer);
-                        const currentDisplayName = this.getServerDisplayName(this.serverName);
-                        console.log(`[REPLICACAO] Servidor ${currentDisplayName} recebeu solicitação de sincronização de ${originDisplayName}`);
-                        // Aguardar um pouco para evitar múltiplas respostas simultâneas
-                        setTimeout(async () => {
-                            await this.broadcastSync();
-                        }, Math.random() * 1000); // Delay aleatório entre 0-1s
+                case 'batch': {
+                    // lote com os registros de uma origem, em ordem de seq dentro de cada sequência
+                    const { origin, records } = payload;
+                    const originDisplayName = this.getServerDisplayName(origin);
+                    const result = this.applyRecords(records, true, origin);
+                    if (result.gaps.size > 0) {
+                        // perdemos algo antes deste lote: pedir o que falta (o resto do lote volta junto)
+                        console.log(`[REPLICACAO] Lacuna de ${originDisplayName} em ${result.gaps.size} sequência(s): ${[...result.gaps].join(", ")}`);
+                        this.catchUp();
                     }
+                    console.log(`[REPLICACAO] Lote de ${originDisplayName} (${records.length} registros): ${result.applied} aplicados, ${result.foreign} de partições de outros servidores`);
                     break;
-                    
+                }
+                
                 default:
                     console.error(`[REPLICACAO] Tipo de dados desconhecido: ${dataType}`);
             }
@@ -502,68 +518,297 @@ class Server {
         }
     }
     
-    async replicateData(dataType, payload) {
-        try {
-            const replicationMessage = {
-                originServer: this.serverName,
-                dataType: dataType,
-                payload: payload,
-                timestamp: Math.floor(Date.now() / 1000),
-                clock: this.incrementClock()
-            };
-            
-            const currentDisplayName = this.getServerDisplayName(this.serverName);
-            console.log(`[REPLICACAO] Servidor ${currentDisplayName} replicando ${dataType}: ${JSON.stringify(payload).substring(0, 100)}`);
-            
-            await this.pubSocket.send(["replication", msgpack.encode(replicationMessage)]);
-            console.log(`[REPLICACAO] Dados de ${dataType} replicados com sucesso`);
-        } catch (error) {
-            console.error(`[REPLICACAO] Erro ao replicar dados: ${error.message}`);
+    applyRecords(records, live = false, origin = undefined) {
+        // aplica registros de outras réplicas em ordem de seq, pulando os já aplicados e as
+        // mensagens de partições de que este servidor não é dono; usuários e canais são gravados
+        // uma vez por chamada. No lote ao vivo (live) um seq adiantado é lacuna: o resto daquela
+        // sequência fica pra sincronização. Na sincronização o outro lado manda só a parte
+        // contínua, então o vetor avança até o seq recebido. Mensagens do lote vêm como frame
+        // (origem do lote, seq do cabeçalho): o corpo só é decodificado se o registro for aplicado
+        let applied = 0;
+        let foreign = 0;
+        const gaps = new Set();
+        let usersChanged = false;
+        let channelsChanged = false;
+        for (const record of records) {
+            const kind = record.kind;
+            const recordOrigin = record.frame ? origin : record.payload.origin;
+            const stream = record.frame ? record.stream : record.payload.stream;
+            const seq = record.frame ? frameSeq(record.frame) : record.payload.seq;
+            if (!this.keeps(this.serverName, recordOrigin, stream)) {
+                foreign++;
+                continue;
+            }
+            const key = versionKey(recordOrigin, stream);
+            if (seq < this.state.expectedSeq(key) || gaps.has(key)) {
+                continue;
+            }
+            if (live && seq > this.state.expectedSeq(key)) {
+                gaps.add(key);
+                continue;
+            }
+            this.applyRecord(kind, record.frame ? recordFromFrame(record.frame, recordOrigin, stream) : record.payload);
+            this.state.advanceVersion(key, seq);
+            usersChanged = usersChanged || kind === 'user';
+            channelsChanged = channelsChanged || kind === 'channel';
+            applied++;
+        }
+        if (usersChanged) {
+            this.saveUsers();
+        }
+        if (channelsChanged) {
+            this.saveChannels();
         }
+        return { applied: applied, foreign: foreign, gaps: gaps };
     }
     
-    async requestSync() {
-        // Solicitar sincronização completa de outro servidor
-        try {
-            const currentDisplayName = this.getServerDisplayName(this.serverName);
-            console.log(`[REPLICACAO] Servidor ${currentDisplayName} solicitando sincronização completa`);
+    applyRecord(kind, payload) {
+        // aplica um usuário, canal ou mensagem vindo de outra réplica (sem gravar usuários/canais)
+        switch (kind) {
+            case 'user':
+                this.state.putUser(payload);
+                break;
             
-            // Enviar solicitação de sincronização
-            const syncRequest = {
-                originServer: this.serverName,
-                dataType: 'sync_request',
-                timestamp: Math.floor(Date.now() / 1000),
-                clock: this.incrementClock()
-            };
+            case 'channel':
+                this.state.putChannel(payload);
+                break;
             
-            await this.pubSocket.send(["replication", msgpack.encode(syncRequest)]);
-        } catch (error) {
-            console.error(`[REPLICACAO] Erro ao solicitar sincronização: ${error.message}`);
+            case 'message':
+                // duplicatas identificadas pela chave da mensagem
+                if (this.state.addMessage(payload)) {
+                    this.appendMessage(payload);
+                }
+                break;
+        }
+        this.state.trackRecord(kind, payload);
+    }
+    
+    stampRecord(kind, record, stream) {
+        // numera um registro criado neste servidor pro vetor de versões (mensagens particionadas
+        // levam a sequência da partição). Quem cria sempre guarda o registro, mesmo sem ser dono:
+        // é do próprio disco que a numeração se refaz depois de reiniciar
+        record.origin = this.serverName;
+        if (stream) {
+            record.stream = stream;
+        }
+        const key = versionKey(this.serverName, stream);
+        // o teto gravado (seqMarks.js) evita reemitir seqs que se perderam no fim do log
+        record.seq = this.seqMarks !== null ? this.seqMarks.next(this.state, key) : this.state.expectedSeq(key);
+        this.state.trackRecord(kind, record);
+        return record;
+    }
+    
+    keeps(server, origin, stream) {
+        // se o servidor guarda os registros da sequência: é dono da partição ou foi quem criou
+        return origin === server || this.ring.owns(server, stream);
+    }
+    
+    channelReplicas(channel) {
+        // fator de replicação das mensagens de um canal
+        const record = this.state.channels.get(channel);
+        return record && record.replicas !== undefined ? record.replicas : this.replicationFactor;
+    }
+    
+    replicateData(dataType, payload) {
+        // entra na fila de replicação; a resposta ao cliente não espera o envio do lote
+        this.enqueueReplication({ kind: dataType, payload: payload });
+    }
+    
+    replicateFrame(stream, frame) {
+        // mensagem replicada como o frame já publicado (origem e seq vêm do lote e do cabeçalho)
+        this.enqueueReplication(stream ? { kind: 'message', stream: stream, frame: frame } : { kind: 'message', frame: frame });
+    }
+    
+    enqueueReplication(record) {
+        this.replicationOutbox.push(record);
+        if (this.replicationOutbox.length >= this.replicationBatchMax) {
+            this.flushReplication();
+        } else if (this.replicationTimer === null) {
+            this.replicationTimer = setTimeout(() => this.flushReplication(), this.replicationBatchMs);
         }
     }
     
-    async broadcastSync() {
-        // Enviar dados completos para todos os servidores
+    async flushReplication() {
+        if (this.replicationTimer !== null) {
+            clearTimeout(this.replicationTimer);
+            this.replicationTimer = null;
+        }
+        if (this.replicationOutbox.length === 0) {
+            return;
+        }
+        const records = this.replicationOutbox;
+        this.replicationOutbox = [];
+        
         try {
-            const currentDisplayName = this.getServerDisplayName(this.serverName);
-            console.log(`[REPLICACAO] Servidor ${currentDisplayName} enviando sincronização completa`);
-            
-            const syncData = {
+            const replicationMessage = {
                 originServer: this.serverName,
-                dataType: 'sync',
+                dataType: 'batch',
                 payload: {
-                    users: this.users,
-                    channels: this.channels,
-                    messages: this.messages
+                    origin: this.serverName,
+                    records: records
                 },
                 timestamp: Math.floor(Date.now() / 1000),
                 clock: this.incrementClock()
             };
             
-            await this.pubSocket.send(["replication", msgpack.encode(syncData)]);
-            console.log(`[REPLICACAO] Sincronização completa enviada (${this.users.length} usuários, ${this.channels.length} canais, ${this.messages.length} mensagens)`);
+            await this.internalPubSocket.send(["replication", msgpack.encode(replicationMessage)]);
+            const currentDisplayName = this.getServerDisplayName(this.serverName);
+            console.log(`[REPLICACAO] Servidor ${currentDisplayName} replicou lote de ${records.length} registros`);
         } catch (error) {
-            console.error(`[REPLICACAO] Erro ao enviar sincronização: ${error.message}`);
+            // os outros servidores veem a lacuna no próximo lote e buscam pela sincronização
+            console.error(`[REPLICACAO] Erro ao replicar lote: ${error.message}`);
+        }
+    }
+    
+    startSyncListener() {
+        // pedidos dos outros servidores: registros que faltam pro vetor recebido e amostras de relógio
+        (async () => {
+            while (true) {
+                try {
+                    const frames = await this.syncSocket.receive();
+                    const envelope = frames.slice(0, -1);
+                    const request = msgpack.decode(frames[frames.length - 1]);
+                    const data = request.data || {};
+                    if (data.clock !== undefined) {
+                        this.updateClock(data.clock);
+                    }
+                    
+                    if (request.service === "clock") {
+                        // amostra da rodada de Berkeley: só a hora local, sem tocar no estado
+                        const response = {
+                            service: "clock",
+                            data: {
+                                time: this.physicalTime(),
+                                timestamp: Date.now(),
+                                clock: this.incrementClock()
+                            }
+                        };
+                        await this.syncSocket.send([...envelope, msgpack.encode(response)]);
+                        continue;
+                    }
+                    
+                    if (request.service === "versions") {
+                        // vetor de versões atual (benchmarks/cluster.py mede a recuperação de uma réplica com ele);
+                        // owned: quais das chaves pedidas em keys são de sequências que este servidor guarda
+                        const response = {
+                            service: "versions",
+                            data: {
+                                vector: Object.fromEntries(this.state.versions),
+                                owned: (data.keys || []).filter(key => this.keeps(this.serverName, key.split('/')[0], streamOfKey(key))),
+                                timestamp: Date.now(),
+                                clock: this.incrementClock()
+                            }
+                        };
+                        await this.syncSocket.send([...envelope, msgpack.encode(response)]);
+                        continue;
+                    }
+                    
+                    if (request.service === "history") {
+                        // histórico repassado por um servidor que não é dono do canal/usuário
+                        const response = await this.handleHistory({ ...data, forwarded: true });
+                        await this.syncSocket.send([...envelope, msgpack.encode(response)]);
+                        continue;
+                    }
+                    
+                    // só as sequências que quem pede guarda (sem o nome, todas)
+                    const limit = Math.min(data.limit || this.syncChunk, this.syncChunk);
+                    const wanted = data.server === undefined ? undefined : (origin, stream) => this.keeps(data.server, origin, stream);
+                    const missing = this.state.missingFor(data.vector || {}, limit, wanted);
+                    const response = {
+                        service: "sync",
+                        data: {
+                            records: missing.records,
+                            more: missing.more,
+                            timestamp: Date.now(),
+                            clock: this.incrementClock()
+                        }
+                    };
+                    await this.syncSocket.send([...envelope, msgpack.encode(response)]);
+                    if (missing.records.length > 0) {
+                        console.log(`[REPLICACAO] Enviados ${missing.records.length} registros de sincronização${missing.more ? " (há mais)" : ""}`);
+                    }
+                } catch (error) {
+                    console.error(`[REPLICACAO] Erro no listener de sincronização: ${error.message}`);
+                    await new Promise(resolve => setTimeout(resolve, 100));
+                }
+            }
+        })();
+    }
+    
+    catchUp() {
+        // pede aos outros servidores só o que falta; pedidos durante uma rodada viram mais uma rodada
+        if (this.catchUpRunning) {
+            this.catchUpPending = true;
+            return;
+        }
+        this.catchUpRunning = true;
+        (async () => {
+            try {
+                do {
+                    this.catchUpPending = false;
+                    await this.catchUpFromPeers();
+                    if (this.catchUpPending) {
+                        // não martelar os outros enquanto a lacuna não chega em ninguém
+                        await new Promise(resolve => setTimeout(resolve, 1000));
+                    }
+                } while (this.catchUpPending);
+            } finally {
+                this.catchUpRunning = false;
+            }
+        })();
+    }
+    
+    async catchUpFromPeers() {
+        // coordenador primeiro, depois por rank; cada um só manda o que os anteriores não mandaram
+        const peers = this.serverList
+            .filter(s => s.name !== this.serverName && s.address)
+            .sort((a, b) => (b.name === this.coordinator) - (a.name === this.coordinator) || a.rank - b.rank);
+        for (const peer of peers) {
+            const displayName = this.getServerDisplayName(peer.name);
+            try {
+                const started = Date.now();
+                const applied = await this.catchUpFrom(peer);
+                if (applied > 0) {
+                    console.log(`[REPLICACAO] ${applied} registros recebidos de ${displayName} em ${Date.now() - started}ms`);
+                }
+            } catch (error) {
+                console.error(`[REPLICACAO] Erro ao sincronizar com ${displayName}: ${error.message}`);
+            }
+        }
+    }
+    
+    async catchUpFrom(peer) {
+        let applied = 0;
+        while (true) {
+            const request = {
+                service: "sync",
+                data: {
+                    server: this.serverName,
+                    vector: Object.fromEntries(this.state.versions),
+                    limit: this.syncChunk,
+                    timestamp: Date.now(),
+                    clock: this.incrementClock()
+                }
+            };
+            const response = await this.peerPool.request(peer.address, request, this.syncTimeout);
+            const data = response.data || {};
+            if (data.clock !== undefined) {
+                this.updateClock(data.clock);
+            }
+            
+            const records = data.records || [];
+            applied += this.applyRecords(records).applied;
+            
+            if (!data.more || records.length === 0) {
+                return applied;
+            }
+        }
+    }
+    
+    restoreRecord(kind, payload) {
+        if (payload.origin !== undefined && payload.seq !== undefined) {
+            this.state.trackRecord(kind, payload);
+            this.state.advanceVersion(versionKey(payload.origin, payload.stream), payload.seq);
         }
     }
     
@@ -581,7 +826,7 @@ class Server {
     
     saveUsers() {
         try {
-            fs.writeFileSync(this.usersFile, JSON.stringify(this.users, null, 2));
+            fs.writeFileSync(this.usersFile, JSON.stringify(Array.from(this.state.users.values()), null, 2));
         } catch (error) {
             console.error("Erro ao salvar usuários:", error);
         }
@@ -600,31 +845,64 @@ class Server {
     }
     
     loadMessages() {
+        // Mensagens ficam num log append-only segmentado (messageLog.js): snapshot + registros posteriores
+        const messages = [];
         try {
-            if (fs.existsSync(this.messagesFile)) {
-                const data = fs.readFileSync(this.messagesFile, 'utf8');
-                return JSON.parse(data);
+            this.messageLog = new MessageLog(this.messagesDir);
+            const started = Date.now();
+            const loaded = this.messageLog.load(message => messages.push(message));
+            console.log(`[PERSISTENCIA] ${messages.length} mensagens carregadas (snapshot: ${loaded.snapshot}, log: ${loaded.tail}) em ${Date.now() - started}ms`);
+            
+            // Migrar o messages.json do formato antigo uma única vez
+            if (this.messageLog.nextOffset === 0 && fs.existsSync(this.messagesFile)) {
+                const legacy = JSON.parse(fs.readFileSync(this.messagesFile, 'utf8'));
+                legacy.forEach(message => {
+                    messages.push(message);
+                    this.appendMessage(message);
+                });
+                fs.renameSync(this.messagesFile, `${this.messagesFile}.migrated`);
+                console.log(`[PERSISTENCIA] ${legacy.length} mensagens migradas de messages.json para o log`);
             }
         } catch (error) {
             console.error("Erro ao carregar mensagens:", error);
         }
-        return [];
+        // o log guarda na ordem de chegada; a ordenação por clock fica com o ChatState
+        return messages;
     }
     
     saveChannels() {
         try {
-            fs.writeFileSync(this.channelsFile, JSON.stringify(this.channels, null, 2));
+            fs.writeFileSync(this.channelsFile, JSON.stringify(Array.from(this.state.channels.values()), null, 2));
         } catch (error) {
             console.error("Erro ao salvar canais:", error);
         }
     }
     
-    saveMessages() {
-        try {
-            fs.writeFileSync(this.messagesFile, JSON.stringify(this.messages, null, 2));
-        } catch (error) {
-            console.error("Erro ao salvar mensagens:", error);
+    appendMessage(message) {
+        // Anexa a mensagem ao log; o fsync sai no próximo group commit (SERVER_LOG_SYNC_MS)
+        // sem bloquear o event loop. A promessa devolvida resolve true quando a mensagem está no
+        // disco e false se a gravação falhar ou antes do rank (sem diretório de dados, nada é gravado)
+        if (this.messageLog === null) {
+            return Promise.resolve(false);
+        }
+        // erros de gravação já são logados pelo próprio log
+        return this.messageLog.append(message).then(() => true, () => false);
+    }
+    
+    async durableError(service, durable) {
+        // com SERVER_LOG_DURABLE_ACK, resposta de erro se a mensagem não chegou ao disco (null = OK)
+        if (!this.durableAcks || await durable) {
+            return null;
         }
+        return {
+            service: service,
+            data: {
+                status: "erro",
+                message: "Erro ao gravar mensagem",
+                timestamp: Date.now(),
+                clock: this.incrementClock()
+            }
+        };
     }
     
     getServerDisplayName(serverName) {
@@ -685,6 +963,7 @@ class Server {
                 service: "rank",
                 data: {
                     user: this.serverName,
+                    address: this.syncAddress,
                     timestamp: Date.now(),
                     clock: this.incrementClock()
                 }
@@ -723,9 +1002,22 @@ class Server {
                         this.migrateFromOldDirectories();
                         
                         // Carregar dados do novo diretório
-                        this.users = this.loadUsers();
-                        this.channels = this.loadChannels();
-                        this.messages = this.loadMessages();
+                        this.state = new ChatState();
+                        this.loadUsers().forEach(user => this.state.putUser(user));
+                        this.loadChannels().forEach(channel => this.state.putChannel(channel));
+                        this.state.mergeMessages(this.loadMessages());
+                        this.seqMarks = new SeqMarks(this.seqsFile).load();
+                        
+                        // refazer o vetor de versões a partir do que foi carregado
+                        for (const user of this.state.users.values()) {
+                            this.restoreRecord('user', user);
+                        }
+                        for (const channel of this.state.channels.values()) {
+                            this.restoreRecord('channel', channel);
+                        }
+                        for (const message of this.state.allMessages()) {
+                            this.restoreRecord('message', message);
+                        }
                     }
                     
                     if (responseData.data.clock !== undefined) {
@@ -763,16 +1055,15 @@ class Server {
                                 }
                             }, 3000);
                         }
-                        
-                        // Solicitar sincronização após um delay
-                        const currentDisplayName = this.getServerDisplayName(this.serverName);
-                        console.log(`[REPLICACAO] Servidor ${currentDisplayName} aguardando para solicitar sincronização inicial`);
-                        setTimeout(async () => {
-                            const currentDisplayName2 = this.getServerDisplayName(this.serverName);
-                            console.log(`[REPLICACAO] Servidor ${currentDisplayName2} solicitando sincronização inicial`);
-                            await this.requestSync();
-                        }, 5000); // Aguardar 5 segundos para outros servidores iniciarem
                     }
+                    
+                    // Buscar o que foi criado enquanto estávamos fora, depois que os outros se registrarem
+                    const currentDisplayName = this.getServerDisplayName(this.serverName);
+                    console.log(`[REPLICACAO] Servidor ${currentDisplayName} aguardando para sincronizar`);
+                    setTimeout(async () => {
+                        await this.getServerList();
+                        this.catchUp();
+                    }, 5000); // Aguardar 5 segundos para outros servidores iniciarem
                 } else {
                     console.error("Resposta inválida do servidor de referência:", JSON.stringify(responseData));
                 }
@@ -791,12 +1082,32 @@ class Server {
     startHeartbeat() {
         setInterval(async () => {
             try {
+                // heartbeat e lista incremental de servidores numa única ida e volta
                 const message = {
-                    service: "heartbeat",
+                    service: "batch",
                     data: {
-                        user: this.serverName,
                         timestamp: Date.now(),
-                        clock: this.incrementClock()
+                        clock: this.incrementClock(),
+                        operations: [
+                            {
+                                service: "heartbeat",
+                                data: {
+                                    user: this.serverName,
+                                    address: this.syncAddress,
+                                    timestamp: Date.now(),
+                                    clock: this.logicalClock
+                                }
+                            },
+                            {
+                                service: "list",
+                                data: {
+                                    since: this.serverListVersion,
+                                    epoch: this.serverListEpoch,
+                                    timestamp: Date.now(),
+                                    clock: this.logicalClock
+                                }
+                            }
+                        ]
                     }
                 };
                 
@@ -818,6 +1129,12 @@ class Server {
                     if (responseData && responseData.data && responseData.data.clock !== undefined) {
                         this.updateClock(responseData.data.clock);
                     }
+                    
+                    const results = (responseData && responseData.data && responseData.data.results) || [];
+                    const listResult = results.find(result => result.service === "list");
+                    if (listResult && listResult.data && listResult.data.list) {
+                        this.applyServerList(listResult.data);
+                    }
                 } catch (decodeError) {
                     console.error("Erro ao decodificar resposta do heartbeat:", decodeError);
                 }
@@ -827,6 +1144,63 @@ class Server {
         }, 10000); // Heartbeat a cada 10 segundos
     }
     
+    sendToBroker(frames) {
+        // Encadear envios para nunca haver dois send() pendentes no mesmo socket
+        this.brokerSendChain = this.brokerSendChain
+            .then(() => this.repSocket.send(frames))
+            .catch(error => console.error(`[BROKER] Erro ao enviar para o broker: ${error.message}`));
+        return this.brokerSendChain;
+    }
+    
+    startBrokerHeartbeat() {
+        if (this.brokerMode !== "lb") {
+            return;
+        }
+        
+        // anunciar ao broker que estamos prontos, informando quantas requisições aceitamos
+        this.sendToBroker([PPP_READY, String(this.brokerCredit)]);
+        console.log(`[BROKER] Servidor ${this.serverName} anunciado ao broker (crédito: ${this.brokerCredit})`);
+        
+        setInterval(() => {
+            this.sendToBroker([PPP_HEARTBEAT]);
+        }, this.brokerHeartbeatInterval);
+    }
+    
+    async receiveRequest() {
+        // Retorna { envelope, message } - envelope é null no modo REP
+        while (true) {
+            const frames = await this.repSocket.receive();
+            if (this.brokerMode !== "lb") {
+                return { envelope: null, message: frames };
+            }
+            
+            // heartbeat do broker: nada a responder
+            if (frames.length === 1 && frames[0].equals(PPP_HEARTBEAT)) {
+                continue;
+            }
+            // broker que não nos conhece (reiniciou ou nos removeu) pede um READY novo com o crédito
+            if (frames.length === 1 && frames[0].equals(PPP_READY)) {
+                this.sendToBroker([PPP_READY, String(this.brokerCredit)]);
+                continue;
+            }
+            
+            // [client, "", payload]
+            const delimiter = frames.findIndex(frame => frame.length === 0);
+            return { envelope: frames.slice(0, delimiter + 1), message: frames.slice(delimiter + 1) };
+        }
+    }
+    
+    async sendReply(envelope, buffer) {
+        if (this.brokerMode === "lb") {
+            // sem envelope não há cliente para quem responder
+            if (envelope !== null) {
+                await this.sendToBroker([...envelope, buffer]);
+            }
+        } else {
+            await this.repSocket.send(buffer);
+        }
+    }
+    
     async handleLogin(data) {
         const username = data.user;
         const timestamp = data.timestamp;
@@ -848,9 +1222,7 @@ class Server {
         }
         
         // Verificar se usuário já existe
-        const existingUser = this.users.find(u => u.user === username);
-        
-        if (existingUser) {
+        if (this.state.hasUser(username)) {
             return {
                 service: "login",
                 data: {
@@ -868,11 +1240,12 @@ class Server {
             timestamp: timestamp,
             clock: this.incrementClock()
         };
-        this.users.push(newUser);
+        this.stampRecord('user', newUser);
+        this.state.putUser(newUser);
         this.saveUsers();
         
         // Replicar dados para outros servidores
-        await this.replicateData('user', newUser);
+        this.replicateData('user', newUser);
         
         return {
             service: "login",
@@ -893,7 +1266,7 @@ class Server {
             data: {
                 timestamp: Math.floor(Date.now() / 1000),
                 clock: this.incrementClock(),
-                users: this.users.map(u => u.user)
+                users: Array.from(this.state.users.keys())
             }
         };
     }
@@ -918,9 +1291,7 @@ class Server {
         }
         
         // Verificar se canal já existe
-        const existingChannel = this.channels.find(c => c.channel === channelName);
-        
-        if (existingChannel) {
+        if (this.state.hasChannel(channelName)) {
             return {
                 service: "channel",
                 data: {
@@ -932,17 +1303,35 @@ class Server {
             };
         }
         
+        // fator de replicação próprio do canal (opcional; sem ele vale SERVER_REPLICATION_FACTOR)
+        const replicas = data.replicas;
+        if (replicas !== undefined && replicas !== null && !(Number.isInteger(replicas) && replicas >= 0)) {
+            return {
+                service: "channel",
+                data: {
+                    status: "erro",
+                    timestamp: Date.now(),
+                    clock: this.incrementClock(),
+                    description: "Fator de replicação inválido"
+                }
+            };
+        }
+        
         // Adicionar novo canal
         const newChannel = {
             channel: channelName,
             timestamp: timestamp,
             clock: this.incrementClock()
         };
-        this.channels.push(newChannel);
+        if (Number.isInteger(replicas)) {
+            newChannel.replicas = replicas;
+        }
+        this.stampRecord('channel', newChannel);
+        this.state.putChannel(newChannel);
         this.saveChannels();
         
         // Replicar dados para outros servidores
-        await this.replicateData('channel', newChannel);
+        this.replicateData('channel', newChannel);
         
         return {
             service: "channel",
@@ -963,12 +1352,12 @@ class Server {
             data: {
                 timestamp: Math.floor(Date.now() / 1000),
                 clock: this.incrementClock(),
-                channels: this.channels.map(c => c.channel)
+                channels: Array.from(this.state.channels.keys())
             }
         };
     }
     
-    async handlePublish(data) {
+    async handlePublish(data, trace) {
         const user = data.user;
         const channel = data.channel;
         const message = data.message;
@@ -1003,9 +1392,7 @@ class Server {
         }
         
         // Verificar se canal existe
-        const existingChannel = this.channels.find(c => c.channel === channel);
-        
-        if (!existingChannel) {
+        if (!this.state.hasChannel(channel)) {
             return {
                 service: "publish",
                 data: {
@@ -1026,34 +1413,35 @@ class Server {
             timestamp: timestamp,
             clock: this.incrementClock()
         };
-        this.messages.push(messageData);
-        this.saveMessages();
+        const topic = `${CHANNEL_TOPIC_PREFIX}${channel}`;
+        const stream = streamFor(topic, this.channelReplicas(channel));
+        this.stampRecord('message', messageData, stream);
+        this.state.addMessage(messageData);
+        const durable = this.appendMessage(messageData);
+        
+        // publicação codificada uma vez (ver server/frame.js): o mesmo buffer vai pro canal e
+        // pro lote de replicação; a requisição rastreada leva o trace com o instante em que saiu daqui
+        const frame = encodeFrame(FRAME_PUBLISH, topic, messageData.clock, messageData.seq, {
+            user: user,
+            channel: channel,
+            message: message,
+            timestamp: timestamp,
+            clock: messageData.clock
+        }, trace ? { id: trace.id, sent: trace.sent, pub: epochMicros() } : null);
         
         // Replicar dados para outros servidores
-        await this.replicateData('message', messageData);
+        this.replicateFrame(stream, frame);
         
         // Publicar mensagem no canal
-        const pubMessage = {
-            service: "publish",
-            data: {
-                user: user,
-                channel: channel,
-                message: message,
-                timestamp: timestamp,
-                clock: messageData.clock
-            }
-        };
-        
-        await this.pubSocket.send([channel, msgpack.encode(pubMessage)]);
+        await this.pubSocket.send([topic, frame]);
         
-        // Incrementar contador de mensagens
+        // Incrementar contador de mensagens (a sincronização de relógio roda em segundo plano)
         this.messageCount++;
-        if (this.messageCount % 10 === 0) {
-            console.log(`[AUDITORIA RELÓGIO] Processadas ${this.messageCount} mensagens - iniciando sincronização de relógio`);
-            console.log(`[AUDITORIA RELÓGIO] Servidor: ${this.serverName}, Coordenador: ${this.getCoordinatorDisplayName()}, Rank: ${this.serverRank || 'N/A'}`);
-            await this.synchronizeClock();
-        }
         
+        const failed = await this.durableError("publish", durable);
+        if (failed) {
+            return failed;
+        }
         return {
             service: "publish",
             data: {
@@ -1064,7 +1452,7 @@ class Server {
         };
     }
     
-    async handleMessage(data) {
+    async handleMessage(data, trace) {
         const src = data.src;
         const dst = data.dst;
         const message = data.message;
@@ -1074,9 +1462,7 @@ class Server {
         this.updateClock(receivedClock);
         
         // Verificar se usuário destino existe
-        const existingUser = this.users.find(u => u.user === dst);
-        
-        if (!existingUser) {
+        if (!this.state.hasUser(dst)) {
             return {
                 service: "message",
                 data: {
@@ -1097,49 +1483,170 @@ class Server {
             timestamp: timestamp,
             clock: this.incrementClock()
         };
-        this.messages.push(messageData);
-        this.saveMessages();
+        const topic = `${USER_TOPIC_PREFIX}${dst}`;
+        const stream = streamFor(topic, this.replicationFactor);
+        this.stampRecord('message', messageData, stream);
+        this.state.addMessage(messageData);
+        const durable = this.appendMessage(messageData);
+        
+        const frame = encodeFrame(FRAME_MESSAGE, topic, messageData.clock, messageData.seq, {
+            src: src,
+            dst: dst,
+            message: message,
+            timestamp: timestamp,
+            clock: messageData.clock
+        }, trace ? { id: trace.id, sent: trace.sent, pub: epochMicros() } : null);
         
         // Replicar dados para outros servidores
-        await this.replicateData('message', messageData);
+        this.replicateFrame(stream, frame);
         
         // Publicar mensagem para usuário
-        const pubMessage = {
+        await this.pubSocket.send([topic, frame]);
+        
+        // Incrementar contador de mensagens (a sincronização de relógio roda em segundo plano)
+        this.messageCount++;
+        
+        const failed = await this.durableError("message", durable);
+        if (failed) {
+            return failed;
+        }
+        return {
             service: "message",
             data: {
-                src: src,
-                dst: dst,
-                message: message,
-                timestamp: timestamp,
-                clock: messageData.clock
+                status: "OK",
+                timestamp: Math.floor(Date.now() / 1000),
+                clock: this.incrementClock()
             }
         };
+    }
+    
+    async handleHistory(data) {
+        const receivedClock = data.clock || 0;
+        this.updateClock(receivedClock);
+        
+        const cursor = data.cursor;
+        if (cursor !== undefined && cursor !== null && (typeof cursor.clock !== "number" || !(cursor.count >= 0))) {
+            return {
+                service: "history",
+                data: {
+                    status: "erro",
+                    timestamp: Date.now(),
+                    clock: this.incrementClock(),
+                    description: "Cursor inválido"
+                }
+            };
+        }
         
-        await this.pubSocket.send([dst, msgpack.encode(pubMessage)]);
+        // histórico do canal (publicações) ou do usuário (mensagens diretas recebidas)
+        let list;
+        let stream;
+        if (data.channel) {
+            if (!this.state.hasChannel(data.channel)) {
+                return {
+                    service: "history",
+                    data: {
+                        status: "erro",
+                        timestamp: Date.now(),
+                        clock: this.incrementClock(),
+                        description: "Canal não existe"
+                    }
+                };
+            }
+            stream = streamFor(`${CHANNEL_TOPIC_PREFIX}${data.channel}`, this.channelReplicas(data.channel));
+            list = this.state.channelMessages(data.channel);
+        } else if (data.user) {
+            stream = streamFor(`${USER_TOPIC_PREFIX}${data.user}`, this.replicationFactor);
+            list = this.state.directMessages(data.user);
+        } else {
+            return {
+                service: "history",
+                data: {
+                    status: "erro",
+                    timestamp: Date.now(),
+                    clock: this.incrementClock(),
+                    description: "Canal ou usuário não fornecido"
+                }
+            };
+        }
         
-        // Incrementar contador de mensagens
-        this.messageCount++;
-        if (this.messageCount % 10 === 0) {
-            console.log(`[AUDITORIA RELÓGIO] Processadas ${this.messageCount} mensagens - iniciando sincronização de relógio`);
-            console.log(`[AUDITORIA RELÓGIO] Servidor: ${this.serverName}, Coordenador: ${this.getCoordinatorDisplayName()}, Rank: ${this.serverRank || 'N/A'}`);
-            await this.synchronizeClock();
+        if (!data.forwarded && !this.ring.owns(this.serverName, stream)) {
+            // as mensagens ficam com os donos da partição: aqui só haveria as criadas neste servidor
+            const response = await this.forwardHistory(data, stream);
+            if (response !== null) {
+                return response;
+            }
         }
         
+        const limit = Math.max(1, Math.min(parseInt(data.limit) || this.historyMaxLimit, this.historyMaxLimit));
+        const page = this.state.historyPage(list, cursor, limit);
         return {
-            service: "message",
+            service: "history",
             data: {
                 status: "OK",
-                timestamp: Math.floor(Date.now() / 1000),
+                // origin/seq são da sincronização entre servidores, não vão pro cliente
+                messages: page.messages.map(({ origin, seq, ...message }) => message),
+                next: page.next,
+                timestamp: Date.now(),
                 clock: this.incrementClock()
             }
         };
     }
     
+    async forwardHistory(data, stream) {
+        // repassa o pedido aos donos da sequência, em ordem de preferência; null se nenhum respondeu
+        for (const owner of this.ring.ownersOf(stream)) {
+            const server = this.serverList.find(s => s.name === owner);
+            if (!server || !server.address) {
+                continue;
+            }
+            try {
+                const request = { service: "history", data: { ...data, forwarded: true } };
+                const response = await this.peerPool.request(server.address, request, this.syncTimeout);
+                if (response.data && response.data.clock !== undefined) {
+                    this.updateClock(response.data.clock);
+                }
+                return response;
+            } catch (error) {
+                console.error(`[ANEL] Erro ao repassar histórico pra ${this.getServerDisplayName(owner)}: ${error.message}`);
+            }
+        }
+        console.error(`[ANEL] Nenhum dono da partição ${stream} respondeu: histórico só com o que há aqui`);
+        return null;
+    }
+    
+    applyServerList(listData) {
+        // Lista completa substitui a atual; lista incremental só traz quem entrou ou saiu
+        if (listData.full !== false) {
+            this.serverList = listData.list;
+        } else {
+            const removed = new Set([...(listData.removed || []), ...listData.list.map(s => s.name)]);
+            this.serverList = this.serverList.filter(s => !removed.has(s.name)).concat(listData.list);
+        }
+        if (listData.version !== undefined) {
+            this.serverListVersion = listData.version;
+            this.serverListEpoch = listData.epoch;
+        }
+        this.peerPool.retain(this.serverList.filter(s => s.address).map(s => s.address));
+        
+        // o anel segue a lista; quem virou dono de uma partição busca o histórico dela com os outros
+        const names = this.serverList.map(s => s.name);
+        if (!this.ring.sameAs(names)) {
+            const hadRing = this.ring.size > 0;
+            this.ring = new HashRing(names);
+            console.log(`[ANEL] ${this.ring.size} servidores no anel (fator de replicação padrão: ${this.replicationFactor || "todos"})`);
+            if (hadRing) {
+                this.catchUp();
+            }
+        }
+    }
+    
     async getServerList() {
         try {
             const message = {
                 service: "list",
                 data: {
+                    since: this.serverListVersion,
+                    epoch: this.serverListEpoch,
                     timestamp: Date.now(),
                     clock: this.incrementClock()
                 }
@@ -1161,7 +1668,7 @@ class Server {
                 
                 // Validar estrutura da resposta
                 if (responseData && responseData.data && responseData.data.list) {
-                    this.serverList = responseData.data.list;
+                    this.applyServerList(responseData.data);
                     
                     // Se não temos coordenador, verificar se existe um servidor com rank 1
                     if (!this.coordinator && this.serverList.length > 0) {
@@ -1184,110 +1691,116 @@ class Server {
         }
     }
     
-    async synchronizeClock() {
-        if (!this.coordinator || this.coordinator === this.serverName) {
-            // se somos o coordenador, não precisa sincronizar
-            console.log(`[AUDITORIA RELÓGIO] Servidor ${this.serverName} é o coordenador - não precisa sincronizar`);
+    physicalTime() {
+        // relógio físico local com a correção acumulada das rodadas de Berkeley
+        return Date.now() + this.clockOffset;
+    }
+    
+    startClockSync() {
+        // o coordenador faz uma rodada a cada SERVER_CLOCK_SYNC_INTERVAL; os outros só
+        // verificam se as rodadas continuam chegando (senão o coordenador caiu)
+        if (this.clockSyncInterval <= 0) {
             return;
         }
-        
-        try {
-            const clockBefore = this.logicalClock;
-            const timestampBefore = Math.floor(Date.now() / 1000);
-            
-            console.log(`[AUDITORIA RELÓGIO] Servidor ${this.serverName} (rank ${this.serverRank}) solicitando hora ao coordenador ${this.coordinator}`);
-            console.log(`[AUDITORIA RELÓGIO] Relógio lógico antes da sincronização: ${clockBefore}`);
-            console.log(`[AUDITORIA RELÓGIO] Timestamp físico antes da sincronização: ${timestampBefore}`);
-            
-            // obter lista de servidores pra encontrar endereço do coordenador
-            await this.getServerList();
-            const coordinatorInfo = this.serverList.find(s => s.name === this.coordinator);
-            
-            if (!coordinatorInfo) {
-                console.error(`[AUDITORIA RELÓGIO] Coordenador ${this.coordinator} não encontrado na lista de servidores`);
+        setInterval(async () => {
+            if (this.coordinator === this.serverName) {
+                await this.runClockRound();
+            } else if (this.coordinator && Date.now() - this.lastClockRound > 3 * this.clockSyncInterval) {
+                console.log(`[AUDITORIA RELÓGIO] Nenhuma rodada de relógio de ${this.getCoordinatorDisplayName()} em ${3 * this.clockSyncInterval / 1000}s - iniciando eleição`);
+                this.lastClockRound = Date.now();
                 await this.startElection();
-                return;
             }
-            
-            // preparar mensagem de solicitação de hora
-            const requestMessage = {
-                service: "clock",
-                data: {
-                    timestamp: timestampBefore,
-                    clock: this.incrementClock()
-                }
-            };
-            
-            // tentar conectar ao coordenador via broker (usando o mesmo mecanismo de clientes)
-            // como os servidores não têm endereços diretos, vamos usar o broker
-            // enviando uma mensagem especial que será roteada ao coordenador
+        }, this.clockSyncInterval);
+    }
+    
+    async runClockRound() {
+        // Berkeley: pede a hora a todos ao mesmo tempo, estima a defasagem de cada um pela
+        // ida e volta, tira a média (com o coordenador) e publica o ajuste de cada servidor
+        const round = ++this.clockRound;
+        const peers = this.serverList.filter(s => s.name !== this.serverName && s.address);
+        const samples = await Promise.all(peers.map(async peer => {
+            const started = performance.now();
             try {
-                // criar novo socket req temporário pra comunicação com coordenador
-                const tempReqSocket = new zmq.Request();
-                tempReqSocket.connect("tcp://broker:5555");
-                
-                // enviar requisição com identificador especial pra rotear ao coordenador
-                const clockRequest = {
+                const response = await this.peerPool.request(peer.address, {
                     service: "clock",
                     data: {
-                        timestamp: timestampBefore,
-                        clock: this.incrementClock(),
-                        coordinator: this.coordinator,
-                        requestingServer: this.serverName
-                    }
-                };
-                
-                tempReqSocket.send(msgpack.encode(clockRequest));
-                
-                // aguardar resposta com timeout
-                const response = await Promise.race([
-                    tempReqSocket.receive(),
-                    new Promise((_, reject) => setTimeout(() => reject(new Error("Timeout")), 5000))
-                ]);
-                
-                let responseBuffer;
-                if (Array.isArray(response)) {
-                    responseBuffer = Buffer.isBuffer(response[0]) ? response[0] : Buffer.from(response[0]);
-                } else {
-                    responseBuffer = Buffer.isBuffer(response) ? response : Buffer.from(response);
-                }
-                
-                const responseData = msgpack.decode(responseBuffer);
-                
-                if (responseData && responseData.data && responseData.data.time) {
-                    // algoritmo de berkeley: calcular offset e ajustar
-                    const coordinatorTime = responseData.data.time;
-                    const coordinatorTimestamp = responseData.data.timestamp;
-                    const currentTime = Date.now();
-                    const currentTimestamp = Math.floor(currentTime / 1000);
-                    
-                    // calcular offset (diferença entre o tempo do coordenador e o nosso)
-                    const offset = coordinatorTimestamp - currentTimestamp;
-                    
-                    // atualizar relógio lógico com o valor recebido
-                    if (responseData.data.clock !== undefined) {
-                        this.updateClock(responseData.data.clock);
+                        round: round,
+                        timestamp: Date.now(),
+                        clock: this.incrementClock()
                     }
-                    
-                    console.log(`[AUDITORIA RELÓGIO] Sincronização de relógio concluída`);
-                    console.log(`[AUDITORIA RELÓGIO] Tempo do coordenador: ${coordinatorTimestamp}, Tempo local: ${currentTimestamp}`);
-                    console.log(`[AUDITORIA RELÓGIO] Offset calculado: ${offset} segundos`);
-                    console.log(`[AUDITORIA RELÓGIO] Coordenador atual: ${this.getCoordinatorDisplayName()}`);
-                    console.log(`[AUDITORIA RELÓGIO] Relógio lógico atualizado: ${clockBefore} -> ${this.logicalClock}`);
+                }, this.clockSyncTimeout);
+                const rtt = performance.now() - started;
+                if (response.data.clock !== undefined) {
+                    this.updateClock(response.data.clock);
                 }
-                
-                tempReqSocket.close();
+                // a hora do outro foi lida, em média, no meio da ida e volta
+                return { name: peer.name, rtt: rtt, skew: response.data.time + rtt / 2 - this.physicalTime() };
             } catch (error) {
-                console.error(`[AUDITORIA RELÓGIO] Erro ao sincronizar relógio via broker: ${error.message}`);
-                // se falhar, tentar eleição
-                await this.startElection();
+                console.error(`[AUDITORIA RELÓGIO] Rodada ${round}: ${this.getServerDisplayName(peer.name)} não respondeu (${error.message})`);
+                return { name: peer.name, rtt: null, skew: null };
             }
-            
-        } catch (error) {
-            console.error(`[AUDITORIA RELÓGIO] Erro ao sincronizar relógio: ${error.message}`);
-            console.error(`[AUDITORIA RELÓGIO] Stack trace: ${error.stack}`);
-            await this.startElection();
+        }));
+        
+        const used = samples.filter(sample => sample.rtt !== null && sample.rtt <= this.clockMaxRtt);
+        const average = used.reduce((sum, sample) => sum + sample.skew, 0) / (used.length + 1);
+        const adjustments = { [this.serverName]: average };
+        for (const sample of used) {
+            adjustments[sample.name] = average - sample.skew;
+        }
+        
+        const message = {
+            service: "clock",
+            data: {
+                round: round,
+                coordinator: this.serverName,
+                adjustments: adjustments,
+                samples: samples,
+                timestamp: Date.now(),
+                clock: this.incrementClock()
+            }
+        };
+        await this.internalPubSocket.send(["servers", msgpack.encode(message)]);
+        this.applyClockRound(message.data);
+    }
+    
+    applyClockRound(data) {
+        // aplica o ajuste deste servidor e guarda as medidas da rodada pro serviço clock_stats
+        this.lastClockRound = Date.now();
+        if (data.clock !== undefined) {
+            this.updateClock(data.clock);
         }
+        const adjustment = data.adjustments[this.serverName];
+        if (adjustment !== undefined) {
+            this.clockOffset += adjustment;
+        }
+        this.clockStats = {
+            round: data.round,
+            coordinator: data.coordinator,
+            at: this.lastClockRound,
+            adjustment: adjustment === undefined ? null : adjustment,
+            samples: data.samples
+        };
+        const measured = data.samples.filter(sample => sample.rtt !== null);
+        const maxSkew = Math.max(0, ...measured.map(sample => Math.abs(sample.skew)));
+        const maxRtt = Math.max(0, ...measured.map(sample => sample.rtt));
+        console.log(`[AUDITORIA RELÓGIO] Rodada ${data.round} de ${this.getServerDisplayName(data.coordinator)}: ${measured.length}/${data.samples.length} servidores, defasagem máxima ${maxSkew.toFixed(1)}ms, ida e volta máxima ${maxRtt.toFixed(1)}ms, ajuste local ${adjustment === undefined ? "-" : adjustment.toFixed(1) + "ms"}, correção acumulada ${this.clockOffset.toFixed(1)}ms`);
+    }
+    
+    handleClockStats(data) {
+        const receivedClock = data.clock || 0;
+        this.updateClock(receivedClock);
+        
+        return {
+            service: "clock_stats",
+            data: {
+                offset: this.clockOffset,
+                interval: this.clockSyncInterval / 1000,
+                coordinator: this.coordinator,
+                last: this.clockStats,
+                timestamp: Date.now(),
+                clock: this.incrementClock()
+            }
+        };
     }
     
     async startElection() {
@@ -1310,7 +1823,7 @@ class Server {
                     try {
                         // tentar conectar ao servidor via broker
                         const tempReqSocket = new zmq.Request();
-                        tempReqSocket.connect("tcp://broker:5555");
+                        tempReqSocket.connect(`tcp://${BROKER_HOST}:5555`);
                         
                         const electionRequest = {
                             service: "election",
@@ -1388,7 +1901,7 @@ class Server {
         };
         
         console.log(`[AUDITORIA RELÓGIO] Anunciando coordenador via Pub/Sub no tópico 'servers': ${JSON.stringify(message)}`);
-        await this.pubSocket.send(["servers", msgpack.encode(message)]);
+        await this.internalPubSocket.send(["servers", msgpack.encode(message)]);
         console.log(`[AUDITORIA RELÓGIO] Anúncio de coordenador enviado com sucesso`);
     }
     
@@ -1432,7 +1945,7 @@ class Server {
         // atualizar relógio lógico
         this.updateClock(receivedClock);
         
-        const currentTime = Date.now();
+        const currentTime = this.physicalTime();
         const currentTimestamp = Math.floor(currentTime / 1000);
         const responseClock = this.incrementClock();
         
@@ -1478,10 +1991,13 @@ class Server {
     async run() {
         console.log("Servidor iniciando...");
         
+        let lastEnvelope = null;
         while (true) {
             try {
                 // Receber mensagem
-                const message = await this.repSocket.receive();
+                lastEnvelope = null;
+                const { envelope, message } = await this.receiveRequest();
+                lastEnvelope = envelope;
                 let data;
                 
                 try {
@@ -1514,7 +2030,7 @@ class Server {
                                 description: "Formato de mensagem inválido"
                             }
                         };
-                        await this.repSocket.send(msgpack.encode(response));
+                        await this.sendReply(envelope, msgpack.encode(response));
                         continue;
                     }
                 }
@@ -1531,7 +2047,7 @@ class Server {
                             description: "Mensagem inválida recebida"
                         }
                     };
-                    await this.repSocket.send(msgpack.encode(response));
+                    await this.sendReply(envelope, msgpack.encode(response));
                     continue;
                 }
                 
@@ -1550,12 +2066,16 @@ class Server {
                             description: "Campo 'service' não encontrado na mensagem"
                         }
                     };
-                    await this.repSocket.send(msgpack.encode(response));
+                    await this.sendReply(envelope, msgpack.encode(response));
                     continue;
                 }
                 
                 console.log(`Processando serviço: ${service}`);
                 
+                // requisição rastreada (amostrada pelo cliente): medir o tempo gasto aqui
+                const trace = data.trace && typeof data.trace === 'object' ? data.trace : null;
+                const started = trace ? process.hrtime.bigint() : null;
+                
                 // Processar serviço
                 let response;
                 switch (service) {
@@ -1572,10 +2092,16 @@ class Server {
                         response = this.handleChannels(serviceData);
                         break;
                     case "publish":
-                        response = await this.handlePublish(serviceData);
+                        response = await this.handlePublish(serviceData, trace);
                         break;
                     case "message":
-                        response = await this.handleMessage(serviceData);
+                        response = await this.handleMessage(serviceData, trace);
+                        break;
+                    case "history":
+                        response = await this.handleHistory(serviceData);
+                        break;
+                    case "clock_stats":
+                        response = this.handleClockStats(serviceData);
                         break;
                     case "clock":
                         // verificar se é requisição de sincronização de outro servidor
@@ -1618,10 +2144,18 @@ class Server {
                         };
                 }
                 
+                if (trace) {
+                    response.trace = {
+                        id: trace.id,
+                        sent: trace.sent,
+                        server_us: Number((process.hrtime.bigint() - started) / 1000n)
+                    };
+                }
+                
                 // Enviar resposta usando MessagePack
-                await this.repSocket.send(msgpack.encode(response));
+                await this.sendReply(envelope, msgpack.encode(response));
                 console.log(`Enviado: ${JSON.stringify(response)}`);
-                
+            
             } catch (error) {
                 console.error(`Erro: ${error}`);
                 const errorResponse = {
@@ -1633,7 +2167,7 @@ class Server {
                         description: error.message
                     }
                 };
-                await this.repSocket.send(msgpack.encode(errorResponse));
+                await this.sendReply(lastEnvelope, msgpack.encode(errorResponse));
             }
         }
     }
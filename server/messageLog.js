@@ -0,0 +1,526 @@
+const fs = require('fs');
+const path = require('path');
+const msgpack = require('msgpack-lite');
+
+// tamanho máximo de cada segmento antes de abrir o próximo
+const SEGMENT_BYTES = parseInt(process.env.SERVER_LOG_SEGMENT_BYTES || String(16 * 1024 * 1024));
+// uma entrada no índice esparso a cada N registros
+const INDEX_INTERVAL = parseInt(process.env.SERVER_LOG_INDEX_INTERVAL || "64");
+// janela do group commit: registros acumulados nesse intervalo vão num único write + fdatasync
+const SYNC_INTERVAL_MS = parseInt(process.env.SERVER_LOG_SYNC_MS || "20");
+// registros em segmentos fechados (fora do snapshot) até compactar num novo snapshot
+const SNAPSHOT_EVERY = parseInt(process.env.SERVER_LOG_SNAPSHOT_EVERY || "10000");
+// bloco de leitura usado na inicialização e nas leituras do histórico
+const READ_CHUNK = 1024 * 1024;
+// cabeçalho de cada registro: tamanho do payload e crc32 (little endian)
+const HEADER_BYTES = 8;
+// formato do snapshot: registros 0..offset-1 do log, copiados dos segmentos (os antigos
+// guardavam o estado em memória e não têm versão)
+const SNAPSHOT_VERSION = 2;
+
+const CRC_TABLE = (() => {
+    const table = new Int32Array(256);
+    for (let n = 0; n < 256; n++) {
+        let c = n;
+        for (let k = 0; k < 8; k++) {
+            c = c & 1 ? 0xEDB88320 ^ (c >>> 1) : c >>> 1;
+        }
+        table[n] = c;
+    }
+    return table;
+})();
+
+function crc32(buffer) {
+    let crc = -1;
+    for (let i = 0; i < buffer.length; i++) {
+        crc = CRC_TABLE[(crc ^ buffer[i]) & 0xFF] ^ (crc >>> 8);
+    }
+    return (crc ^ -1) >>> 0;
+}
+
+function encodeRecord(record) {
+    // [tamanho][crc32][payload msgpack]
+    const payload = msgpack.encode(record);
+    const buffer = Buffer.allocUnsafe(HEADER_BYTES + payload.length);
+    buffer.writeUInt32LE(payload.length, 0);
+    buffer.writeUInt32LE(crc32(payload), 4);
+    payload.copy(buffer, HEADER_BYTES);
+    return buffer;
+}
+
+function segmentName(base) {
+    return `segment-${String(base).padStart(20, '0')}.log`;
+}
+
+function snapshotName(offset) {
+    return `snapshot-${String(offset).padStart(20, '0')}.log`;
+}
+
+function indexPath(segmentPath) {
+    return segmentPath.replace(/\.log$/, '.index');
+}
+
+function removeFile(filePath) {
+    // apaga se existir
+    try {
+        fs.unlinkSync(filePath);
+    } catch (error) {
+        if (error.code !== 'ENOENT') {
+            throw error;
+        }
+    }
+}
+
+async function copyRange(target, sourcePath, start, end) {
+    // copia os bytes [start, end) de um arquivo pro fim de target, em blocos e sem decodificar
+    const source = await fs.promises.open(sourcePath, 'r');
+    const chunk = Buffer.allocUnsafe(READ_CHUNK);
+    try {
+        for (let position = start; position < end;) {
+            const { bytesRead } = await source.read(chunk, 0, Math.min(chunk.length, end - position), position);
+            if (bytesRead === 0) {
+                throw new Error(`${sourcePath} terminou antes do esperado`);
+            }
+            await target.write(chunk, 0, bytesRead);
+            position += bytesRead;
+        }
+    } finally {
+        await source.close();
+    }
+}
+
+function scanFile(filePath, startPosition, onRecord) {
+    // Lê o arquivo em blocos (sem carregar tudo na memória) e chama onRecord(payload, posição)
+    // até o fim ou até onRecord devolver false; retorna a posição logo após o último registro lido
+    const fd = fs.openSync(filePath, 'r');
+    let chunk = Buffer.allocUnsafe(READ_CHUNK);
+    let chunkStart = startPosition; // posição no arquivo do byte chunk[0]
+    let length = 0;                 // bytes válidos em chunk
+    let consumed = 0;               // bytes de chunk já processados
+    let position = startPosition;
+    
+    try {
+        while (true) {
+            // Garantir o cabeçalho e o payload inteiros no bloco, lendo mais se preciso
+            let needed = HEADER_BYTES;
+            if (length - consumed >= HEADER_BYTES) {
+                needed += chunk.readUInt32LE(consumed);
+            }
+            if (length - consumed < needed) {
+                const rest = length - consumed;
+                if (needed > chunk.length) {
+                    const bigger = Buffer.allocUnsafe(needed);
+                    chunk.copy(bigger, 0, consumed, length);
+                    chunk = bigger;
+                } else {
+                    chunk.copy(chunk, 0, consumed, length);
+                }
+                chunkStart += consumed;
+                consumed = 0;
+                length = rest;
+                const read = fs.readSync(fd, chunk, length, chunk.length - length, chunkStart + length);
+                length += read;
+                if (read === 0) {
+                    // fim do arquivo (um registro incompleto no fim é descartado)
+                    return position;
+                }
+                continue;
+            }
+            
+            const size = chunk.readUInt32LE(consumed);
+            const checksum = chunk.readUInt32LE(consumed + 4);
+            const payload = chunk.subarray(consumed + HEADER_BYTES, consumed + HEADER_BYTES + size);
+            if (crc32(payload) !== checksum) {
+                return position;
+            }
+            const keepGoing = onRecord(payload, position);
+            consumed += HEADER_BYTES + size;
+            position = chunkStart + consumed;
+            if (keepGoing === false) {
+                return position;
+            }
+        }
+    } finally {
+        fs.closeSync(fd);
+    }
+}
+
+class MessageLog {
+    // Log append-only de mensagens em segmentos rotativos, com índice esparso por segmento e
+    // group commit dos fsyncs. Os segmentos fechados são compactados de tempos em tempos num
+    // snapshot (cópia dos registros já codificados, fora do event loop) e apagados, então a
+    // inicialização lê o snapshot e os segmentos posteriores a ele
+    constructor(directory, options = {}) {
+        this.directory = directory;
+        this.segmentBytes = options.segmentBytes || SEGMENT_BYTES;
+        this.indexInterval = options.indexInterval || INDEX_INTERVAL;
+        this.syncInterval = options.syncInterval !== undefined ? options.syncInterval : SYNC_INTERVAL_MS;
+        this.snapshotEvery = options.snapshotEvery || SNAPSHOT_EVERY;
+        
+        // [{ base, path, size, count, index: [[offset, posição]] }] em ordem de base; o snapshot,
+        // se houver, é o primeiro (base 0, com snapshot: true e headerSize bytes de cabeçalho)
+        this.segments = [];
+        this.nextOffset = 0;
+        this.fd = null;
+        this.snapshotting = false;
+        this.compacting = Promise.resolve();
+        
+        // group commit
+        this.pending = [];    // registros codificados aguardando o próximo commit
+        this.pendingBytes = 0;
+        this.waiters = [];    // promessas resolvidas quando o commit que as contém terminar
+        this.timer = null;
+        this.flushing = Promise.resolve();
+        
+        fs.mkdirSync(directory, { recursive: true });
+    }
+    
+    load(onRecord) {
+        // Carrega o snapshot mais recente e reaplica os registros dos segmentos posteriores a ele
+        // Retorna { snapshot: registros do snapshot, tail: registros reaplicados do log }
+        const names = fs.readdirSync(this.directory);
+        // compactação interrompida antes do rename
+        names.filter(name => name.endsWith('.tmp')).forEach(name => removeFile(path.join(this.directory, name)));
+        
+        const snapshot = this.loadSnapshot(onRecord);
+        const covered = snapshot ? snapshot.count : 0;
+        if (snapshot) {
+            this.segments.push(snapshot);
+        }
+        let tail = 0;
+        
+        const files = [];
+        for (const name of names.filter(name => /^segment-\d{20}\.log$/.test(name)).sort()) {
+            const segmentPath = path.join(this.directory, name);
+            if (parseInt(name.slice(8, 28)) < covered) {
+                // já copiado pro snapshot (a compactação caiu antes de apagar o segmento)
+                removeFile(segmentPath);
+                removeFile(indexPath(segmentPath));
+            } else {
+                files.push(name);
+            }
+        }
+        
+        files.forEach((name, position) => {
+            const segment = {
+                base: parseInt(name.slice(8, 28)),
+                path: path.join(this.directory, name),
+                size: 0,
+                count: 0,
+                index: []
+            };
+            const end = scanFile(segment.path, 0, (payload, recordPosition) => {
+                if (segment.count % this.indexInterval === 0) {
+                    segment.index.push([segment.base + segment.count, recordPosition]);
+                }
+                segment.count++;
+                onRecord(msgpack.decode(payload));
+                tail++;
+            });
+            segment.size = end;
+            
+            if (end < fs.statSync(segment.path).size) {
+                // registro incompleto (queda no meio da escrita): descartar a cauda
+                console.log(`[PERSISTENCIA] Descartando ${fs.statSync(segment.path).size - end} bytes incompletos no fim de ${name}`);
+                fs.truncateSync(segment.path, end);
+            }
+            if (position < files.length - 1) {
+                this.saveIndex(segment);
+            }
+            this.segments.push(segment);
+        });
+        
+        const current = this.segments.length > 0 && !this.segments[this.segments.length - 1].snapshot
+            ? this.segments[this.segments.length - 1]
+            : null;
+        this.nextOffset = current ? current.base + current.count : covered;
+        if (!current || current.size >= this.segmentBytes) {
+            this.openSegment(this.nextOffset);
+        } else {
+            this.fd = fs.openSync(current.path, 'a');
+        }
+        this.maybeCompact();
+        
+        return { snapshot: covered, tail: tail };
+    }
+    
+    loadSnapshot(onRecord) {
+        // snapshot-<offset>.log: cabeçalho { version, offset, count } seguido dos registros 0..offset-1
+        const files = fs.readdirSync(this.directory).filter(name => /^snapshot-\d{20}\.log$/.test(name)).sort();
+        if (files.length === 0) {
+            return null;
+        }
+        // os anteriores sobraram de uma compactação interrompida antes de apagá-los
+        files.slice(0, -1).forEach(name => removeFile(path.join(this.directory, name)));
+        
+        const name = files[files.length - 1];
+        const snapshot = { base: 0, path: path.join(this.directory, name), size: 0, count: 0, index: [], snapshot: true, headerSize: 0 };
+        let header = null;
+        snapshot.size = scanFile(snapshot.path, 0, (payload, position) => {
+            if (header === null) {
+                header = msgpack.decode(payload);
+                snapshot.headerSize = HEADER_BYTES + payload.length;
+                // formato antigo (estado em memória, sem versão): os segmentos nunca eram apagados
+                return header.version === SNAPSHOT_VERSION;
+            }
+            if (snapshot.count % this.indexInterval === 0) {
+                snapshot.index.push([snapshot.count, position]);
+            }
+            onRecord(msgpack.decode(payload));
+            snapshot.count++;
+        });
+        if (header !== null && header.version !== SNAPSHOT_VERSION) {
+            console.log(`[PERSISTENCIA] Snapshot ${name} no formato antigo ignorado: as mensagens são relidas dos segmentos`);
+            removeFile(snapshot.path);
+            return null;
+        }
+        if (header === null || snapshot.count !== header.count) {
+            // snapshot é gravado em arquivo temporário e renomeado, então isso não deveria acontecer
+            throw new Error(`Snapshot ${name} incompleto (${snapshot.count} de ${header ? header.count : '?'} registros)`);
+        }
+        return snapshot;
+    }
+    
+    loadIndex(segment) {
+        // índice salvo quando o segmento foi fechado: { count, size, index }
+        try {
+            const saved = msgpack.decode(fs.readFileSync(indexPath(segment.path)));
+            if (saved.size !== fs.statSync(segment.path).size) {
+                return false;
+            }
+            segment.count = saved.count;
+            segment.size = saved.size;
+            segment.index = saved.index;
+            return true;
+        } catch (error) {
+            return false;
+        }
+    }
+    
+    saveIndex(segment) {
+        fs.writeFileSync(indexPath(segment.path), msgpack.encode({ count: segment.count, size: segment.size, index: segment.index }));
+    }
+    
+    openSegment(base) {
+        const segment = { base: base, path: path.join(this.directory, segmentName(base)), size: 0, count: 0, index: [] };
+        this.fd = fs.openSync(segment.path, 'a');
+        this.segments.push(segment);
+        return segment;
+    }
+    
+    append(record) {
+        // Registra no índice e enfileira pro próximo commit; a promessa resolve depois do fdatasync
+        const buffer = encodeRecord(record);
+        let segment = this.segments[this.segments.length - 1];
+        
+        if (segment.size > 0 && segment.size + buffer.length > this.segmentBytes) {
+            // fechar o segmento atual depois que o que já está pendente for gravado nele
+            const sealed = segment;
+            const fd = this.fd;
+            this.commit();
+            this.flushing = this.flushing.then(() => {
+                fs.closeSync(fd);
+                this.saveIndex(sealed);
+            });
+            segment = this.openSegment(this.nextOffset);
+            this.maybeCompact();
+        }
+        
+        const offset = this.nextOffset++;
+        if (segment.count % this.indexInterval === 0) {
+            segment.index.push([offset, segment.size]);
+        }
+        segment.count++;
+        segment.size += buffer.length;
+        
+        this.pending.push(buffer);
+        this.pendingBytes += buffer.length;
+        const durable = new Promise((resolve, reject) => this.waiters.push({ resolve, reject }));
+        if (this.timer === null) {
+            this.timer = setTimeout(() => this.commit(), this.syncInterval);
+        }
+        return durable;
+    }
+    
+    commit() {
+        // Grava tudo que estiver pendente com um único write + fdatasync (fora do event loop)
+        if (this.timer !== null) {
+            clearTimeout(this.timer);
+            this.timer = null;
+        }
+        if (this.pending.length === 0) {
+            return this.flushing;
+        }
+        
+        const buffer = Buffer.concat(this.pending, this.pendingBytes);
+        const waiters = this.waiters;
+        const fd = this.fd;
+        this.pending = [];
+        this.pendingBytes = 0;
+        this.waiters = [];
+        
+        // commits em sequência: a ordem no arquivo é a ordem dos offsets
+        this.flushing = this.flushing.then(async () => {
+            try {
+                await writeAll(fd, buffer);
+                await new Promise((resolve, reject) => fs.fdatasync(fd, error => error ? reject(error) : resolve()));
+                waiters.forEach(waiter => waiter.resolve());
+            } catch (error) {
+                console.error(`[PERSISTENCIA] Erro ao gravar log de mensagens: ${error.message}`);
+                waiters.forEach(waiter => waiter.reject(error));
+            }
+        });
+        return this.flushing;
+    }
+    
+    maybeCompact() {
+        // compacta quando os segmentos fechados fora do snapshot somam snapshotEvery registros e
+        // pelo menos o tamanho do snapshot: ele dobra a cada compactação, então cada registro é
+        // copiado um número constante de vezes (amortizado), em vez de o histórico inteiro a cada snapshotEvery
+        const first = this.segments[0];
+        const covered = first && first.snapshot ? first.count : 0;
+        const open = this.segments[this.segments.length - 1];
+        if (!this.snapshotting && open.base - covered >= Math.max(this.snapshotEvery, covered)) {
+            this.compact();
+        }
+    }
+    
+    compact() {
+        // Novo snapshot = snapshot anterior + segmentos fechados, copiando os registros já codificados;
+        // não depende do estado em memória e as cópias são assíncronas (só o índice é montado aqui)
+        const previous = this.segments[0].snapshot ? this.segments[0] : null;
+        const covered = this.segments.slice(previous ? 1 : 0, -1);
+        if (covered.length === 0) {
+            return this.compacting;
+        }
+        this.snapshotting = true;
+        // o fechamento do último segmento (gravação + índice) está no fim da fila de commits
+        const sealed = this.flushing;
+        this.compacting = this.writeSnapshot(previous, covered, sealed).finally(() => {
+            this.snapshotting = false;
+        });
+        return this.compacting;
+    }
+    
+    async writeSnapshot(previous, covered, sealed) {
+        const last = covered[covered.length - 1];
+        const offset = last.base + last.count;
+        const target = path.join(this.directory, snapshotName(offset));
+        const temporary = `${target}.tmp`;
+        
+        try {
+            await sealed;
+            const header = encodeRecord({ version: SNAPSHOT_VERSION, offset: offset, count: offset });
+            const index = [];
+            let size = header.length;
+            const handle = await fs.promises.open(temporary, 'w');
+            try {
+                await handle.write(header);
+                if (previous) {
+                    previous.index.forEach(([indexed, position]) => index.push([indexed, position - previous.headerSize + size]));
+                    await copyRange(handle, previous.path, previous.headerSize, previous.size);
+                    size += previous.size - previous.headerSize;
+                }
+                for (const segment of covered) {
+                    segment.index.forEach(([indexed, position]) => index.push([indexed, position + size]));
+                    await copyRange(handle, segment.path, 0, segment.size);
+                    size += segment.size;
+                }
+                await handle.sync();
+            } finally {
+                await handle.close();
+            }
+            await fs.promises.rename(temporary, target);
+            
+            // daqui em diante o snapshot substitui o anterior e os segmentos cobertos (inclusive nas leituras)
+            const snapshot = { base: 0, path: target, size: size, count: offset, index: index, snapshot: true, headerSize: header.length };
+            this.segments.splice(0, covered.length + (previous ? 1 : 0), snapshot);
+            const obsolete = covered.flatMap(segment => [segment.path, indexPath(segment.path)]);
+            if (previous) {
+                obsolete.push(previous.path);
+            }
+            await Promise.all(obsolete.map(file => fs.promises.unlink(file).catch(() => {})));
+            console.log(`[PERSISTENCIA] Snapshot de ${offset} mensagens gravado, ${covered.length} segmento(s) apagado(s)`);
+        } catch (error) {
+            console.error(`[PERSISTENCIA] Erro ao gravar snapshot: ${error.message}`);
+            await fs.promises.unlink(temporary).catch(() => {});
+        }
+    }
+    
+    read(fromOffset, limit) {
+        // Lê até limit registros a partir de fromOffset usando o índice esparso pra achar a posição
+        const records = [];
+        if (fromOffset >= this.nextOffset) {
+            return records;
+        }
+        
+        // busca binária do segmento que contém fromOffset
+        let low = 0;
+        let high = this.segments.length - 1;
+        while (low < high) {
+            const middle = (low + high + 1) >> 1;
+            if (this.segments[middle].base <= fromOffset) {
+                low = middle;
+            } else {
+                high = middle - 1;
+            }
+        }
+        
+        for (let s = low; s < this.segments.length && records.length < limit; s++) {
+            const segment = this.segments[s];
+            let start = segment.snapshot ? segment.headerSize : 0;
+            let offset = segment.base;
+            // última entrada do índice antes de fromOffset
+            for (const [indexedOffset, position] of segment.index) {
+                if (indexedOffset > fromOffset) {
+                    break;
+                }
+                offset = indexedOffset;
+                start = position;
+            }
+            
+            try {
+                // registros ainda no group commit não estão no arquivo: a leitura para no que já foi gravado
+                scanFile(segment.path, start, payload => {
+                    if (offset >= fromOffset) {
+                        records.push(msgpack.decode(payload));
+                    }
+                    offset++;
+                    return records.length < limit;
+                });
+            } catch (error) {
+                console.error(`[PERSISTENCIA] Erro ao ler ${segment.path}: ${error.message}`);
+            }
+        }
+        return records;
+    }
+    
+    close() {
+        // Grava o que estiver pendente, espera a compactação em andamento e fecha o segmento atual
+        return this.commit().then(() => this.compacting).then(() => {
+            if (this.fd !== null) {
+                fs.closeSync(this.fd);
+                this.fd = null;
+            }
+        });
+    }
+}
+
+function writeAll(fd, buffer) {
+    return new Promise((resolve, reject) => {
+        const write = (offset) => {
+            fs.write(fd, buffer, offset, buffer.length - offset, null, (error, written) => {
+                if (error) {
+                    reject(error);
+                } else if (offset + written < buffer.length) {
+                    write(offset + written);
+                } else {
+                    resolve();
+                }
+            });
+        };
+        write(0);
+    });
+}
+
+module.exports = { MessageLog, crc32 };
@@ -0,0 +1,103 @@
+const zmq = require('zeromq');
+const msgpack = require('msgpack-lite');
+
+// Sockets persistentes pros outros servidores (um DEALER por endereço), com várias
+// requisições em voo no mesmo socket identificadas por um id de correlação
+
+class PeerConnection {
+    constructor(address) {
+        this.address = address;
+        this.socket = new zmq.Dealer({ linger: 0 });
+        this.socket.connect(address);
+        this.nextId = 0;
+        this.pending = new Map(); // id -> { resolve, reject, timer }
+        // zeromq.js não aceita dois send() simultâneos no mesmo socket
+        this.sendChain = Promise.resolve();
+        this.closed = false;
+        this.receiveLoop();
+    }
+    
+    async receiveLoop() {
+        // o ROUTER do outro lado devolve o envelope: [id, vazio, resposta]
+        while (!this.closed) {
+            try {
+                const frames = await this.socket.receive();
+                const id = frames[0].length === 4 ? frames[0].readUInt32BE(0) : -1;
+                const request = this.pending.get(id);
+                if (request === undefined) {
+                    continue; // resposta atrasada de uma requisição que já deu timeout
+                }
+                this.pending.delete(id);
+                clearTimeout(request.timer);
+                request.resolve(msgpack.decode(frames[frames.length - 1]));
+            } catch (error) {
+                if (this.closed) {
+                    return;
+                }
+                console.error(`[PEERS] Erro ao receber de ${this.address}: ${error.message}`);
+                await new Promise(resolve => setTimeout(resolve, 100));
+            }
+        }
+    }
+    
+    request(message, timeout) {
+        const id = this.nextId;
+        this.nextId = (this.nextId + 1) >>> 0;
+        const correlation = Buffer.alloc(4);
+        correlation.writeUInt32BE(id, 0);
+        
+        return new Promise((resolve, reject) => {
+            const timer = setTimeout(() => {
+                this.pending.delete(id);
+                reject(new Error(`Timeout na requisição ${message.service} para ${this.address}`));
+            }, timeout);
+            this.pending.set(id, { resolve, reject, timer });
+            this.sendChain = this.sendChain
+                .then(() => this.socket.send([correlation, Buffer.alloc(0), msgpack.encode(message)]))
+                .catch(error => {
+                    this.pending.delete(id);
+                    clearTimeout(timer);
+                    reject(error);
+                });
+        });
+    }
+    
+    close() {
+        this.closed = true;
+        for (const request of this.pending.values()) {
+            clearTimeout(request.timer);
+            request.reject(new Error(`Conexão com ${this.address} fechada`));
+        }
+        this.pending.clear();
+        this.socket.close();
+    }
+}
+
+class PeerPool {
+    constructor() {
+        this.connections = new Map(); // endereço -> PeerConnection
+    }
+    
+    request(address, message, timeout) {
+        // requisição a outro servidor reaproveitando a conexão com o endereço
+        let connection = this.connections.get(address);
+        if (connection === undefined) {
+            connection = new PeerConnection(address);
+            this.connections.set(address, connection);
+        }
+        return connection.request(message, timeout);
+    }
+    
+    retain(addresses) {
+        // fecha conexões com servidores que saíram da lista
+        const alive = new Set(addresses);
+        for (const [address, connection] of this.connections) {
+            if (!alive.has(address)) {
+                connection.close();
+                this.connections.delete(address);
+            }
+        }
+    }
+}
+
+module.exports = { PeerPool };
@@ -0,0 +1,75 @@
+const fs = require('fs');
+
+// Teto das sequências que este servidor já pode ter emitido (stampRecord), por entrada do
+// vetor de versões. O log grava em group commit: se o servidor cair antes do fsync, o fim do
+// log se perde, mas as outras réplicas podem já ter aplicado aqueles seqs. Refeita só do disco,
+// a numeração repetiria os mesmos seqs e as réplicas descartariam os registros novos como
+// duplicados. O teto vai pro disco (com fsync) antes de qualquer seq acima dele ser usado, e
+// depois de reiniciar a numeração continua acima dele. A reserva é em blocos de SEQ_LEASE,
+// então o fsync síncrono sai uma vez por bloco e não a cada registro
+const SEQ_LEASE = parseInt(process.env.SERVER_SEQ_LEASE || "1000");
+
+class SeqMarks {
+    constructor(filePath, lease = SEQ_LEASE) {
+        this.filePath = filePath;
+        this.lease = Math.max(1, lease);
+        this.marks = new Map(); // entrada do vetor -> maior seq reservado
+        this.floors = new Map(); // tetos lidos na inicialização: seqs até eles podem ter saído antes
+    }
+    
+    load() {
+        try {
+            const data = JSON.parse(fs.readFileSync(this.filePath, 'utf8'));
+            for (const [key, mark] of Object.entries(data)) {
+                this.marks.set(key, mark);
+                this.floors.set(key, mark);
+            }
+        } catch (error) {
+            if (error.code !== 'ENOENT') {
+                console.error(`[PERSISTENCIA] Erro ao ler ${this.filePath}: ${error.message}`);
+            }
+        }
+        return this;
+    }
+    
+    next(state, key) {
+        // próximo seq de key: o esperado pelo vetor de state ou, se o fim do log se perdeu na
+        // queda, o primeiro acima de tudo que pode ter saído (o vetor pula a lacuna)
+        let seq = state.expectedSeq(key);
+        const floor = this.floor(key);
+        if (seq <= floor) {
+            state.advanceVersion(key, floor);
+            seq = floor + 1;
+        }
+        this.reserve(key, seq);
+        return seq;
+    }
+    
+    floor(key) {
+        // maior seq que pode ter sido emitido antes de reiniciar (0 = nenhum)
+        return this.floors.get(key) || 0;
+    }
+    
+    reserve(key, seq) {
+        // garante no disco um teto >= seq antes de o seq ser usado
+        if (seq <= (this.marks.get(key) || 0)) {
+            return;
+        }
+        this.marks.set(key, seq + this.lease - 1);
+        this.save();
+    }
+    
+    save() {
+        const temporary = `${this.filePath}.tmp`;
+        const fd = fs.openSync(temporary, 'w');
+        try {
+            fs.writeSync(fd, JSON.stringify(Object.fromEntries(this.marks)));
+            fs.fsyncSync(fd);
+        } finally {
+            fs.closeSync(fd);
+        }
+        fs.renameSync(temporary, this.filePath);
+    }
+}
+
+module.exports = { SeqMarks, SEQ_LEASE };
@@ -0,0 +1,52 @@
+// paridade do frame com common/frame.py: os frames de referência de tests/fixtures/frames.json
+// (gerados pelo lado Python) precisam sair byte a byte do encodeFrame e ser lidos de volta aqui
+//
+// uso: cd server && npm test
+const test = require('node:test');
+const assert = require('node:assert');
+const fs = require('fs');
+const path = require('path');
+const msgpack = require('msgpack-lite');
+const { encodeFrame, frameType, frameSeq, frameBody, FRAME_PUBLISH, FRAME_MESSAGE } = require('../frame');
+const { hash32 } = require('../hashRing');
+
+const fixture = JSON.parse(fs.readFileSync(path.join(__dirname, '..', '..', 'tests', 'fixtures', 'frames.json'), 'utf8'));
+
+for (const frame of fixture.frames) {
+    test(`${frame.name}: encodeFrame igual ao frame de referência`, () => {
+        const encoded = encodeFrame(frame.type, frame.topic, frame.clock, frame.seq, frame.data, frame.trace);
+        assert.strictEqual(encoded.toString('hex'), frame.hex);
+    });
+
+    test(`${frame.name}: cabeçalho e corpo lidos do frame de referência`, () => {
+        const buffer = Buffer.from(frame.hex, 'hex');
+        const length = buffer.readUInt32BE(20);
+        assert.strictEqual(buffer.readUInt8(0), 0xC1);
+        assert.strictEqual(frameType(buffer), frame.type);
+        assert.strictEqual(buffer.readUInt8(2), frame.trace ? 1 : 0);
+        assert.strictEqual(buffer.readUInt32BE(4), hash32(frame.topic));
+        assert.strictEqual(buffer.readBigUInt64BE(8), BigInt(frame.clock));
+        assert.strictEqual(frameSeq(buffer), frame.seq);
+        assert.deepStrictEqual(frameBody(buffer), frame.data);
+        if (frame.trace) {
+            assert.deepStrictEqual(msgpack.decode(buffer.subarray(24 + length)), frame.trace);
+        } else {
+            assert.strictEqual(buffer.length, 24 + length);
+        }
+    });
+}
+
+test('os tipos batem com common/frame.py', () => {
+    assert.deepStrictEqual([FRAME_PUBLISH, FRAME_MESSAGE], [1, 2]);
+});
+
+test('tópicos diferentes com o mesmo id de canal', () => {
+    // o id é só um filtro: quem casa por ele confere o canal no corpo
+    const [ours, theirs] = fixture.collision;
+    assert.notStrictEqual(ours, theirs);
+    assert.strictEqual(hash32(ours), hash32(theirs));
+    const colliding = fixture.frames.find(frame => frame.topic === theirs);
+    const buffer = Buffer.from(colliding.hex, 'hex');
+    assert.strictEqual(buffer.readUInt32BE(4), hash32(ours));
+    assert.notStrictEqual(`#${frameBody(buffer).channel}`, ours);
+});
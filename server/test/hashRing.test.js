@@ -0,0 +1,33 @@
+// paridade do anel com common/ring.py: os dois leem o mesmo fixture (tests/fixtures/ring.json,
+// gerado pelo lado Python) e precisam chegar às mesmas partições e donos
+//
+// uso: cd server && npm test
+const test = require('node:test');
+const assert = require('node:assert');
+const fs = require('fs');
+const path = require('path');
+const { HashRing, streamFor, partitionOf, hash32 } = require('../hashRing');
+
+const fixture = JSON.parse(fs.readFileSync(path.join(__dirname, '..', '..', 'tests', 'fixtures', 'ring.json'), 'utf8'));
+
+test('hash32 igual ao do Python', () => {
+    for (const [text, expected] of Object.entries(fixture.hash32)) {
+        assert.strictEqual(hash32(text), expected, text);
+    }
+});
+
+test('partições e donos iguais aos do Python', () => {
+    const ring = new HashRing(fixture.names);
+    for (const { key, partition, owners } of fixture.keys) {
+        assert.strictEqual(partitionOf(key), partition, key);
+        for (const [replicas, expected] of Object.entries(owners)) {
+            assert.deepStrictEqual(ring.ownersOf(streamFor(key, Number(replicas))), expected, `${key} com ${replicas} réplicas`);
+        }
+    }
+});
+
+test('a ordem da lista de servidores não muda o anel', () => {
+    const ring = new HashRing([...fixture.names].reverse());
+    const { key, owners } = fixture.keys[0];
+    assert.deepStrictEqual(ring.ownersOf(streamFor(key, 2)), owners["2"]);
+});
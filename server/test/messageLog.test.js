@@ -0,0 +1,109 @@
+// testes do log de mensagens: reinício depois da compactação em snapshot
+//
+// uso: cd server && npm test
+const test = require('node:test');
+const assert = require('node:assert');
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const msgpack = require('msgpack-lite');
+const { MessageLog, crc32 } = require('../messageLog');
+
+const directories = [];
+
+function temporaryDirectory() {
+    const directory = fs.mkdtempSync(path.join(os.tmpdir(), 'messagelog-'));
+    directories.push(directory);
+    return directory;
+}
+
+test.after(() => directories.forEach(directory => fs.rmSync(directory, { recursive: true, force: true })));
+
+function message(index) {
+    return { type: "publish", user: "u", channel: `canal_${index % 3}`, message: `mensagem ${index}`, timestamp: index, clock: index };
+}
+
+function reopen(directory, options) {
+    const log = new MessageLog(directory, options);
+    const records = [];
+    const loaded = log.load(record => records.push(record));
+    return { log, records, loaded };
+}
+
+function writeLegacySnapshot(directory, offset) {
+    // só o cabeçalho { offset, count }, como o snapshot antigo gravava com o estado vazio
+    const payload = msgpack.encode({ offset: offset, count: 0 });
+    const buffer = Buffer.alloc(8 + payload.length);
+    buffer.writeUInt32LE(payload.length, 0);
+    buffer.writeUInt32LE(crc32(payload), 4);
+    payload.copy(buffer, 8);
+    fs.writeFileSync(path.join(directory, `snapshot-${String(offset).padStart(20, '0')}.log`), buffer);
+}
+
+const OPTIONS = { segmentBytes: 1024, snapshotEvery: 100, syncInterval: 0 };
+
+test('migração logo depois do load: o reinício devolve todas as mensagens', async () => {
+    // como o loadMessages migrando um messages.json: appends em sequência logo depois do
+    // load, antes de o estado ter qualquer mensagem
+    const directory = temporaryDirectory();
+    const first = reopen(directory, OPTIONS);
+    for (let index = 0; index < 150; index++) {
+        first.log.append(message(index));
+    }
+    await first.log.close();
+    
+    const second = reopen(directory, OPTIONS);
+    assert.deepStrictEqual(second.records.map(record => record.message), Array.from({ length: 150 }, (_, index) => `mensagem ${index}`));
+    assert.ok(second.loaded.snapshot >= 100, `snapshot com ${second.loaded.snapshot} registros`);
+    assert.strictEqual(second.loaded.snapshot + second.loaded.tail, 150);
+    await second.log.close();
+});
+
+test('compactação apaga os segmentos cobertos e mantém as leituras por offset', async () => {
+    const directory = temporaryDirectory();
+    const first = reopen(directory, OPTIONS);
+    for (let index = 0; index < 400; index++) {
+        first.log.append(message(index));
+    }
+    await first.log.close();
+    
+    const files = fs.readdirSync(directory);
+    const snapshots = files.filter(name => name.startsWith('snapshot-'));
+    assert.strictEqual(snapshots.length, 1);
+    const covered = parseInt(snapshots[0].slice(9, 29));
+    const segments = files.filter(name => /^segment-\d{20}\.log$/.test(name)).map(name => parseInt(name.slice(8, 28)));
+    assert.ok(segments.every(base => base >= covered), `segmentos ${segments} antes do snapshot ${covered}`);
+    
+    const second = reopen(directory, OPTIONS);
+    assert.strictEqual(second.records.length, 400);
+    assert.strictEqual(second.loaded.snapshot, covered);
+    assert.deepStrictEqual(second.log.read(0, 3).map(record => record.clock), [0, 1, 2]);
+    assert.deepStrictEqual(second.log.read(covered - 1, 2).map(record => record.clock), [covered - 1, covered]);
+    assert.deepStrictEqual(second.log.read(398, 10).map(record => record.clock), [398, 399]);
+    
+    // mais mensagens depois do reinício: o novo snapshot parte do anterior
+    for (let index = 400; index < 700; index++) {
+        second.log.append(message(index));
+    }
+    await second.log.close();
+    const third = reopen(directory, OPTIONS);
+    assert.deepStrictEqual(third.records.map(record => record.clock), Array.from({ length: 700 }, (_, index) => index));
+    assert.ok(third.loaded.snapshot > covered);
+    await third.log.close();
+});
+
+test('snapshot no formato antigo é ignorado e as mensagens vêm dos segmentos', async () => {
+    const directory = temporaryDirectory();
+    const first = reopen(directory, { syncInterval: 0 });
+    for (let index = 0; index < 150; index++) {
+        first.log.append(message(index));
+    }
+    await first.log.close();
+    // snapshot da versão anterior gravado antes de o estado ter mensagens (offset 100, 0 registros)
+    writeLegacySnapshot(directory, 100);
+    
+    const second = reopen(directory, { syncInterval: 0 });
+    assert.strictEqual(second.records.length, 150);
+    assert.strictEqual(second.loaded.snapshot, 0);
+    await second.log.close();
+});
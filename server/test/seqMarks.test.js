@@ -0,0 +1,102 @@
+// testes do teto das sequências: reinício depois de perder o fim do log
+//
+// uso: cd server && npm test
+const test = require('node:test');
+const assert = require('node:assert');
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const { MessageLog } = require('../messageLog');
+const { ChatState, versionKey } = require('../chatState');
+const { SeqMarks } = require('../seqMarks');
+
+const directories = [];
+
+test.after(() => directories.forEach(directory => fs.rmSync(directory, { recursive: true, force: true })));
+
+function temporaryDirectory() {
+    const directory = fs.mkdtempSync(path.join(os.tmpdir(), 'seqmarks-'));
+    directories.push(directory);
+    return directory;
+}
+
+const KEY = versionKey("server_a");
+
+function stamp(state, marks, index) {
+    // como o stampRecord do servidor: numera, registra no vetor e devolve a mensagem
+    const record = { type: "publish", user: "u", channel: "geral", message: `mensagem ${index}`, timestamp: index, clock: index, origin: "server_a" };
+    record.seq = marks === null ? state.expectedSeq(KEY) : marks.next(state, KEY);
+    state.trackRecord('message', record);
+    state.addMessage(record);
+    return record;
+}
+
+function dropTail(directory, count) {
+    // apaga os últimos `count` registros do segmento atual, como um group commit sem fsync na queda
+    const segment = fs.readdirSync(directory).filter(name => /^segment-\d{20}\.log$/.test(name)).sort().pop();
+    const file = path.join(directory, segment);
+    const buffer = fs.readFileSync(file);
+    const ends = [];
+    for (let position = 0; position < buffer.length; position += 8 + buffer.readUInt32LE(position)) {
+        ends.push(position + 8 + buffer.readUInt32LE(position));
+    }
+    fs.truncateSync(file, ends[ends.length - count - 1]);
+}
+
+function restart(directory, withMarks) {
+    // como o registerWithReference: log do disco, vetor refeito a partir dele e o teto lido
+    const state = new ChatState();
+    const log = new MessageLog(path.join(directory, 'messages'), { syncInterval: 0 });
+    const messages = [];
+    log.load(message => messages.push(message));
+    state.mergeMessages(messages);
+    for (const message of state.allMessages()) {
+        state.trackRecord('message', message);
+        state.advanceVersion(versionKey(message.origin, message.stream), message.seq);
+    }
+    const marks = withMarks ? new SeqMarks(path.join(directory, 'seqs.json'), 10).load() : null;
+    return { state, log, marks };
+}
+
+async function crashAfter(directory, count, lost, withMarks) {
+    // grava `count` mensagens (todas aplicadas por uma réplica) e perde as `lost` últimas do disco
+    const origin = restart(directory, withMarks);
+    const replica = new ChatState();
+    for (let index = 0; index < count; index++) {
+        const record = stamp(origin.state, origin.marks, index);
+        origin.log.append(record);
+        replica.trackRecord('message', record);
+    }
+    await origin.log.close();
+    dropTail(path.join(directory, 'messages'), lost);
+    return replica;
+}
+
+test('depois de perder o fim do log o seq continua acima do que as réplicas já aplicaram', async () => {
+    const directory = temporaryDirectory();
+    const replica = await crashAfter(directory, 30, 5, true);
+    assert.strictEqual(replica.expectedSeq(KEY), 31);
+
+    const restarted = restart(directory, true);
+    assert.strictEqual(restarted.state.expectedSeq(KEY), 26);
+    const record = stamp(restarted.state, restarted.marks, 30);
+    assert.ok(record.seq >= replica.expectedSeq(KEY), `seq ${record.seq} já aplicado pela réplica`);
+    // o vetor do próprio servidor pula a lacuna e segue contínuo
+    assert.strictEqual(restarted.state.expectedSeq(KEY), record.seq + 1);
+    assert.strictEqual(stamp(restarted.state, restarted.marks, 31).seq, record.seq + 1);
+    await restarted.log.close();
+
+    // o teto foi reservado antes do uso: um novo reinício continua acima dos dois
+    const again = restart(directory, true);
+    assert.ok(stamp(again.state, again.marks, 32).seq > record.seq + 1);
+    await again.log.close();
+});
+
+test('sem o teto o seq reemitido seria descartado como duplicado', async () => {
+    const directory = temporaryDirectory();
+    const replica = await crashAfter(directory, 30, 5, false);
+    const restarted = restart(directory, false);
+    const record = stamp(restarted.state, null, 30);
+    assert.ok(record.seq < replica.expectedSeq(KEY));
+    await restarted.log.close();
+});
@@ -0,0 +1,22 @@
+"""testes dos componentes Python: python -m pytest -q na raiz do repositório
+
+os componentes (broker, proxy, reference, bot) são todos main.py e importam common/ pelo
+caminho do repositório; load_component carrega cada um com um nome próprio.
+"""
+import importlib.util
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+@pytest.fixture
+def load_component():
+    """carrega <componente>/main.py como o módulo <componente>_main"""
+    def load(name):
+        spec = importlib.util.spec_from_file_location(f"{name}_main", os.path.join(ROOT, name, "main.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
@@ -0,0 +1,32 @@
+"""rajada numerada do bot demo: publicações em voo juntas, confirmações tratadas na ordem de envio"""
+import msgpack
+import pytest
+import zmq
+from common.flow import BUSY_STATUS
+
+@pytest.fixture
+def demo(load_component, monkeypatch):
+    module = load_component("bot")
+    monkeypatch.setattr(module, "BROKER_ENDPOINT", "inproc://bot-test")
+    bot = module.Bot()
+    broker = bot.context.socket(zmq.ROUTER)
+    broker.bind("inproc://bot-test")
+    yield bot, broker
+    broker.close(linger=0)
+    bot.client.close()
+    bot.sub_socket.close(linger=0)
+    bot.context.term()
+
+def test_burst_is_pipelined_and_acks_are_read_in_order(demo, capsys):
+    bot, broker = demo
+    burst = [(i, f"texto {i}") + bot.submit_publish("geral", f"texto {i} ({i+1}/10)") for i in range(3)]
+    # as três chegam ao broker antes de qualquer resposta
+    requests = [broker.recv_multipart() for _ in range(3)]
+    assert [msgpack.unpackb(frames[-1])["data"]["message"] for frames in requests] == [f"texto {i} ({i+1}/10)" for i in range(3)]
+    # respostas na ordem inversa: cada uma casa com a própria requisição pela correlação
+    statuses = ["OK", BUSY_STATUS, "OK"]
+    for frames, status in reversed(list(zip(requests, statuses))):
+        broker.send_multipart(frames[:-1] + [msgpack.packb({"service": "publish", "data": {"status": status, "clock": 5}})])
+    assert [bot.finish_publish("geral", *entry) for entry in burst] == [False, True, False]
+    lines = [line for line in capsys.readouterr().out.splitlines() if "/10" in line]
+    assert "mensagem 1/10" in lines[0] and "mensagem 2/10 não publicada" in lines[1] and "mensagem 3/10" in lines[2]
@@ -0,0 +1,63 @@
+"""frame das publicações (common/frame.py) contra os frames de referência de tests/fixtures/frames.json,
+os mesmos que server/test/frame.test.js confere no encodeFrame do servidor"""
+import json
+import os
+import msgpack
+import pytest
+from common import frame as wire
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "frames.json")
+
+with open(FIXTURE, encoding="utf-8") as source:
+    fixture = json.load(source)
+
+CASES = [pytest.param(case, id=case["name"]) for case in fixture["frames"]]
+
+@pytest.mark.parametrize("case", CASES)
+def test_encode_matches_golden_bytes(case):
+    payload = wire.encode(case["type"], case["topic"], case["clock"], case["seq"], case["data"], case["trace"])
+    assert payload.hex() == case["hex"]
+
+@pytest.mark.parametrize("case", CASES)
+def test_decode_golden_bytes(case):
+    payload = bytes.fromhex(case["hex"])
+    assert wire.is_frame(payload)
+    assert payload[0] == wire.MAGIC and payload[1] == case["type"]
+    kind, flags, channel, clock, seq, length = wire.header(payload)
+    assert (kind, channel, clock, seq) == (case["type"], wire.channel_id(case["topic"]), case["clock"], case["seq"])
+    # tamanho do corpo big-endian no offset 20
+    assert payload[20:24] == length.to_bytes(4, "big")
+    assert wire.body(payload, length) == case["data"]
+    assert wire.traced(payload) == bool(flags & wire.TRACED) == (case["trace"] is not None)
+    assert wire.trace_of(payload) == case["trace"]
+    expected = {"service": wire.SERVICES[case["type"]], "data": case["data"]}
+    if case["trace"] is not None:
+        expected["trace"] = case["trace"]
+    assert wire.decode(payload) == expected
+
+def test_envelope_is_not_a_frame():
+    envelope = msgpack.packb({"service": "publish", "data": fixture["frames"][0]["data"]})
+    assert not wire.is_frame(envelope)
+    assert not wire.is_frame(bytes.fromhex(fixture["frames"][0]["hex"])[:wire.HEADER.size - 1])
+
+def test_colliding_channel_is_counted_and_skipped(load_component):
+    """o id do cabeçalho bate com um canal de carga, mas o corpo é de outro canal"""
+    bot = load_component("bot")
+    load = bot.LoadTest()
+    try:
+        ours, theirs = fixture["collision"]
+        assert wire.channel_id(ours) == wire.channel_id(theirs)
+        load.channels = [ours[1:]]
+        load.channel_ids = {wire.channel_id(ours)}
+        load.channel_names = set(load.channels)
+        load.stats = {ours[1:]: bot.ChannelStats()}
+        # o canal certo passa pelo filtro sem contar colisão
+        own = wire.encode(wire.PUBLISH, ours, 1, 1, dict(fixture["frames"][0]["data"], channel=ours[1:]))
+        load.handle_publish(own)
+        assert "channel_id_collisions" not in load.metrics.snapshot()["counters"]
+        colliding = next(case for case in fixture["frames"] if case["topic"] == theirs)
+        assert load.handle_publish(bytes.fromhex(colliding["hex"])) == 0
+        assert load.metrics.snapshot()["counters"].get("channel_id_collisions") == 1
+        assert load.stats[ours[1:]].received == 0
+    finally:
+        load.context.term()
@@ -0,0 +1,111 @@
+"""proxy lvc: replay na inscrição e desinscrição sem replay"""
+import time
+from collections import OrderedDict
+import msgpack
+import pytest
+import zmq
+
+@pytest.fixture
+def lvc(load_component):
+    """LastValueCacheProxy com o XPUB num inproc e, no lugar do XSUB dos servidores, um PUB sem ninguém"""
+    module = load_component("proxy")
+    context = zmq.Context()
+    proxy = module.LastValueCacheProxy.__new__(module.LastValueCacheProxy)
+    proxy.backend = context.socket(zmq.XPUB)
+    proxy.backend.setsockopt(zmq.XPUB_MANUAL_LAST_VALUE, 1)
+    proxy.backend.bind("inproc://lvc-test")
+    proxy.frontend = context.socket(zmq.PUB)
+    proxy.frontend.bind("inproc://lvc-test-servers")
+    proxy.cache = OrderedDict()
+    proxy.cached_bytes = 0
+    proxy.evicted = 0
+    proxy.replayed = 0
+    sockets = []
+
+    def subscriber():
+        socket = context.socket(zmq.SUB)
+        socket.connect("inproc://lvc-test")
+        sockets.append(socket)
+        return socket
+
+    def pump():
+        """aplica as (des)inscrições pendentes no XPUB"""
+        while proxy.backend.poll(100):
+            proxy.handle_subscription(proxy.backend.recv())
+
+    proxy.test_subscriber = subscriber
+    proxy.test_pump = pump
+    yield proxy
+    for socket in sockets + [proxy.backend, proxy.frontend]:
+        socket.close(0)
+    context.term()
+
+def drain(socket):
+    messages = []
+    while socket.poll(100):
+        messages.append(socket.recv_multipart())
+    return messages
+
+def is_replay(frames):
+    try:
+        return msgpack.unpackb(frames[-1], raw=False).get("service") == "replay"
+    except Exception:
+        return False
+
+def test_unsubscribe_sends_no_replay_and_keeps_next_publication(lvc):
+    lvc.sent([b"#geral", b"antiga"])
+    first = lvc.test_subscriber()
+    second = lvc.test_subscriber()
+    first.setsockopt(zmq.SUBSCRIBE, b"#geral")
+    lvc.test_pump()
+    second.setsockopt(zmq.SUBSCRIBE, b"#geral")
+    lvc.test_pump()
+    for socket in (first, second):
+        replays = drain(socket)
+        assert len(replays) == 1 and is_replay(replays[0])
+        assert msgpack.unpackb(replays[0][-1], raw=False)["data"]["messages"] == [b"antiga"]
+
+    second.setsockopt(zmq.UNSUBSCRIBE, b"#geral")
+    lvc.test_pump()
+    time.sleep(0.05)
+    lvc.backend.send_multipart([b"#geral", b"nova"])
+
+    # quem ficou recebe a publicação seguinte (e nenhum replay); quem saiu não recebe nada
+    assert drain(first) == [[b"#geral", b"nova"]]
+    assert drain(second) == []
+
+def test_slow_subscriber_is_evicted_and_fast_one_kept(load_component):
+    module = load_component("proxy")
+    context = zmq.Context()
+    backend = context.socket(zmq.XPUB)
+    port = backend.bind_to_random_port("tcp://127.0.0.1")
+    metrics = module.Metrics("proxy-test")
+    slow = module.SlowSubscribers(backend, metrics, limit=16 * 1024, timeout=0.2)
+    subscribers = []
+    for lagging in (True, False):
+        subscriber = context.socket(zmq.SUB)
+        if lagging:
+            subscriber.setsockopt(zmq.RCVHWM, 10)
+            subscriber.setsockopt(zmq.RCVBUF, 16 * 1024)
+        subscriber.connect(f"tcp://127.0.0.1:{port}")
+        subscriber.setsockopt(zmq.SUBSCRIBE, b"#geral")
+        subscribers.append(subscriber)
+    lagging, reading = subscribers
+    try:
+        while backend.poll(500):
+            backend.recv()
+        deadline = time.time() + 10
+        while not metrics.snapshot()["counters"].get("slow_evictions") and time.time() < deadline:
+            for _ in range(50):
+                backend.send_multipart([b"#geral", b"x" * 512])
+            while reading.poll(5):
+                reading.recv_multipart()
+            slow.check(time.time())
+            time.sleep(0.01)
+        assert metrics.snapshot()["counters"].get("slow_evictions") == 1
+        # só o assinante que não lia caiu: o que lê continua acompanhado
+        assert len(slow.peers) == 1
+    finally:
+        for socket in subscribers + [slow.monitor, backend]:
+            socket.close(0)
+        context.term()
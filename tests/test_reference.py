@@ -0,0 +1,56 @@
+"""lista incremental do servidor de referência: versão + época"""
+import pytest
+
+@pytest.fixture
+def reference(load_component, tmp_path, monkeypatch):
+    module = load_component("reference")
+    monkeypatch.setattr(module, "REGISTRY_DIR", str(tmp_path))
+    monkeypatch.setattr(module, "BIND_ENDPOINT", "inproc://reference-test")
+    server = module.ReferenceServer()
+    yield server
+    server.registry.close()
+    server.router_socket.close()
+    server.context.term()
+
+def register(server, name):
+    server.handle_rank_request({"user": name, "timestamp": 0, "address": f"tcp://{name}:5570"})
+
+def list_servers(server, **data):
+    return server.handle_list_request(dict(data, timestamp=0))["data"]
+
+def test_same_epoch_and_since_gets_delta(reference):
+    register(reference, "server_a")
+    register(reference, "server_b")
+    first = list_servers(reference)
+    assert first["full"]
+    assert {entry["name"] for entry in first["list"]} == {"server_a", "server_b"}
+
+    register(reference, "server_c")
+    delta = list_servers(reference, since=first["version"], epoch=first["epoch"])
+    assert not delta["full"]
+    assert [entry["name"] for entry in delta["list"]] == ["server_c"]
+    assert delta["epoch"] == first["epoch"]
+
+    unchanged = list_servers(reference, since=delta["version"], epoch=delta["epoch"])
+    assert not unchanged["full"]
+    assert unchanged["list"] == [] and unchanged["removed"] == []
+
+def test_other_epoch_gets_full_list(reference):
+    register(reference, "server_a")
+    register(reference, "server_b")
+    current = list_servers(reference)
+
+    # `since` de outra instância (reiniciada), mesmo menor que a versão atual
+    stale = list_servers(reference, since=1, epoch=current["epoch"] ^ 1)
+    assert stale["full"]
+    assert len(stale["list"]) == 2
+
+    # sem época (cliente antigo): também recebe a lista completa
+    assert list_servers(reference, since=1)["full"]
+
+def test_unknown_services_share_one_histogram(load_component):
+    module = load_component("reference")
+    assert module.metric_service("list") == "list"
+    assert module.metric_service("error") == "error"
+    # nomes vindos do cliente não criam um histograma cada
+    assert {module.metric_service(name) for name in ("lixo", "x" * 100, ["lista"], None)} == {"unknown"}
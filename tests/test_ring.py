@@ -0,0 +1,74 @@
+"""anel de hash consistente (common/ring.py) e paridade com server/hashRing.js"""
+import json
+import os
+import shutil
+import subprocess
+import pytest
+from common.ring import HashRing, PARTITIONS, hash32, partition_of
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "ring.json")
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server")
+
+with open(FIXTURE, encoding="utf-8") as source:
+    fixture = json.load(source)
+
+def test_hash32_matches_fixture():
+    for text, expected in fixture["hash32"].items():
+        assert hash32(text) == expected, text
+
+def test_partitions_and_owners_match_fixture():
+    ring = HashRing(fixture["names"])
+    for case in fixture["keys"]:
+        assert partition_of(case["key"]) == case["partition"], case["key"]
+        for replicas, owners in case["owners"].items():
+            assert ring.owners_of(case["key"], int(replicas)) == owners, (case["key"], replicas)
+
+def test_partition_range():
+    partitions = {partition_of(f"#canal_{index}") for index in range(2000)}
+    assert min(partitions) >= 0 and max(partitions) < PARTITIONS
+    # com 2000 chaves todas as partições recebem alguma
+    assert len(partitions) == PARTITIONS
+
+def test_owners_are_distinct_and_capped():
+    ring = HashRing(["a", "b", "c"])
+    for partition in range(PARTITIONS):
+        owners = ring.owners(partition, 2)
+        assert len(owners) == 2 and len(set(owners)) == 2
+        # pedir mais réplicas que servidores devolve todos, sem repetir
+        assert sorted(ring.owners(partition, 5)) == ["a", "b", "c"]
+        # o primeiro dono não depende do fator de replicação
+        assert ring.owners(partition, 1) == owners[:1]
+    assert HashRing().owners(0, 3) == []
+
+def test_names_are_deduplicated_and_order_free():
+    assert HashRing(["b", "a", "b"]).names == ["a", "b"]
+    first = HashRing(["a", "b", "c"])
+    second = HashRing(["c", "a", "b"])
+    assert all(first.owners(partition, 2) == second.owners(partition, 2) for partition in range(PARTITIONS))
+
+def test_adding_a_server_only_moves_partitions_to_it():
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+    moved = 0
+    for partition in range(PARTITIONS):
+        old, new = before.owners(partition, 1)[0], after.owners(partition, 1)[0]
+        if old != new:
+            assert new == "d"
+            moved += 1
+    assert 0 < moved < PARTITIONS
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node não instalado")
+def test_hash_ring_js_agrees():
+    """as mesmas chaves no server/hashRing.js, pelo node, chegam às mesmas partições e donos"""
+    names = ["server_a", "server_b", "server_c", "3f2a9c1d7e4b", "server_d"]
+    keys = [f"#canal_{index}" for index in range(200)] + [f"@usuario_{index}" for index in range(200)]
+    script = (
+        "const { HashRing, partitionOf, streamFor } = require('./hashRing');"
+        "const [names, keys] = JSON.parse(require('fs').readFileSync(0, 'utf8'));"
+        "const ring = new HashRing(names);"
+        "console.log(JSON.stringify(keys.map(key => [partitionOf(key), ring.ownersOf(streamFor(key, 3))])));"
+    )
+    result = subprocess.run(["node", "-e", script], cwd=SERVER, input=json.dumps([names, keys]),
+                            capture_output=True, text=True, check=True)
+    ring = HashRing(names)
+    assert json.loads(result.stdout) == [[partition_of(key), ring.owners_of(key, 3)] for key in keys]